@@ -0,0 +1,82 @@
+"""Time the match analytics over a day of synthetic match logs.
+
+Writes --matches logs of --races races each, 8 players racing to 50 with
+random reaction times and a 10 % miss rate (what a busy event night with
+the lobby records), then loads them all and computes every metric of
+analytics.py, timing each step. Needs NumPy.
+
+Run from the repository root:  python benchmarks/bench_analytics.py --matches 2000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "myapp"))
+
+import numpy as np  # noqa: E402
+from analytics import RECORD_DTYPE, Presses, load  # noqa: E402
+from matchlog import HEADER, MAGIC, RECORD, VERSION, COUNT, JOIN, MAX, MISSED, START  # noqa: E402
+
+PLAYERS = 8
+MAX_SCORE = 50
+
+
+def synthetic_log(path: str, n_races: int, rng: np.random.Generator) -> None:
+    """A log of n_races races, every player pressing until it reaches MAX_SCORE."""
+    rows = [(0, JOIN, player_id, 0) for player_id in range(1, PLAYERS + 1)] + [(0, MAX, 0, MAX_SCORE)]
+    now = 1_000_000
+    for _ in range(n_races):
+        rows.append((now, START, 0, 0))
+        presses = int(MAX_SCORE / 0.9) + 5
+        reaction = rng.gamma(4, 60_000, size=(PLAYERS, presses)).astype(np.int64)
+        times = now + np.cumsum(reaction, axis=1)
+        hits = rng.random((PLAYERS, presses)) > 0.1
+        counts = np.cumsum(hits, axis=1)
+        for player in range(PLAYERS):
+            keep = counts[player] <= MAX_SCORE
+            for t, hit, count in zip(times[player][keep], hits[player][keep], counts[player][keep]):
+                rows.append((t, COUNT if hit else MISSED, player + 1, count if hit else 0))
+        now = int(times.max()) + 5_000_000
+    records = np.array(rows, dtype=np.int64)
+    records = records[np.argsort(records[:, 0], kind="stable")]
+    out = np.zeros(len(records), RECORD_DTYPE)
+    out["time_us"], out["event"], out["player_id"], out["value"] = records.T
+    with open(path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION, RECORD.size, time.time_ns() // 1000))
+        out.tofile(file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Match analytics benchmark")
+    parser.add_argument("--matches", type=int, default=2000, help="logs to analyze")
+    parser.add_argument("--races", type=int, default=3, help="races per log")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(1)
+    with tempfile.TemporaryDirectory() as directory:
+        paths = [os.path.join(directory, f"match{i}.taplog") for i in range(args.matches)]
+        for path in paths:
+            synthetic_log(path, args.races, rng)
+        size = sum(os.path.getsize(path) for path in paths)
+        print(f"{args.matches} logs, {size / 2**20:.1f} MB")
+
+        start = time.perf_counter()
+        records, matches = load(paths)
+        loaded = time.perf_counter()
+        presses = Presses(records, matches)
+        grouped = time.perf_counter()
+        presses.taps_per_second()
+        np.histogram(presses.intervals_us(), bins=50)
+        presses.reaction_us()
+        presses.per_player()
+        done = time.perf_counter()
+        print(f"load {len(records)} records: {(loaded - start) * 1000:.0f} ms")
+        print(f"group {len(presses)} presses:  {(grouped - loaded) * 1000:.0f} ms")
+        print(f"metrics:            {(done - grouped) * 1000:.0f} ms")
+        print(f"total:              {done - start:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Time from the start button to the first frame rendered on the game screen.
+
+Runs the real app (a window is needed) and presses start --rounds times,
+timing on_start_btn() up to the first frame flipped with screen B current,
+then goes back home. The first round builds what is built on first use, the
+next ones show the cost of a game start with everything reused.
+
+With --players N the app hosts a game and N headless binary clients join it
+first, so the scoreboard gets N rows; between rounds the screen is switched
+back directly, the server keeps running. Without it the rounds are single
+player games started and ended through on_back_home().
+
+Run from the repository root:  python benchmarks/bench_game_start.py --players 50
+"""
+import argparse
+import os
+import socket
+import sys
+import time
+
+MYAPP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "myapp")
+sys.path.insert(0, MYAPP)
+os.chdir(MYAPP)     # layout.kv and the fonts are loaded relative to myapp
+os.environ["KIVY_NO_ARGS"] = "1"    # The options below are ours, not Kivy's
+
+from kivy.clock import Clock  # noqa: E402
+from kivy.core.window import Window  # noqa: E402
+from main import MainApp  # noqa: E402
+from protocol import HELLO  # noqa: E402
+
+
+class BenchApp(MainApp):
+    """MainApp pressing start and timing the first frame of screen B."""
+    def __init__(self, args, **kwargs):
+        super().__init__(**kwargs)
+        self.args = args
+        self.clients: list[socket.socket] = []
+        self.times: list[float] = []
+        self.pressed_at: float | None = None
+
+    def on_start(self):
+        super().on_start()
+        Window.bind(on_flip=self.on_frame)
+        if self.args.players:
+            self.start_server()
+            port = self.server.server.getsockname()[1]
+            for _ in range(self.args.players):
+                client = socket.create_connection(("127.0.0.1", port))
+                client.sendall(HELLO)
+                self.clients.append(client)
+        Clock.schedule_once(self.press_start, 1)
+
+    def press_start(self, dt):
+        if self.server and len(self.server.players) < self.args.players:
+            Clock.schedule_once(self.press_start, .1)     # Wait for every client to join
+            return
+        self.pressed_at = time.perf_counter()
+        self.on_start_btn()
+
+    def on_frame(self, window):
+        if self.pressed_at is None or self.root.current != "screen B":
+            return
+        self.times.append(time.perf_counter() - self.pressed_at)
+        self.pressed_at = None
+        Clock.schedule_once(self.go_home, .5)
+
+    def go_home(self, dt):
+        if self.server:
+            self.root.current = "screen A"
+        else:
+            self.on_back_home()
+        if len(self.times) < self.args.rounds:
+            Clock.schedule_once(self.press_start, .5)
+        else:
+            self.on_exit()
+
+    def on_stop(self):
+        for client in self.clients:
+            client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tap Race game start benchmark")
+    parser.add_argument("--players", type=int, default=0, help="clients joining a hosted game (0: single player)")
+    parser.add_argument("--rounds", type=int, default=10)
+    args = parser.parse_args()
+
+    app = BenchApp(args)
+    app.run()
+
+    times = [t * 1000 for t in app.times]
+    warm = sorted(times[1:]) or times
+    print(f"first start:  {times[0]:.1f} ms (builds on first use)")
+    print(f"next starts:  median {warm[len(warm) // 2]:.1f} ms, max {warm[-1]:.1f} ms ({len(warm)} rounds)")
+
+
+if __name__ == "__main__":
+    main()
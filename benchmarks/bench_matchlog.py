@@ -0,0 +1,88 @@
+"""Cost of recording a tap to the match log, and speed of scanning and seeking logs.
+
+Records --events COUNT events through a MatchRecorder (what Server.update_score
+pays per accepted tap, the disk writes happen on the writer thread), then
+writes --logs logs of a typical race and scans them all with summary(), and
+times seeks into the big log.
+
+Run from the repository root:  python benchmarks/bench_matchlog.py
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "myapp"))
+
+import matchlog  # noqa: E402
+from matchlog import COUNT, JOIN, MAX, START, WIN, MatchLog, MatchRecorder, summary  # noqa: E402
+from netloop import EventLoop  # noqa: E402
+
+
+def record(path: str, n_events: int) -> float:
+    """Seconds per recorded event."""
+    loop = EventLoop()
+    recorder = MatchRecorder(path, loop)
+    start = time.perf_counter()
+    for i in range(n_events):
+        recorder.add(COUNT, i % 8 + 1, i // 8)
+    elapsed = time.perf_counter() - start
+    recorder.close()
+    matchlog.drain()
+    loop.close()
+    return elapsed / n_events
+
+
+def race(path: str, loop: EventLoop) -> None:
+    """A race of 8 players to 50."""
+    recorder = MatchRecorder(path, loop)
+    for player_id in range(1, 9):
+        recorder.add(JOIN, player_id)
+    recorder.add(MAX, 0, 50)
+    recorder.add(START)
+    for count in range(1, 51):
+        for player_id in random.sample(range(1, 9), 8):
+            recorder.add(COUNT, player_id, count)
+    recorder.add(WIN, 1)
+    recorder.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Match log benchmark")
+    parser.add_argument("--events", type=int, default=1_000_000)
+    parser.add_argument("--logs", type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        big = os.path.join(directory, "big.taplog")
+        per_event = record(big, args.events)
+        print(f"record: {per_event * 1e9:.0f} ns per event, {os.path.getsize(big) / args.events:.0f} bytes per event")
+
+        log = MatchLog(big)
+        start = time.perf_counter()
+        for _ in range(1000):
+            log.seek(random.randrange(log.duration_us))
+        print(f"seek in {len(log)} events: {(time.perf_counter() - start) * 1000:.1f} us per seek")
+        log.close()
+
+        loop = EventLoop()
+        paths = [os.path.join(directory, f"race{i}.taplog") for i in range(args.logs)]
+        for path in paths:
+            race(path, loop)
+        matchlog.drain()
+        loop.close()
+        size = sum(os.path.getsize(path) for path in paths)
+        start = time.perf_counter()
+        for path in paths:
+            log = MatchLog(path)
+            summary(log)
+            log.close()
+        elapsed = time.perf_counter() - start
+        print(f"scan {args.logs} races ({size / args.logs / 1024:.1f} kB each): {elapsed * 1000:.0f} ms, "
+              f"{elapsed / args.logs * 1e6:.0f} us per race")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Per-tap cost of the network logging at each netlog level, against print().
+
+Every simulated tap goes through the same logging as MainApp.on_press and
+Server.receive_data/broadcast (three messages). print() writes to /dev/null
+here, so on a phone (synchronous logcat) it only gets worse.
+
+Run from the repository root:  python benchmarks/bench_netlog.py
+"""
+import contextlib
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "myapp"))
+
+import netlog  # noqa: E402
+from protocol import COUNT  # noqa: E402
+
+N_TAPS = 200_000
+
+
+def baseline() -> None:
+    for i in range(N_TAPS):
+        message = (COUNT, 2, i, i)
+
+
+def with_print() -> None:
+    for i in range(N_TAPS):
+        message = (COUNT, 2, i, i)
+        print(f"To Server: {message}")
+        print(f"msg from client: {message}")
+        print(f"Broadcasting: {message}")
+
+
+def with_netlog() -> None:
+    for i in range(N_TAPS):
+        message = (COUNT, 2, i, i)
+        if netlog.level:
+            netlog.message("to server", message)
+        if netlog.level:
+            netlog.message("from client", message)
+        if netlog.level:
+            netlog.message("broadcast", message)
+
+
+def run(name: str, func) -> float:
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    return elapsed / N_TAPS * 1e9
+
+
+if __name__ == "__main__":
+    base = run("baseline", baseline)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        results = [("print() to /dev/null", run("print", with_print))]
+        for name in netlog.LEVELS:
+            netlog.set_level(name)
+            results.append((f"netlog {name}", run(name, with_netlog)))
+        netlog.set_level("off")
+        time.sleep(0.5)         # Let the writer drain before stdout is restored
+
+    print(f"{'baseline loop':<22} {base:>8.1f} ns/tap")
+    for name, ns in results:
+        print(f"{name:<22} {ns - base:>8.1f} ns/tap overhead")
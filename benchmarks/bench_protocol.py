@@ -0,0 +1,58 @@
+"""Frames/sec of the legacy '&'-split parser against protocol.FrameDecoder.
+
+Run from the repository root:  python benchmarks/bench_protocol.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "myapp"))
+
+from protocol import COUNT, FrameDecoder, encode, encode_legacy  # noqa: E402
+
+N_FRAMES = 200_000
+CHUNK = 1024
+
+
+def chunks(data: bytes) -> list[bytes]:
+    return [data[i:i + CHUNK] for i in range(0, len(data), CHUNK)]
+
+
+def legacy_parser(stream: list[bytes]) -> int:
+    """The original receive_data + process_message parsing of COUNT messages."""
+    n = 0
+    for chunk in stream:
+        for msg in chunk.decode('ascii').split('&')[:-1]:
+            if msg.startswith('COUNT'):
+                idx = int(msg[7]) - 1
+                count = int(msg[10:])
+                n += 1
+    return n
+
+
+def frame_decoder(stream: list[bytes], binary: bool) -> int:
+    decoder = FrameDecoder()
+    decoder.binary = binary
+    n = 0
+    for chunk in stream:
+        decoder.feed(chunk)
+        n += len(decoder.messages())
+    return n
+
+
+def run(name: str, func, *args) -> None:
+    start = time.perf_counter()
+    n = func(*args)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<28} {n:>8} frames  {n / elapsed:>12,.0f} frames/s")
+
+
+if __name__ == "__main__":
+    messages = [(COUNT, i % 6 + 1, i % 100, i) for i in range(N_FRAMES)]
+    legacy = b"".join(encode_legacy(m) for m in messages)
+    binary = b"".join(encode(m) for m in messages)
+    print(f"wire size: legacy {len(legacy)} bytes, binary {len(binary)} bytes")
+
+    run("legacy split parser", legacy_parser, chunks(legacy))
+    run("FrameDecoder (ASCII peer)", frame_decoder, chunks(legacy), False)
+    run("FrameDecoder (binary)", frame_decoder, chunks(binary), True)
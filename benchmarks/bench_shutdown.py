@@ -0,0 +1,61 @@
+"""Shutdown latency and idle wakeups of the headless Server.
+
+Starts a Server on localhost with --clients binary clients connected, lets it
+sit idle and counts how many times its event loop woke up (reported per
+minute, 0 is the goal), then measures how long close_connection() takes to
+disconnect everybody and join the network thread. Repeated --rounds times.
+
+Run from the repository root:  python benchmarks/bench_shutdown.py
+"""
+import argparse
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "myapp"))
+
+from protocol import HELLO  # noqa: E402
+from server import Server  # noqa: E402
+
+
+def one_round(n_clients: int, idle: float) -> tuple[float, float]:
+    """Return (idle wakeups per minute, shutdown seconds) for one server."""
+    server = Server(ip_addr="127.0.0.1", port=0)
+    server.start_server()
+    port = server.server.getsockname()[1]
+    clients = [socket.create_connection(("127.0.0.1", port)) for _ in range(n_clients)]
+    for client in clients:
+        client.sendall(HELLO)
+    while len(server.players) < n_clients:
+        time.sleep(0.01)
+    time.sleep(0.1)     # Let the joins and handshakes settle
+
+    wakeups = server.loop.wakeups
+    time.sleep(idle)
+    per_minute = (server.loop.wakeups - wakeups) * 60 / idle
+
+    start = time.perf_counter()
+    server.close_connection(close_clients=True)
+    elapsed = time.perf_counter() - start
+    for client in clients:
+        client.close()
+    return per_minute, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tap Race shutdown and idle benchmark")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--idle", type=float, default=3, help="seconds of idle time to watch per round")
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    results = [one_round(args.clients, args.idle) for _ in range(args.rounds)]
+    wakeups = [w for w, _ in results]
+    shutdowns = sorted(s * 1000 for _, s in results)
+    print(f"idle wakeups:     {max(wakeups):.1f}/min (worst round, {args.clients} clients)")
+    print(f"shutdown latency: median {shutdowns[len(shutdowns) // 2]:.2f} ms, max {shutdowns[-1]:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Server cost per tap: one COUNT frame per tap against TAPS batches checked on the button sequence.
+
+Decodes --taps taps sent as COUNT frames, then as TAPS batches of --batch
+presses (what a client sends every 30 ms while tapping), and checks every
+batch against the race's ButtonSequence the way Server.receive_taps does.
+
+Run from the repository root:  python benchmarks/bench_taps.py
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "myapp"))
+
+from protocol import COUNT, TAPS, FrameDecoder, encode  # noqa: E402
+from sequence import ButtonSequence  # noqa: E402
+
+CHUNK = 1024
+
+
+def decode(data: bytes) -> list[tuple]:
+    decoder = FrameDecoder()
+    decoder.binary = True
+    messages = []
+    for i in range(0, len(data), CHUNK):
+        decoder.feed(data[i:i + CHUNK])
+        messages += decoder.messages()
+    return messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tap batch validation benchmark")
+    parser.add_argument("--taps", type=int, default=200_000)
+    parser.add_argument("--batch", type=int, default=4, help="presses per TAPS batch")
+    args = parser.parse_args()
+
+    sequence = ButtonSequence(12345, args.taps)
+    buttons = bytes(sequence.buttons[:args.taps])
+    tap_times = [i * 100_000 & 0xFFFFFFFF for i in range(args.taps)]
+    counts = b"".join(encode((COUNT, 1, i + 1, tap_times[i])) for i in range(args.taps))
+    batches = b"".join(encode((TAPS, sequence.seed, i, buttons[i:i + args.batch],
+                               tuple(tap_times[i:i + args.batch]))) for i in range(0, args.taps, args.batch))
+    print(f"wire size: COUNT {len(counts)} bytes, TAPS {len(batches)} bytes")
+
+    start = time.perf_counter()
+    decode(counts)
+    elapsed = time.perf_counter() - start
+    print(f"COUNT per tap:        {elapsed / args.taps * 1e9:6.0f} ns per tap")
+
+    # A fresh sequence, generated ahead as the server does at the start
+    sequence = ButtonSequence(sequence.seed, args.taps)
+    start = time.perf_counter()
+    hits = 0
+    for _, seed, first, pressed, times in decode(batches):
+        hits += sequence.hits(first, pressed)
+    elapsed = time.perf_counter() - start
+    assert hits == args.taps
+    print(f"TAPS checked, by {args.batch}: {elapsed / args.taps * 1e9:6.0f} ns per tap")
+
+
+if __name__ == "__main__":
+    main()
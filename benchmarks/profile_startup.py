@@ -0,0 +1,117 @@
+"""Cold start report of the app: import times and time to the first frame.
+
+Every run is a fresh process (a warm interpreter would hide the imports):
+    1. python -X importtime on `import main`, the --top slowest modules by
+       cumulative import time are listed, and the game-only modules among them
+    2. --runs starts of the real app (a window is needed), each timing the
+       process start to main imported, MainApp built, and the first frame
+       flipped, then quitting; with --cprofile the startup of the last run
+       is profiled up to the first frame
+
+To compare with an older version, run it from a checkout of that version.
+
+Run from the repository root:  python benchmarks/profile_startup.py --runs 5
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+START = time.perf_counter()
+MYAPP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "myapp")
+# Modules the game screens need but screen A should not wait for
+LATE_MODULES = ("host", "client", "server", "netifaces", "kivymd.uix.dialog", "kivymd.uix.menu")
+
+
+def import_report(top: int) -> None:
+    env = dict(os.environ, KIVY_NO_ARGS="1", KIVY_NO_CONSOLELOG="1")
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"],
+                            cwd=MYAPP, env=env, capture_output=True, text=True)
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append((int(cumulative_us), int(self_us), name.strip()))
+    main_us = next((us for us, _, name in modules if name == "main"), 0)
+    print(f"import main: {main_us / 1000:.1f} ms")
+    for cumulative_us, self_us, name in sorted(modules, reverse=True)[1:top + 1]:
+        print(f"  {cumulative_us / 1000:8.1f} ms cumulative {self_us / 1000:8.1f} ms self  {name}")
+    loaded = {name for _, _, name in modules}
+    early = [name for name in LATE_MODULES if name in loaded]
+    print(f"imported before screen A but only needed later: {', '.join(early) or 'none'}")
+
+
+def child(profile: bool) -> None:
+    """One app start, reports its times on stdout and quits after the first frame."""
+    sys.path.insert(0, MYAPP)
+    os.chdir(MYAPP)
+    os.environ["KIVY_NO_ARGS"] = "1"
+    profiler = None
+    if profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    from kivy.core.window import Window
+    from main import MainApp
+    imported = time.perf_counter()
+
+    class StartupApp(MainApp):
+        def on_start(self):
+            super().on_start()
+            Window.bind(on_flip=self.on_frame)
+
+        def on_frame(self, window):
+            Window.unbind(on_flip=self.on_frame)
+            first_frame = time.perf_counter()
+            if profiler:
+                profiler.disable()
+                profiler.print_stats("cumulative")
+            print(f"STARTUP {imported - START:.4f} {built - START:.4f} {first_frame - START:.4f}")
+            self.stop()
+
+    app = StartupApp()
+    built = time.perf_counter()
+    app.run()
+
+
+def startup_report(runs: int, profile: bool) -> None:
+    env = dict(os.environ, KIVY_NO_CONSOLELOG="1")
+    times = []
+    for run in range(runs):
+        command = [sys.executable, os.path.abspath(__file__), "--child"]
+        command += ["--cprofile"] if profile and run == runs - 1 else []
+        output = subprocess.run(command, env=env, capture_output=True, text=True).stdout
+        for line in output.splitlines():
+            if line.startswith("STARTUP "):
+                times.append([float(t) * 1000 for t in line.split()[1:]])
+            elif profile and run == runs - 1:
+                print(line)
+    if not times:
+        print("the app did not start (no display?)")
+        return
+    for label, column in (("main imported", 0), ("MainApp built", 1), ("first frame", 2)):
+        values = sorted(t[column] for t in times)
+        print(f"{label + ':':15} median {values[len(values) // 2]:7.1f} ms, max {values[-1]:7.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tap Race cold start report")
+    parser.add_argument("--runs", type=int, default=5, help="app starts to time (0: imports only)")
+    parser.add_argument("--top", type=int, default=15, help="slowest imports to list")
+    parser.add_argument("--cprofile", action="store_true", help="profile the startup of the last run")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.cprofile)
+        return
+    import_report(args.top)
+    if args.runs:
+        startup_report(args.runs, args.cprofile)
+
+
+if __name__ == "__main__":
+    main()
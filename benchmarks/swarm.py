@@ -0,0 +1,244 @@
+"""Headless client swarm: load a localhost server with thousands of simulated players.
+
+Every player speaks the Client protocol without Kivy: it gets its nickname,
+follows NPLAYERS and the score stream (COUNT or SNAPSHOT) and taps with a
+configurable rate and jitter: COUNT, or TAPS on the highlighted buttons once
+a race has a button sequence (SEED). Races go to --race-length (at most the
+server's SCORE_LIMIT): on WINNER the player who set the max score sends
+RESET, like a finished race. A REJECT puts a player back on the score the
+server kept. With --churn players leave (CLOSED_BY_CLIENT) and new ones join.
+
+Examples, from the repository root:
+    python benchmarks/swarm.py --spawn lobby --players 2000 --room-size 8
+    python benchmarks/swarm.py --spawn server --players 50 --duration 10
+
+The report gives taps/sec processed by the server (taps echoed back to their
+player), broadcast fan-out (score updates received by all players per second)
+and p50/p95/p99 tap-to-echo latency.
+"""
+import argparse
+import asyncio
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "myapp"))
+
+from protocol import (  # noqa: E402
+    HELLO, NICKNAME, MAX_SCORE, COUNT, SNAPSHOT, RESET, CLOSED_BY_CLIENT, JOIN_ROOM, SEED, TAPS, WINNER,
+    REJECT, FrameDecoder, encode,
+)
+from sequence import ButtonSequence  # noqa: E402
+from server import SCORE_LIMIT  # noqa: E402
+
+
+class Stats:
+    """Counters shared by all simulated players."""
+    def __init__(self):
+        self.taps_sent = 0
+        self.taps_echoed = 0
+        self.taps_rejected = 0
+        self.updates_received = 0
+        self.joins = 0
+        self.leaves = 0
+        self.errors = 0
+        self.latencies: list[float] = []
+
+
+class Player:
+    """One simulated player."""
+    def __init__(self, args, room: str, sets_max_score: bool, stats: Stats):
+        self.args = args
+        self.room = room
+        self.sets_max_score = sets_max_score
+        self.stats = stats
+        self.player_id: int | None = None
+        self.count = 0
+        self.sequence: ButtonSequence | None = None
+        self.presses = 0
+        self.sent_at: dict[int, float] = {}     # Count -> time it was sent
+        self.writer: asyncio.StreamWriter | None = None
+
+    async def run(self, stop_at: float):
+        reader, self.writer = await asyncio.open_connection(self.args.host, self.args.port)
+        self.writer.write(HELLO + encode((JOIN_ROOM, self.room)))
+        self.stats.joins += 1
+        receiving = asyncio.create_task(self.receive(reader))
+        try:
+            await self.tap(stop_at)
+        finally:
+            receiving.cancel()
+            if not self.writer.is_closing():
+                self.writer.write(encode((CLOSED_BY_CLIENT,)))
+                self.writer.close()
+            self.stats.leaves += 1
+
+    async def tap(self, stop_at: float):
+        args = self.args
+        leave_at = time.monotonic() + random.expovariate(args.churn) if args.churn else stop_at
+        while self.player_id is None:
+            if time.monotonic() > stop_at:
+                return
+            await asyncio.sleep(0.01)
+        if self.sets_max_score:
+            self.writer.write(encode((MAX_SCORE, self.race_length)))
+
+        while time.monotonic() < min(stop_at, leave_at):
+            interval = 1 / args.tap_rate
+            await asyncio.sleep(interval * random.uniform(1 - args.jitter, 1 + args.jitter))
+            if self.count >= self.race_length:
+                continue    # Waiting for the next race
+            self.count += 1
+            self.sent_at[self.count] = time.perf_counter()
+            if self.sequence:
+                button = bytes([self.sequence[self.presses]])
+                self.writer.write(encode((TAPS, self.sequence.seed, self.presses, button, (0,))))
+                self.presses += 1
+            else:
+                self.writer.write(encode((COUNT, self.player_id, self.count, 0)))
+            self.stats.taps_sent += 1
+
+    @property
+    def race_length(self) -> int:
+        return min(self.args.race_length or SCORE_LIMIT, SCORE_LIMIT)
+
+    async def receive(self, reader: asyncio.StreamReader):
+        decoder = FrameDecoder()
+        try:
+            while data := await reader.read(65536):
+                decoder.feed(data)
+                for msg in decoder.messages():
+                    self.process_message(msg)
+        except (ConnectionError, OSError):
+            self.stats.errors += 1
+
+    def process_message(self, msg: tuple):
+        kind = msg[0]
+        if kind == NICKNAME:
+            self.player_id = msg[1]
+        elif kind == COUNT:
+            self.update_score(msg[1], msg[2])
+        elif kind == SNAPSHOT:
+            for player_id, count, _ in msg[1]:
+                self.update_score(player_id, count)
+        elif kind == SEED:
+            self.sequence = ButtonSequence(msg[1])
+            self.presses = 0
+        elif kind == RESET:
+            self.count = 0
+            self.sent_at.clear()
+        elif kind == WINNER:
+            if self.sets_max_score:
+                self.writer.write(encode((RESET,)))
+        elif kind == REJECT:
+            # Back to the score the server kept, the taps above it were processed all the same
+            self.count = msg[1]
+            for count in [count for count in self.sent_at if count > msg[1]]:
+                del self.sent_at[count]
+                self.stats.taps_rejected += 1
+
+    def update_score(self, player_id: int, count: int):
+        self.stats.updates_received += 1
+        if player_id != self.player_id or not self.sent_at:
+            return
+        now = time.perf_counter()
+        for sent in [c for c in self.sent_at if c <= count]:
+            self.stats.latencies.append(now - self.sent_at.pop(sent))
+            self.stats.taps_echoed += 1
+
+
+async def spawn_players(args, stats: Stats, stop_at: float):
+    """Start the players gradually, replace the ones that leave (churn)."""
+    tasks = set()
+    n_rooms = max(1, args.players // args.room_size)
+    joined = 0
+
+    def start(index: int):
+        room = f"r{index % n_rooms}"
+        player = Player(args, room, index < n_rooms, stats)
+        task = asyncio.create_task(player.run(stop_at))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    for joined in range(args.players):
+        start(joined)
+        if joined % 100 == 99:
+            await asyncio.sleep(0.05)      # Do not hit the accept backlog all at once
+
+    while time.monotonic() < stop_at:
+        await asyncio.sleep(0.1)
+        # Keep the population steady when players churn
+        while len(tasks) < args.players and time.monotonic() < stop_at:
+            joined += 1
+            start(joined)
+
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def percentile(values: list[float], p: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000 if values else float("nan")
+
+
+def report(stats: Stats, elapsed: float):
+    latencies = sorted(stats.latencies)
+    print(f"players joined/left:     {stats.joins}/{stats.leaves} ({stats.errors} errors)")
+    print(f"taps sent:               {stats.taps_sent} ({stats.taps_sent / elapsed:,.0f}/s)")
+    print(f"taps processed (echoed): {stats.taps_echoed} ({stats.taps_echoed / elapsed:,.0f}/s), "
+          f"{stats.taps_rejected} rejected")
+    print(f"broadcast fan-out:       {stats.updates_received} updates ({stats.updates_received / elapsed:,.0f}/s)")
+    print(f"tap-to-echo latency:     p50 {percentile(latencies, .50):.2f} ms  "
+          f"p95 {percentile(latencies, .95):.2f} ms  p99 {percentile(latencies, .99):.2f} ms")
+
+
+def spawn_server(args) -> subprocess.Popen | None:
+    """Start a localhost server or lobby to test against."""
+    if args.spawn == "none":
+        return None
+    myapp = os.path.join(os.path.dirname(__file__), "..", "myapp")
+    command = [sys.executable, "-m", args.spawn, "--port", str(args.port), "--tick-rate", str(args.tick_rate)]
+    process = subprocess.Popen(command, cwd=myapp, stdout=subprocess.DEVNULL)
+    time.sleep(1)
+    return process
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tap Race load generator")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=55555)
+    parser.add_argument("--spawn", choices=["none", "server", "lobby"], default="none",
+                        help="start a localhost server (python -m server) or lobby first")
+    parser.add_argument("--tick-rate", type=int, default=30, help="tick rate of the spawned server")
+    parser.add_argument("--players", type=int, default=100)
+    parser.add_argument("--room-size", type=int, default=8, help="players per room (lobby only)")
+    parser.add_argument("--tap-rate", type=float, default=6, help="taps per second per player")
+    parser.add_argument("--jitter", type=float, default=0.3, help="relative jitter of the tap interval")
+    parser.add_argument("--churn", type=float, default=0, help="leaves per second per player")
+    parser.add_argument("--race-length", type=int, default=0,
+                        help=f"score that ends a race (0: the server's limit, {SCORE_LIMIT})")
+    parser.add_argument("--duration", type=float, default=10)
+    args = parser.parse_args()
+
+    # Thousands of sockets need a higher open files limit
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    try:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ValueError, OSError):
+        pass
+
+    server = spawn_server(args)
+    stats = Stats()
+    start = time.monotonic()
+    try:
+        asyncio.run(spawn_players(args, stats, start + args.duration))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+    report(stats, time.monotonic() - start)
+
+
+if __name__ == "__main__":
+    main()
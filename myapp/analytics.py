@@ -0,0 +1,168 @@
+"""Post-match analytics over the match logs, vectorized with NumPy.
+
+Every log of a batch is read into one structured array (one row per record,
+with the number of its log), then every metric is a handful of array
+operations over all the matches at once, no Python loop per event:
+    taps per second     accepted taps of each player in each second of a race
+    inter-tap interval  time between two accepted taps of a player
+    reaction time       time from the highlight to the press: a new button is
+                        highlighted right after every press, and at the start
+    miss rate           presses on a button that was not highlighted, per press
+
+Times are the server receive times of the log, so for the players on other
+phones they include the network jitter (a few ms on a LAN).
+
+NumPy is only needed here, not by the app or the server. Run from the myapp
+directory:
+    python -m analytics logs/*.taplog [--export presses.npz | presses.parquet]
+"""
+import argparse
+import time
+import numpy as np
+from matchlog import HEADER, MAGIC, RECORD, VERSION, COUNT, MISSED, START
+
+# One match log record (matchlog.RECORD)
+RECORD_DTYPE = np.dtype([("time_us", "<u8"), ("event", "u1"), ("pad", "u1"), ("player_id", "<u2"),
+                         ("value", "<u4")])
+assert RECORD_DTYPE.itemsize == RECORD.size
+
+INTERVAL_BINS_MS = np.geomspace(20, 5000, 25)     # Log-spaced, fast tappers and idle players alike
+
+
+def load(paths: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    """Records of every log and the number of the log of each record (logs that are not are skipped)."""
+    chunks, match_ids = [], []
+    for match, path in enumerate(paths):
+        try:
+            with open(path, "rb") as file:
+                magic, version, record_size, _ = HEADER.unpack(file.read(HEADER.size))
+                if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+                    raise ValueError("not a match log")
+                records = np.fromfile(file, dtype=RECORD_DTYPE)
+        except (OSError, ValueError) as e:
+            print(f"{path}: {e}")
+            continue
+        chunks.append(records)
+        match_ids.append(np.full(len(records), match, dtype=np.uint32))
+    if not chunks:
+        return np.empty(0, RECORD_DTYPE), np.empty(0, np.uint32)
+    return np.concatenate(chunks), np.concatenate(match_ids)
+
+
+class Presses:
+    """Every press during a race, ordered by race, player and time (columns)."""
+    def __init__(self, records: np.ndarray, matches: np.ndarray):
+        event = records["event"]
+        # A race runs from a START to the next one or the end of its log
+        new_match = np.r_[True, matches[1:] != matches[:-1]] if len(matches) else np.empty(0, bool)
+        segment = np.cumsum((event == START) | new_match) - 1
+        segment_first = np.flatnonzero(np.r_[True, segment[1:] != segment[:-1]]) if len(segment) else segment
+        is_race = event[segment_first] == START
+        race_start = records["time_us"][segment_first]
+
+        pressed = np.flatnonzero(((event == COUNT) | (event == MISSED)) & is_race[segment])
+        key = segment[pressed] << 16 | records["player_id"][pressed]
+        order = np.argsort(key, kind="stable")      # Time order is kept inside a race and player
+        pressed = pressed[order]
+
+        self.key = key[order]
+        self.race = self.key >> 16
+        self.player_id = self.key & 0xFFFF
+        self.match = matches[pressed]
+        self.hit = event[pressed] == COUNT
+        self.t_us = (records["time_us"][pressed] - race_start[self.race]).astype(np.int64)
+        self.first = np.r_[True, self.key[1:] != self.key[:-1]] if len(self.key) else np.empty(0, bool)
+        self.n_races = int(is_race.sum())
+
+    def __len__(self) -> int:
+        return len(self.t_us)
+
+    def reaction_us(self) -> np.ndarray:
+        """Time from the highlight (race start or previous press) to each press."""
+        previous = np.r_[0, self.t_us[:-1]]
+        return self.t_us - np.where(self.first, 0, previous)
+
+    def intervals_us(self) -> np.ndarray:
+        """Time between two accepted taps of the same player in the same race."""
+        t, key = self.t_us[self.hit], self.key[self.hit]
+        same = key[1:] == key[:-1]
+        return np.diff(t)[same]
+
+    def taps_per_second(self) -> dict[str, np.ndarray]:
+        """Accepted taps of each player in each second of each race (rows only where there are taps)."""
+        seconds = self.t_us[self.hit] // 1_000_000
+        keys, taps = np.unique(self.key[self.hit] << 16 | seconds, return_counts=True)
+        return {"race": keys >> 32, "player_id": (keys >> 16) & 0xFFFF, "second": keys & 0xFFFF, "taps": taps}
+
+    def per_player(self) -> dict[str, np.ndarray]:
+        """Presses, misses and miss rate of each player in each race."""
+        keys, start, presses = np.unique(self.key, return_index=True, return_counts=True)
+        misses = np.add.reduceat((~self.hit).astype(np.int64), start) if len(start) else presses
+        return {"race": keys >> 16, "match": self.match[start], "player_id": keys & 0xFFFF,
+                "presses": presses, "misses": misses, "miss_rate": misses / presses}
+
+    def columns(self) -> dict[str, np.ndarray]:
+        """One row per press, for export."""
+        return {"match": self.match, "race": self.race, "player_id": self.player_id, "t_us": self.t_us,
+                "hit": self.hit, "reaction_us": self.reaction_us()}
+
+
+def export(columns: dict[str, np.ndarray], path: str) -> None:
+    """Write columns to .npz (NumPy only) or .parquet (needs pyarrow)."""
+    if path.endswith(".parquet"):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            print("Parquet export needs pyarrow (pip install pyarrow), or export to .npz")
+            return
+        pq.write_table(pa.table(columns), path)
+    else:
+        np.savez_compressed(path, **columns)
+
+
+def percentiles_ms(values_us: np.ndarray) -> str:
+    if not len(values_us):
+        return "-"
+    p50, p90, p99 = np.percentile(values_us, [50, 90, 99]) / 1000
+    return f"p50 {p50:.0f} ms, p90 {p90:.0f} ms, p99 {p99:.0f} ms"
+
+
+def report(presses: Presses) -> None:
+    intervals = presses.intervals_us()
+    curves = presses.taps_per_second()
+    per_player = presses.per_player()
+    print(f"{presses.n_races} races, {len(presses)} presses, {int(presses.hit.sum())} taps")
+    if len(curves["taps"]):
+        print(f"taps per second: mean {curves['taps'].mean():.2f}, best {curves['taps'].max()}")
+    print(f"inter-tap interval: {percentiles_ms(intervals)}")
+    print(f"reaction time: {percentiles_ms(presses.reaction_us())}")
+    if len(per_player["presses"]):
+        print(f"miss rate: {per_player['misses'].sum() / per_player['presses'].sum():.1%} overall, "
+              f"worst player {per_player['miss_rate'].max():.1%}")
+
+    counts, edges = np.histogram(intervals / 1000, bins=INTERVAL_BINS_MS)
+    width = 50 / max(counts.max(), 1) if len(counts) else 0
+    print("inter-tap intervals (ms):")
+    for count, low, high in zip(counts, edges[:-1], edges[1:]):
+        if count:
+            print(f"  {low:6.0f} - {high:6.0f} {'#' * max(1, round(count * width))} {count}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tap Race match log analytics")
+    parser.add_argument("logs", nargs="+", metavar="LOG")
+    parser.add_argument("--export", metavar="FILE", help="write one row per press to FILE (.npz or .parquet)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    records, matches = load(args.logs)
+    presses = Presses(records, matches)
+    report(presses)
+    if args.export:
+        export(presses.columns(), args.export)
+    print(f"{len(args.logs)} logs, {len(records)} records in {time.perf_counter() - start:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
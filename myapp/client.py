@@ -1,208 +1,619 @@
+import random
 import socket
-from threading import Thread
+import time
+import netlog
+from array import array
+from threading import Event, Thread, current_thread
 from kivy.clock import mainthread
 from kivymd.app import MDApp
-from kivymd.uix.progressindicator import MDLinearProgressIndicator
-from kivymd.uix.menu import MDDropdownMenu
-from myutils import snackbar, get_wifi_addr, add_prog_bar
+from myutils import snackbar, player_name, get_wifi_addr, player_color, Scoreboard, ScoreBuffer, WidgetPool
+from netloop import EventLoop, TimerHandle
+from connection import HEARTBEAT_TIMEOUT, RESUME_GRACE, Connection, connect_first, set_keepalive
+from latency import NARROW_SHIFT, ClockSync, LatencyStats, clock_us, delta_us, widen_time
+from protocol import (
+    HELLO, HANDSHAKE, NICKNAME, MAX_SCORE, STARTED_BY_SERVER, STARTED_BY_CLIENT, NPLAYERS,
+    COUNT, LOSE, RESET, RESTARTED_BY_SERVER, RESTARTED_BY_CLIENT, CLOSED_BY_CLIENT,
+    CLOSED_BY_SERVER, CLOSED_BY_CLIENT_ACK, CLOSED_BY_SERVER_ACK, SNAPSHOT, JOIN_ROOM,
+    PING, PONG, WINNER, REJECT, SESSION, RESUME, SEQ, PLAYER_NAME, SEED, TAPS, MAX_TAPS, SPECTATE,
+    ProtocolError, encode,
+)
+
+# Seconds between clock probes while a race is running
+PING_INTERVAL = 1.0
+# Seconds before the first reconnect attempt, doubled after every failed one up to the max
+RECONNECT_DELAY = 0.25
+MAX_RECONNECT_DELAY = 4.0
+# Seconds a press waits for the next ones to go in the same TAPS batch (the winning one is sent at once)
+TAP_BATCH_DELAY = 0.03
 
 
 class Client:
-    """Client class for network communication and game state management."""
+    """Client class for network communication and game state management.
+
+    The socket is served by an EventLoop in receive_data_thread. While a race
+    runs the client sends a PING every PING_INTERVAL: sync estimates the round
+    trip and the offset to the server clock, so taps are stamped in server
+    time and every score rendered can be timed from its tap (latency).
+
+    The player's own score is predicted: MainApp.on_press shows every tap
+    right away and the server echo is timed (tap_to_echo). The server answers
+    a COUNT it does not take with REJECT and the score it kept, and confirms
+    the winner with WINNER, the client rolls back to either, or to an echo
+    that still differs once its tap time shows the server has all our taps.
+
+    A server that sends the SEED of the race gets the presses, hits and
+    misses, in TAPS batches (every TAP_BATCH_DELAY at most) and counts the
+    hits itself, the others get a COUNT per tap.
+
+    A server that goes away (EOF, socket error, TCP keepalive giving up, or no
+    answer for heartbeat_timeout seconds during a race) does not end the
+    session right away when the server gave us a SESSION token: the client
+    reconnects in the background with exponential backoff and sends RESUME
+    with the token and the last SEQ it got, the server answers with only the
+    state that changed meanwhile. Taps made while away are counted locally
+    and sent again once resumed (all the presses of the race with TAPS, the
+    server keeps the ones it lacks). After resume_grace seconds without a
+    server, or if the server no longer knows the session, the player goes
+    back home (or plays on in the new slot it got).
+
+    A spectator client (spectator set before connecting, to a server or a
+    relay) sends SPECTATE instead of playing: it has no slot, shows every
+    score of the stream and never resumes, see spectators.py.
+    """
     def __init__(self):
         self.client: socket.socket | None = None
         self.receive_data_thread: Thread | None = None
         self.stop_thread: bool = False
+        self.loop: EventLoop | None = None
+        self.connection: Connection | None = None
+
+        self.sync: ClockSync = ClockSync()
+        self.latency: LatencyStats = LatencyStats("rtt", "tap_to_echo", "tap_to_render")
+        self.received_at: int = 0           # Our clock when the data being processed arrived
+        self.ping_timer: TimerHandle | None = None
+        self.in_race: bool = False
+        self.heartbeat_timeout: float = HEARTBEAT_TIMEOUT
+
+        # Session resume after losing the socket
+        self.resume_grace: float = RESUME_GRACE
+        self.token: int = 0                 # Session token from the server, 0: no resume
+        self.seq: int = 0                   # Last state seq received
+        self.resuming: bool = False         # RESUME sent, waiting for the answer
+        self.pending_idx: int | None = None     # Slot given while resuming, taken on the RESUME answer
+        self.lost_at: float | None = None   # When the socket was lost, None while connected
+        self.reconnect_cancel = Event()
+
+        # Presses of this race (TAPS), the seed of its button sequence and how many were sent
+        self.taps_seed: int = 0
+        self.tap_buttons = bytearray()
+        self.tap_times = array('I')
+        self.taps_sent: int = 0
+        self.taps_timer: TimerHandle | None = None
 
         self.idx: int | None = None
         self.nickname: str | None = None
         self.server_addr: str | None = None
+        self.server_addrs: list[str] = []   # More addresses of the same server (discovery), tried at once
+        self.server_port: int = 55555
+        self.room: str | None = None
+        self.spectator: bool = False        # Watch the game instead of playing
         self.is_connected: bool = False
         self.count: int = 0
+        self.last_tap: int = 0              # Server time of our last press (stamp_tap)
         self.n_players: int = 0
 
-        self.menu_win: MDDropdownMenu | None = None
-        self.menu_lose: MDDropdownMenu | None = None
-
         self.players_score: list[int] = []
-        self.prog_bars: list[MDLinearProgressIndicator] = []
-        self.colors: list[str] = ["#ff1717", "#17ff17", "#1717ff", "#ffff17", '#17ffff', '#8817ff']
+        self.ui_updates = ScoreBuffer(self.show_game_screen, self.reset_game_screen, self.show_score)
 
         # Get WIFI IP address if connected
         self.ip_addr = get_wifi_addr()
         print(f"Client IP: {self.ip_addr}")
 
         self.app = MDApp.get_running_app()
+        self.scoreboard: Scoreboard = self.app.root.ids.scoreboard
+        self.menus: WidgetPool = self.app.menus
         if self.ip_addr.startswith("Not connected"):
             self.app.root.ids.ip_label.text = self.ip_addr
         else:
             self.app.root.ids.ip_label.text = f"Your IP: {self.ip_addr}"
 
     def start_client(self):
-        """Initialize client socket and connect to server."""
+        """Connect to the server and start the network thread (blocks up to 2 s, not on the UI thread)."""
         try:
-            # Create socket for client and connect to server
-            self.client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-            self.client.settimeout(2)
-            self.client.connect((self.server_addr, 55555))
+            # Connect to every known address of the server at once, the first to answer wins
+            self.loop = EventLoop()
+            self.attach_socket(connect_first(self.addrs(), self.server_port, timeout=2))
 
             self.is_connected = True
             print("Client is connected: True - start_client")
-            MDApp.get_running_app().root.ids.ip_label.text = f"Your IP: {self.ip_addr}"
+            # The address of the interface that reaches the server, whichever LAN it is on
+            self.ip_addr = self.client.getsockname()[0]
 
-            # Start new thread to run receive_data()
+            # Start new thread running the event loop
             try:
-                self.receive_data_thread = Thread(target=self.receive_data)
+                self.receive_data_thread = Thread(target=self.handle_connection)
                 self.receive_data_thread.start()
             except Exception as e:
                 print(f"Error starting receive_data thread on client: {e}")
 
         except ConnectionRefusedError:
-            snackbar("Connection refused!")
+            print("Connection refused!")
         except Exception as e:
             print(f"Error starting client: {e}")
 
-    def receive_data(self):
-        """Thread function to receive and process messages from the server."""
-        while not self.stop_thread:
-            try:
-                # Get data from server
-                msg_recv = self.client.recv(1024).decode('ascii')
-                messages = msg_recv.split('&')[:-1]
-                for msg in messages:
-                    print(f"msg from server: {msg}")
-                    self.process_message(msg)
-
-            except TimeoutError:
-                pass
-            except Exception as e:
-                print(f"Exception caught in receive_data: {e}")
-                self.client.close()
-                self.is_connected = False
-                break
+    def addrs(self) -> list[str]:
+        """Every known address of the server, the one that answered last first."""
+        return list(dict.fromkeys(([self.server_addr] if self.server_addr else []) + self.server_addrs))
+
+    def attach_socket(self, sock: socket.socket, resume: bool = False):
+        """Serve a socket just connected to the server, resuming the session if asked."""
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        set_keepalive(sock)
+        self.client = sock
+        self.server_addr = sock.getpeername()[0]
+        self.connection = Connection(sock, self.loop)
+
+        # Offer the binary protocol (an old server just ignores it) and ask a lobby for a room
+        self.connection.queue_raw(HELLO)
+        if self.room:
+            self.connection.queue_raw(encode((JOIN_ROOM, self.room)))
+        if self.spectator:
+            self.connection.queue_raw(encode((SPECTATE,)))
+        if resume:
+            self.connection.queue_raw(encode((RESUME, self.token, self.seq)))
+        self.connection.flush()
+        self.loop.add_reader(sock, self.receive_data)
+
+    def handle_connection(self):
+        """Thread function running the event loop of the server socket."""
+        self.loop.run(lambda: self.stop_thread)
+        if self.connection:
+            self.connection.close()
+        self.loop.close()
+
+    def receive_data(self, sock):
+        """Receive and process messages from the server (socket is readable)."""
+        try:
+            # Get data from server straight into the frame buffer
+            n_bytes = self.connection.receive()
+        except BlockingIOError:
+            return
+        except Exception as e:
+            print(f"Exception caught in receive_data: {e}")
+            n_bytes = 0
+
+        if not n_bytes:
+            self.connection_lost()
+            return
+
+        self.received_at = clock_us()
+        try:
+            messages = self.connection.decoder.messages()
+        except ProtocolError as e:
+            print(f"Bad frame from server: {e}")
+            self.connection_lost()
+            return
+        for msg in messages:
+            if netlog.level:
+                netlog.message("from server", msg)
+            self.process_message(msg)
 
     def process_message(self, msg):
         """Process incoming messages based on their type."""
+        kind = msg[0]
+
+        # Server answered the handshake, switch to binary frames and sync clocks
+        if kind == HANDSHAKE:
+            self.connection.binary = True
+            if not self.spectator:
+                # Who we are on the leaderboard, only a binary server gets the name
+                self.send((PLAYER_NAME, player_name(self.app.user_data_dir)))
+            self.ping()
+
+        # Answer to a clock probe
+        elif kind == PONG:
+            rtt = self.sync.add_sample(msg[1], msg[2], msg[3], self.received_at)
+            self.latency.record("rtt", rtt)
+
+        # Game state seq, sent back on RESUME
+        elif kind == SEQ:
+            self.seq = msg[1]
+
+        # Token to resume the session with (while resuming it is the one of the slot given meanwhile)
+        elif kind == SESSION:
+            if not self.resuming and not self.spectator:
+                self.token = msg[1]
+
+        # Answer to RESUME, with the session to go on with
+        elif kind == RESUME:
+            self.seq = msg[2]
+            if self.resuming:
+                self.session_resumed(msg[1] == self.token)
+            self.token = msg[1]
+
+        # Slot given while resuming, known for sure once RESUME tells which session it is
+        elif kind == NICKNAME and self.resuming:
+            self.pending_idx = msg[1] - 1
+
+        # A spectator gives back the slot it joined with
+        elif kind == NICKNAME and self.spectator:
+            pass
+
         # Get nickname
-        if msg.startswith('P'):
-            self.nickname = msg
-            self.idx = int(msg[1]) - 1
+        elif kind == NICKNAME:
+            self.nickname = f"P{msg[1]}"
+            self.idx = msg[1] - 1
             print(f"Client connected as {self.nickname}")
-            self.update_snackbar()
+            self.update_nickname()
+            self.update_snackbar("Connected to server!")
+
+        # Button sequence of the race about to start (again when resuming, then it is the same)
+        elif kind == SEED:
+            if msg[1] != self.taps_seed:
+                self.clear_taps(msg[1])
+                self.update_sequence(msg[1])
 
         # Max score
-        elif msg.startswith('MAX_SCORE'):
-            max_score = int(msg[11:])
-            self.app.max_score = max_score
+        elif kind == MAX_SCORE:
+            self.update_max_score(msg[1])
 
         # Start game
-        elif msg.startswith('STARTED_BY_SERVER') or msg.startswith('STARTED_BY_CLIENT'):
+        elif kind == STARTED_BY_SERVER or kind == STARTED_BY_CLIENT:
             self.players_score = [0 for _ in range(self.n_players)]
+            self.start_pings()
             self.start_game_screen()
 
-        # Get number of players
-        elif msg.startswith('NPLAYERS'):
-            self.n_players = int(msg[10])
-            self.players_score = [0 for _ in range(self.n_players)]
+        # Get number of players (players left or joined, keep the scores of the others)
+        elif kind == NPLAYERS:
+            self.update_players(msg[1])
 
         # Receive server score
-        elif msg.startswith('COUNT'):
-            idx = int(msg[7]) - 1
-            count = int(msg[10:])
-            self.players_score[idx] = count
-            self.update_counter(count, idx)
+        elif kind == COUNT:
+            self.receive_score(msg[1] - 1, msg[2], widen_time(msg[3], self.server_time()))
+
+        # Receive the scores changed since the last server tick
+        elif kind == SNAPSHOT:
+            for player_id, count, tap_time in msg[1]:
+                self.receive_score(player_id - 1, count, tap_time)
+
+        # Server did not take our last COUNT, go back to the score it kept
+        elif kind == REJECT:
+            self.rollback(msg[1])
+
+        # Server confirmed who won the race
+        elif kind == WINNER:
+            self.update_winner(msg[1] - 1)
 
         # Open lose menu
-        elif msg.startswith('LOSE'):
-            if self.count < self.app.max_score:
+        elif kind == LOSE:
+            self.stop_pings()
+            if self.count < self.app.max_score and not self.spectator:
                 self.update_menu_lose()
 
-        # Reset score and progress bars
-        elif msg.startswith('RESET'):
+        # Reset score and progress bars, the race starts over (so do the heartbeats)
+        elif kind == RESET:
+            self.start_pings()
             self.update_reset()
 
-        # Remove everything and stop thread
-        elif msg.startswith('RESTARTED_BY_SERVER') or msg.startswith('RESTARTED_BY_CLIENT'):
+        # Remove everything and stop thread (spectators stay for the next race)
+        elif (kind == RESTARTED_BY_SERVER or kind == RESTARTED_BY_CLIENT) and not self.spectator:
+            self.stop_pings()
             self.update_reset()
             self.close_connection(by_client=True)
             self.update_back_home()
             self.stop_thread = True
 
         # Close connection, remove everything, and stop thread
-        elif msg.startswith('CLOSED_BY_SERVER'):
-            self.client.send('CLOSED_BY_SERVER_ACK&'.encode('ascii'))
-            self.client.close()
+        elif kind == CLOSED_BY_SERVER:
+            self.stop_pings()
+            self.send((CLOSED_BY_SERVER_ACK,))
             self.is_connected = False
             self.update_back_home()
             self.stop_thread = True
 
         # Ack message used to Stop thread
-        elif msg.startswith('CLOSED_BY_CLIENT_ACK'):
+        elif kind == CLOSED_BY_CLIENT_ACK:
             self.stop_thread = True
 
+    def session_resumed(self, resumed: bool):
+        """The server answered RESUME: same slot (resumed) or a new one (session expired)."""
+        self.resuming = False
+        self.lost_at = None
+        self.idx = self.pending_idx
+        self.nickname = f"P{self.idx + 1}"
+        self.update_nickname()
+        if resumed:
+            print(f"Session resumed as {self.nickname}")
+            self.update_snackbar("Reconnected!")
+            # Taps made while away never reached the server (nor maybe the last ones sent)
+            if self.tap_buttons:
+                self.taps_sent = 0
+                self.send_taps()
+            elif self.in_race and self.idx < len(self.players_score) and self.count > self.players_score[self.idx]:
+                self.send((COUNT, self.idx + 1, self.count, self.server_time()))
+        else:
+            print(f"Session expired, joined again as {self.nickname}")
+            # The new slot starts from press 0, with the SEED the server sends next
+            self.clear_taps(0)
+            self.stop_pings()
+            self.update_reset()
+            self.update_snackbar(f"Reconnected as {self.nickname}")
+
+    def update_players(self, n_players: int):
+        """Players joined or left, keep the scores of the others."""
+        self.n_players = n_players
+        self.players_score = (self.players_score + [0] * n_players)[:n_players]
+
+    def update_max_score(self, max_score: int):
+        """Max score chosen by the server or another player."""
+        self.app.max_score = max_score
+
+    def receive_score(self, idx, count, tap_time):
+        """Store a score from the server and show it (our own score is already shown)."""
+        self.players_score[idx] = count
+        if idx != self.idx:
+            self.update_counter(count, idx, tap_time)
+        elif tap_time:
+            self.latency.record("tap_to_echo", delta_us(self.sync.server_time(), tap_time))
+            # The server has every press we made and still disagrees: the prediction was wrong
+            # (a COUNT tap time is cut to 1 << NARROW_SHIFT us)
+            if count != self.count and delta_us(tap_time, self.last_tap) > -(1 << NARROW_SHIFT):
+                self.rollback(count)
+
+    def send(self, *messages: tuple):
+        """Send messages to the server in the protocol it speaks, in a single write."""
+        # The socket is only touched by the loop thread, hand the work over to it
+        if current_thread() is not self.receive_data_thread:
+            self.loop.call_soon_threadsafe(self.send, *messages)
+            return
+        if self.connection is None:
+            return      # Reconnecting, our score is sent again once resumed
+        for message in messages:
+            self.connection.queue(message)
+        self.connection.flush()
+
+    def add_tap(self, seed: int, button: int, win: bool = False):
+        """Queue the next press of the race of seed for the next TAPS batch (any thread)."""
+        tap_time = self.stamp_tap()
+        if current_thread() is not self.receive_data_thread:
+            self.loop.call_soon_threadsafe(self.queue_tap, seed, button, tap_time, win)
+        else:
+            self.queue_tap(seed, button, tap_time, win)
+
+    def queue_tap(self, seed: int, button: int, tap_time: int, win: bool):
+        """Add a press to the batch, sent after TAP_BATCH_DELAY or right away for a win (loop thread)."""
+        if seed != self.taps_seed:
+            return      # Pressed before the new race's SEED got here
+        self.tap_buttons.append(button)
+        self.tap_times.append(tap_time)
+        if win or len(self.tap_buttons) - self.taps_sent >= MAX_TAPS:
+            self.send_taps()
+        elif not self.taps_timer:
+            self.taps_timer = self.loop.call_later(TAP_BATCH_DELAY, self.send_taps)
+
+    def send_taps(self):
+        """Send the presses not sent yet, in as few TAPS frames as they fit in (loop thread)."""
+        if self.taps_timer:
+            self.taps_timer.cancel()
+            self.taps_timer = None
+        if self.connection is None:
+            return      # Reconnecting, the presses are sent once resumed
+        batches = []
+        while self.taps_sent < len(self.tap_buttons):
+            first, end = self.taps_sent, min(len(self.tap_buttons), self.taps_sent + MAX_TAPS)
+            batches.append((TAPS, self.taps_seed, first, bytes(self.tap_buttons[first:end]),
+                            tuple(self.tap_times[first:end])))
+            self.taps_sent = end
+        if batches:
+            if netlog.level:
+                for message in batches:
+                    netlog.message("to server", message)
+            self.send(*batches)
+
+    def clear_taps(self, seed: int):
+        """Forget the presses of the last race, the next ones are of the race of seed."""
+        if self.taps_timer:
+            self.taps_timer.cancel()
+            self.taps_timer = None
+        self.taps_seed = seed
+        self.tap_buttons.clear()
+        del self.tap_times[:]
+        self.taps_sent = 0
+
+    def server_time(self) -> int:
+        """Current time in the server clock, to stamp a tap with."""
+        return self.sync.server_time()
+
+    def stamp_tap(self) -> int:
+        """Server time of a press, the last one is how we know the server has them all."""
+        self.last_tap = self.server_time()
+        return self.last_tap
+
+    def connection_lost(self):
+        """The server went away without closing the session: reconnect and resume, or go back home."""
+        if self.ping_timer:
+            self.ping_timer.cancel()
+            self.ping_timer = None
+        if self.token and self.resume_grace and not self.stop_thread:
+            print("Connection to server lost, reconnecting")
+            self.connection.close()
+            self.connection = None
+            self.is_connected = False
+            self.resuming = False
+            if self.lost_at is None:
+                self.lost_at = time.monotonic()
+                self.update_snackbar("Connection lost, reconnecting...")
+            Thread(target=self.reconnect, name="reconnect", daemon=True).start()
+            return
+
+        print("Connection to server lost")
+        self.stop_pings()
+        self.is_connected = False
+        self.stop_thread = True
+        self.update_reset()
+        self.update_back_home()
+        self.update_snackbar("Connection lost!")
+
+    def reconnect(self):
+        """Thread function connecting again with exponential backoff, the loop thread resumes."""
+        delay = RECONNECT_DELAY
+        deadline = self.lost_at + self.resume_grace
+        while time.monotonic() < deadline:
+            # Jitter, not every player of a room hit by the same Wi-Fi blip at once
+            if self.reconnect_cancel.wait(delay * random.uniform(0.5, 1)):
+                return
+            try:
+                sock = connect_first(self.addrs(), self.server_port, timeout=2)
+            except OSError as e:
+                print(f"Reconnect failed: {e}")
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+                continue
+            self.loop.call_soon_threadsafe(self.resume, sock)
+            return
+        self.loop.call_soon_threadsafe(self.give_up)
+
+    def resume(self, sock: socket.socket):
+        """Connected again, ask the server for our session back (loop thread)."""
+        if self.stop_thread or self.reconnect_cancel.is_set():
+            sock.close()
+            return
+        self.resuming = True
+        self.attach_socket(sock, resume=True)
+        self.is_connected = True
+
+    def give_up(self):
+        """No server for resume_grace seconds, end the session (loop thread)."""
+        self.token = 0
+        if not self.stop_thread:
+            self.connection_lost()
+
+    def ping(self):
+        """Send a clock probe (heartbeat), and schedule the next one during a race."""
+        self.ping_timer = None
+        if self.connection is None or not self.connection.binary or self.stop_thread:
+            return
+        # The server answers every PING, silence means it is gone
+        if self.heartbeat_timeout and time.monotonic() - self.connection.last_received > self.heartbeat_timeout:
+            self.connection_lost()
+            return
+        self.send((PING, clock_us()))
+        if self.in_race:
+            self.ping_timer = self.loop.call_later(PING_INTERVAL, self.ping)
+
+    def start_pings(self):
+        """Probe the server clock periodically until the race is over."""
+        self.in_race = True
+        if not self.ping_timer:
+            self.ping()
+
+    def stop_pings(self):
+        """Stop the periodic clock probes (race over, the loop may go idle)."""
+        self.in_race = False
+        if self.ping_timer:
+            self.ping_timer.cancel()
+            self.ping_timer = None
+
+    def latency_summary(self) -> dict[str, dict[str, float]]:
+        """Percentiles of the latency histograms, in milliseconds (metric)."""
+        return self.latency.summary()
+
     def close_connection(self, by_client=False):
         """Close the client socket connection."""
-        if self.is_connected and not by_client:
-            self.client.send('CLOSED_BY_CLIENT&'.encode('ascii'))
+        self.reconnect_cancel.set()
+        if self.connection is None and self.receive_data_thread and self.receive_data_thread.is_alive():
+            # Reconnecting, there is no server to say goodbye to
+            self.loop.call_soon_threadsafe(setattr, self, "stop_thread", True)
             self.receive_data_thread.join()
+        elif self.is_connected and not by_client:
+            self.send((CLOSED_BY_CLIENT,))
+            self.receive_data_thread.join(self.heartbeat_timeout)
+            if self.receive_data_thread.is_alive():
+                # No answer from the server, stop waiting for it
+                self.stop_thread = True
+                self.loop.call_soon_threadsafe(self.connection.close)
+                self.receive_data_thread.join()
 
-        self.client.close()
         self.is_connected = False
 
 
-    # UI update methods (executed on main thread)
-    @mainthread
+    # UI update methods (batched per frame or executed on main thread)
     def start_game_screen(self):
-        """Add progress bar widgets and switch to game screen."""
-        for i in range(self.n_players):
-            prog_bar, panel = add_prog_bar(num=i, max_score=self.app.max_score)
-            self.prog_bars.append(prog_bar)
-            self.app.root.ids.prog_bar_grid.add_widget(panel)
+        """Add progress bar widgets and switch to game screen (next frame)."""
+        self.ui_updates.start()
+
+    def update_counter(self, count, idx, tap_time=0):
+        """Update progress bar and score display (next frame, latest count only)."""
+        self.ui_updates.set_score(idx, count, tap_time)
+
+    def update_reset(self):
+        """Reset all game state variables and UI elements (next frame)."""
+        self.ui_updates.reset()
+
+    def show_game_screen(self):
+        """Reset the scoreboard for the players and switch to game screen."""
+        self.scoreboard.set_players(self.n_players, self.app.max_score)
         # Change to game screen (screen B)
         self.app.root.current = "screen B"
 
     @mainthread
-    def update_snackbar(self):
-        """Display connection status notification."""
-        snackbar(f"Connected to server!")
+    def update_nickname(self):
+        """Show the nickname given by the server, in the player color."""
+        self.app.root.ids.nickname_label.text = \
+            f"Nickname: [color={player_color(self.idx)}][b]{self.nickname}[/b][/color]"
 
     @mainthread
-    def update_counter(self, count, idx):
+    def update_sequence(self, seed):
+        """Highlight the buttons of the race's sequence."""
+        self.app.new_sequence(seed)
+
+    @mainthread
+    def update_snackbar(self, message):
+        """Display connection status notification."""
+        snackbar(message)
+
+    def show_score(self, idx, count, tap_time):
         """Update progress bar and score display."""
-        self.prog_bars[idx].value = count
+        if tap_time:
+            self.latency.record("tap_to_render", delta_us(self.sync.server_time(), tap_time))
+        self.scoreboard.set_score(idx, count)
         if idx == self.idx:
             self.app.root.ids.count_label.text = str(count)
 
     @mainthread
     def update_menu_lose(self):
         """Show the lose menu."""
-        self.menu_lose.open()
+        self.menus.open("lose")
 
     @mainthread
-    def update_reset(self):
+    def update_winner(self, idx):
+        """Take back a predicted win if the server confirmed another winner."""
+        if self.spectator:
+            snackbar(f"P{idx + 1} won!")
+        elif idx != self.idx and self.count >= self.app.max_score:
+            self.menus.dismiss("win")
+            self.menus.open("lose")
+
+    @mainthread
+    def rollback(self, count):
+        """Replace the predicted score by the one the server kept."""
+        self.count = count
+        self.update_counter(count, self.idx)
+        if count < self.app.max_score:
+            self.menus.dismiss("win")
+
+    def reset_game_screen(self):
         """Reset all game state variables and UI elements."""
         self.count = 0
         self.app.root.ids.count_label.text = "0"
-        if self.prog_bars:
-            for i in range(self.n_players):
-                self.prog_bars[i].value = 0
+        self.scoreboard.reset()
 
         # Dismiss win and lose menu
-        if self.menu_win:
-            self.menu_win.dismiss()
-        if self.menu_lose:
-            self.menu_lose.dismiss()
+        self.menus.dismiss("win")
+        self.menus.dismiss("lose")
 
     @mainthread
     def update_back_home(self):
-        """Remove progress bars widgets and return to home screen."""
-        prog_bar_grid = self.app.root.ids.prog_bar_grid
-        children = prog_bar_grid.children.copy()
-        for child in children:
-            prog_bar_grid.remove_widget(child)
-        self.prog_bars = []
-
+        """Return to home screen (the scoreboard stays for the next game)."""
         self.app.root.ids.nickname_label.text = ""
         self.app.root.current = "screen A"
 
@@ -0,0 +1,222 @@
+import errno
+import os
+import selectors
+import socket
+import time
+from protocol import COUNT, SEQ, FrameDecoder, encode, encode_legacy
+
+# Outbound bytes a peer may fall behind by before it is disconnected
+MAX_BUFFER = 64 * 1024
+
+# Seconds of silence before a peer is given up on: app heartbeats during a race
+# (clients PING every second), kernel TCP keepalive probes otherwise
+HEARTBEAT_TIMEOUT = 5.0
+KEEPALIVE_IDLE = 10
+KEEPALIVE_INTERVAL = 3
+KEEPALIVE_COUNT = 3
+# Seconds the server keeps the slot of a binary client that lost its socket,
+# for it to reconnect and resume its session
+RESUME_GRACE = 30.0
+
+
+def set_keepalive(sock: socket.socket) -> None:
+    """Let the kernel probe an idle peer, so a half-open connection errors out on its own."""
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    # Linux/Android names, macOS only has the idle time (TCP_KEEPALIVE)
+    idle = getattr(socket, "TCP_KEEPIDLE", getattr(socket, "TCP_KEEPALIVE", None))
+    for option, value in ((idle, KEEPALIVE_IDLE),
+                          (getattr(socket, "TCP_KEEPINTVL", None), KEEPALIVE_INTERVAL),
+                          (getattr(socket, "TCP_KEEPCNT", None), KEEPALIVE_COUNT)):
+        if option is not None:
+            try:
+                sock.setsockopt(socket.IPPROTO_TCP, option, value)
+            except OSError:
+                pass
+
+
+def connect_first(addrs: list[str], port: int, timeout: float = 2.0) -> socket.socket:
+    """Connect to all the addresses at once, keep the first that answers (non-blocking socket).
+
+    Raises ConnectionRefusedError if every address refused, TimeoutError if
+    none answered in time, or the OSError of the last failure.
+    """
+    selector = selectors.DefaultSelector()
+    errors: list[OSError] = []
+    try:
+        for addr in dict.fromkeys(addrs):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            try:
+                error = sock.connect_ex((addr, port))
+            except OSError as e:     # Not even an address
+                error = e.errno or errno.EINVAL
+            if error in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                selector.register(sock, selectors.EVENT_WRITE)
+            else:
+                errors.append(OSError(error, os.strerror(error), addr))
+                sock.close()
+
+        deadline = time.monotonic() + timeout
+        while selector.get_map() and (remaining := deadline - time.monotonic()) > 0:
+            for key, _ in selector.select(remaining):
+                sock = key.fileobj
+                selector.unregister(sock)
+                error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if not error:
+                    return sock
+                errors.append(OSError(error, os.strerror(error)))
+                sock.close()
+    finally:
+        for key in list(selector.get_map().values()):
+            key.fileobj.close()
+        selector.close()
+
+    if errors and all(e.errno == errno.ECONNREFUSED for e in errors) and len(errors) == len(set(addrs)):
+        raise ConnectionRefusedError(errno.ECONNREFUSED, "Connection refused")
+    if len(errors) < len(set(addrs)):
+        raise TimeoutError(f"No answer from {', '.join(dict.fromkeys(addrs))}")
+    raise errors[-1] if errors else TimeoutError("No address to connect to")
+
+
+class Connection:
+    """A peer socket with its frame decoder and a bounded outbound queue.
+
+    Frames are queued on the event loop thread and written with a single send
+    per flush, so everything queued in the same loop iteration is coalesced.
+    A slow peer never blocks the others: whatever the socket does not take is
+    kept and written when it becomes writable again.
+
+    Slow peer policy: a queued COUNT replaces the stale COUNT of the same
+    player still waiting in the queue (only the latest score matters), and a
+    SEQ supersedes the SEQ still waiting (the latest covers everything before
+    it), while control frames keep their order. If the peer still falls more
+    than max_buffer bytes behind, on_overflow(connection) is called so the
+    owner can disconnect it.
+    """
+    def __init__(self, sock: socket.socket, loop, on_overflow=None, max_buffer: int = MAX_BUFFER):
+        self.sock = sock
+        self.loop = loop
+        self.on_overflow = on_overflow
+        self.max_buffer = max_buffer
+        self.decoder = FrameDecoder()
+        self.binary: bool = False
+        self.closed: bool = False
+        self.last_received: float = time.monotonic()
+
+        self._frames: list[bytes] = []          # Queued frames, oldest first
+        self._counts: dict[int, int] = {}       # Player id -> index of its COUNT in _frames
+        self._seq: int | None = None            # Index of the SEQ in _frames
+        self._superseded: int = 0               # Frames emptied by a later SEQ
+        self._queued_bytes: int = 0
+        self._unsent = b""                      # Tail of the last send not taken by the socket
+
+        self.dropped_counts: int = 0
+        self.sent_bytes: int = 0
+
+    @property
+    def queue_depth(self) -> int:
+        """Frames waiting to be written (metric)."""
+        return len(self._frames) - self._superseded
+
+    @property
+    def buffered_bytes(self) -> int:
+        """Bytes waiting to be written (metric)."""
+        return self._queued_bytes + len(self._unsent)
+
+    def receive(self) -> int:
+        """Read what the socket has into the decoder, return the bytes read (0: peer gone)."""
+        n_bytes = self.decoder.recv_into(self.sock)
+        self.last_received = time.monotonic()
+        return n_bytes
+
+    def encode(self, message: tuple) -> bytes:
+        """Encode a message in the protocol this peer speaks."""
+        return encode(message) if self.binary else encode_legacy(message)
+
+    def queue(self, message: tuple, data: bytes | None = None) -> None:
+        """Queue a message (data is its encoding for this peer, if already known)."""
+        if self.closed:
+            return
+        if data is None:
+            data = self.encode(message)
+        if not data:
+            return      # Nothing this peer understands
+
+        if message[0] == COUNT:
+            index = self._counts.get(message[1])
+            if index is not None:
+                # Replace the stale score of the same player
+                self._queued_bytes += len(data) - len(self._frames[index])
+                self._frames[index] = data
+                self.dropped_counts += 1
+                return
+            self._counts[message[1]] = len(self._frames)
+        elif message[0] == SEQ:
+            index = self._seq
+            if index is not None:
+                # The new SEQ goes last, after every frame it covers
+                self._queued_bytes -= len(self._frames[index])
+                if index == len(self._frames) - 1:
+                    self._frames.pop()
+                else:
+                    self._frames[index] = b""
+                    self._superseded += 1
+            self._seq = len(self._frames)
+        else:
+            # Control frames are ordering barriers, COUNTs queued later must stay later
+            self._counts.clear()
+
+        self._frames.append(data)
+        self._queued_bytes += len(data)
+        if self.buffered_bytes > self.max_buffer and self.on_overflow:
+            self.on_overflow(self)
+
+    def queue_raw(self, data: bytes) -> None:
+        """Queue bytes that are not a protocol message (handshake)."""
+        self._counts.clear()
+        self._frames.append(data)
+        self._queued_bytes += len(data)
+
+    def flush(self) -> None:
+        """Write the queue with a single send, keep whatever the socket does not take."""
+        if self.closed or not (self._frames or self._unsent):
+            return
+        data = self._unsent + b"".join(self._frames)
+        self._frames.clear()
+        self._counts.clear()
+        self._seq = None
+        self._superseded = 0
+        self._queued_bytes = 0
+
+        try:
+            sent = self.sock.send(data)
+        except BlockingIOError:
+            sent = 0
+        except OSError as e:
+            print(f"Exception caught in flush: {e}")
+            self._unsent = b""
+            self.closed = True
+            self.loop.remove_writer(self.sock)
+            return
+
+        self.sent_bytes += sent
+        self._unsent = data[sent:]
+        if self._unsent:
+            self.loop.add_writer(self.sock, self._on_writable)
+        else:
+            self.loop.remove_writer(self.sock)
+
+    def _on_writable(self, sock: socket.socket) -> None:
+        self.flush()
+
+    def close(self) -> None:
+        """Drop the queue, stop watching and close the socket."""
+        self.closed = True
+        self._frames.clear()
+        self._counts.clear()
+        self._seq = None
+        self._superseded = 0
+        self._unsent = b""
+        self.loop.remove_reader(self.sock)
+        self.loop.remove_writer(self.sock)
+        self.sock.close()
@@ -0,0 +1,280 @@
+"""LAN discovery: hosts announce their game with UDP beacons, clients list them.
+
+A Beacon runs on the event loop of a Server. Every BEACON_INTERVAL while the
+game waits for players (the server pauses it during a race) it sends a
+BEACON datagram (game name, TCP port, players, max score and the host LAN
+addresses) to the multicast group on each LAN interface, and to the
+broadcast address for networks that drop multicast. It always answers the
+PROBE datagrams of the clients with a unicast BEACON echoing the probe
+token, which gives the client a round trip time.
+
+A Discovery (client side) runs its own EventLoop thread while the join
+dialog is open: it probes every PROBE_INTERVAL, keeps the servers heard
+from in the last EXPIRY seconds, deduplicated by host id (a host on two
+LANs is one server with two addresses), and calls on_change with the list
+whenever it changes.
+
+Datagrams (big endian):
+    PROBE   magic, kind, token (client wire clock, latency.clock_us)
+    BEACON  magic, kind, host id, echoed token (0: unsolicited), port,
+            players, max score, name length, name (utf-8), address count,
+            addresses (4 bytes each)
+"""
+import random
+import socket
+import struct
+import time
+from threading import Thread
+import netinfo
+from latency import clock_us, delta_us
+from netloop import EventLoop, TimerHandle
+
+GROUP = "239.255.42.99"     # Organization-local multicast scope
+DISCOVERY_PORT = 55556
+BEACON_INTERVAL = 1.0       # Seconds between unsolicited beacons
+PROBE_INTERVAL = 1.0        # Seconds between client probes
+EXPIRY = 3.5                # Seconds without a beacon before a server is dropped from the list
+
+MAGIC = b"TAPR"
+PROBE = 1
+BEACON = 2
+PROBE_FORMAT = struct.Struct(">4sBI")
+BEACON_FORMAT = struct.Struct(">4sBIIHHHB")
+MAX_NAME_LEN = 64
+
+
+def encode_beacon(host_id: int, echo: int, port: int, n_players: int, max_score: int, name: str,
+                  addrs: list[str]) -> bytes:
+    name_bytes = name.encode()[:MAX_NAME_LEN]
+    # Players and max score are 16 bits, a larger max score shows as 65535
+    return (BEACON_FORMAT.pack(MAGIC, BEACON, host_id, echo, port, min(n_players, 0xFFFF), min(max_score, 0xFFFF),
+                               len(name_bytes))
+            + name_bytes + bytes([len(addrs)]) + b"".join(socket.inet_aton(addr) for addr in addrs))
+
+
+def decode(data: bytes) -> tuple | None:
+    """(PROBE, token) or (BEACON, host_id, echo, port, n_players, max_score, name, addrs), None if not ours."""
+    try:
+        if data[:4] != MAGIC:
+            return None
+        if data[4] == PROBE:
+            return PROBE, PROBE_FORMAT.unpack_from(data)[2]
+        if data[4] == BEACON:
+            _, _, host_id, echo, port, n_players, max_score, name_len = BEACON_FORMAT.unpack_from(data)
+            offset = BEACON_FORMAT.size
+            name = data[offset:offset + name_len].decode(errors="replace")
+            offset += name_len
+            n_addrs = data[offset]
+            addrs = [socket.inet_ntoa(data[offset + 1 + 4 * i:offset + 5 + 4 * i]) for i in range(n_addrs)]
+            return BEACON, host_id, echo, port, n_players, max_score, name, addrs
+    except (struct.error, IndexError, OSError):
+        pass
+    return None
+
+
+def discovery_socket() -> socket.socket:
+    """UDP socket on DISCOVERY_PORT, member of the group on every LAN interface."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, "SO_REUSEPORT"):
+        # A host and a client on the same device both listen to the port
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+    sock.bind(("", DISCOVERY_PORT))
+    for addr in [address.addr for address in netinfo.addresses()] or ["0.0.0.0"]:
+        try:
+            membership = socket.inet_aton(GROUP) + socket.inet_aton(addr)
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        except OSError:
+            pass    # No multicast on this interface, the broadcasts still get through
+    sock.setblocking(False)
+    return sock
+
+
+def send_everywhere(sock: socket.socket, data: bytes) -> None:
+    """Send to the multicast group on every LAN interface and to the broadcast address."""
+    for address in netinfo.addresses():
+        try:
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(address.addr))
+            sock.sendto(data, (GROUP, DISCOVERY_PORT))
+        except OSError:
+            pass
+    try:
+        sock.sendto(data, ("255.255.255.255", DISCOVERY_PORT))
+    except OSError:
+        pass
+
+
+def acquire_multicast_lock():
+    """Android drops multicast and broadcast datagrams unless the app holds a MulticastLock."""
+    try:
+        from jnius import autoclass
+    except ImportError:
+        return None     # Not on Android
+    try:
+        activity = autoclass("org.kivy.android.PythonActivity").mActivity
+        wifi = activity.getSystemService(autoclass("android.content.Context").WIFI_SERVICE)
+        lock = wifi.createMulticastLock("tap-race")
+        lock.acquire()
+        return lock
+    except Exception as e:
+        print(f"No multicast lock: {e}")
+        return None
+
+
+class Beacon:
+    """Announces a Server on the LAN and answers probes (runs on the server event loop)."""
+    def __init__(self, server, name: str):
+        self.server = server
+        self.name: str = name
+        self.host_id: int = random.getrandbits(32) or 1
+        self.sock: socket.socket | None = None
+        self.timer: TimerHandle | None = None
+        self.lock = None
+
+    def start(self) -> None:
+        """Open the socket and start announcing (loop thread)."""
+        try:
+            self.sock = discovery_socket()
+        except OSError as e:
+            print(f"Error starting discovery beacon: {e}")
+            return
+        self.lock = acquire_multicast_lock()
+        self.server.loop.add_reader(self.sock, self.receive)
+        self.announce()
+
+    def beacon(self, echo: int = 0) -> bytes:
+        addrs = [address.addr for address in netinfo.addresses()][:8]
+        return encode_beacon(self.host_id, echo, self.server.port, self.server.n_players,
+                             self.server.max_score, self.name, addrs)
+
+    def announce(self) -> None:
+        send_everywhere(self.sock, self.beacon())
+        self.timer = self.server.loop.call_later(BEACON_INTERVAL, self.announce)
+
+    def pause(self) -> None:
+        """Stop the unsolicited beacons, during a race (loop thread)."""
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+
+    def resume(self) -> None:
+        """Announce again, the game waits for players (loop thread)."""
+        if self.sock and not self.timer:
+            self.announce()
+
+    def receive(self, sock: socket.socket) -> None:
+        try:
+            data, addr = sock.recvfrom(2048)
+        except OSError:
+            return
+        msg = decode(data)
+        if msg and msg[0] == PROBE:
+            try:
+                sock.sendto(self.beacon(echo=msg[1]), addr)
+            except OSError:
+                pass
+
+    def close(self) -> None:
+        """Stop announcing (loop thread)."""
+        if self.timer:
+            self.timer.cancel()
+        if self.sock:
+            self.server.loop.remove_reader(self.sock)
+            self.sock.close()
+            self.sock = None
+        if self.lock:
+            self.lock.release()
+
+
+class FoundServer:
+    """A server heard on the LAN."""
+    __slots__ = ("host_id", "name", "port", "n_players", "max_score", "addrs", "rtt_ms", "last_seen")
+
+    def __init__(self, host_id: int):
+        self.host_id = host_id
+        self.name = ""
+        self.port = 0
+        self.n_players = 0
+        self.max_score = 0
+        self.addrs: list[str] = []      # Addresses to connect to, the ones heard from first
+        self.rtt_ms: float | None = None
+        self.last_seen = 0.0
+
+
+class Discovery:
+    """Live list of the servers on the LAN, for the join dialog."""
+    def __init__(self, on_change):
+        self.on_change = on_change      # (list[FoundServer]) -> None, called on the discovery thread
+        self.servers: dict[int, FoundServer] = {}
+        self.loop: EventLoop | None = None
+        self.sock: socket.socket | None = None
+        self.thread: Thread | None = None
+        self.stop_thread: bool = False
+        self.lock = None
+
+    def start(self) -> bool:
+        """Start listening and probing in the background, False if the port is not available."""
+        try:
+            self.sock = discovery_socket()
+        except OSError as e:
+            print(f"Error starting discovery: {e}")
+            return False
+        self.lock = acquire_multicast_lock()
+        self.loop = EventLoop()
+        self.loop.add_reader(self.sock, self.receive)
+        self.loop.call_soon(self.probe)
+        self.thread = Thread(target=self.run, name="discovery", daemon=True)
+        self.thread.start()
+        return True
+
+    def run(self) -> None:
+        self.loop.run(lambda: self.stop_thread)
+        self.sock.close()
+        self.loop.close()
+        if self.lock:
+            self.lock.release()
+
+    def stop(self) -> None:
+        """Stop the background thread (any thread)."""
+        if self.loop and not self.stop_thread:
+            self.loop.call_soon_threadsafe(setattr, self, "stop_thread", True)
+
+    def probe(self) -> None:
+        send_everywhere(self.sock, PROBE_FORMAT.pack(MAGIC, PROBE, clock_us()))
+        self.expire()
+        self.loop.call_later(PROBE_INTERVAL, self.probe)
+
+    def expire(self) -> None:
+        deadline = time.monotonic() - EXPIRY
+        expired = [host_id for host_id, found in self.servers.items() if found.last_seen < deadline]
+        for host_id in expired:
+            del self.servers[host_id]
+        if expired:
+            self.changed()
+
+    def receive(self, sock: socket.socket) -> None:
+        try:
+            data, (addr, _) = sock.recvfrom(2048)
+        except OSError:
+            return
+        msg = decode(data)
+        if not msg or msg[0] != BEACON:
+            return
+        _, host_id, echo, port, n_players, max_score, name, addrs = msg
+        found = self.servers.get(host_id)
+        if found is None:
+            found = self.servers[host_id] = FoundServer(host_id)
+        before = (found.name, found.port, found.n_players, found.max_score, found.addrs)
+        found.name, found.port, found.n_players, found.max_score = name, port, n_players, max_score
+        # The source address is known to route back to us, try it first
+        found.addrs = list(dict.fromkeys([addr] + found.addrs + addrs))
+        found.last_seen = time.monotonic()
+        if echo:
+            found.rtt_ms = delta_us(clock_us(), echo) / 1000
+        if echo or before != (name, port, n_players, max_score, found.addrs):
+            self.changed()
+
+    def changed(self) -> None:
+        self.on_change(sorted(self.servers.values(), key=lambda found: (found.rtt_ms is None, found.rtt_ms or 0)))
@@ -0,0 +1,94 @@
+from kivy.clock import mainthread
+from kivymd.app import MDApp
+from myutils import snackbar, player_name, ip_label_text, Scoreboard, ScoreBuffer, WidgetPool
+from latency import clock_us, delta_us
+from leaderboard import Leaderboard
+from server import Server
+
+
+class HostServer(Server):
+    """Server running inside the app, the host plays as P1 and the UI follows the game.
+
+    Game screen updates from the network thread go through a ScoreBuffer and
+    are applied once per frame.
+    """
+    def __init__(self, tick_rate: int | None = None, leaderboard: Leaderboard | None = None):
+        # Listen on every interface, players may join from any LAN the device is on
+        super().__init__(tick_rate=tick_rate, host_player=True, leaderboard=leaderboard)
+        self.ui_updates = ScoreBuffer(self.show_game_screen, self.reset_game_screen, self.show_score)
+
+        self.app = MDApp.get_running_app()
+        self.host_name = player_name(self.app.user_data_dir)
+        self.scoreboard: Scoreboard = self.app.root.ids.scoreboard
+        self.menus: WidgetPool = self.app.menus
+        self.app.root.ids.ip_label.text = ip_label_text()
+        print(f"Server IP: {self.app.root.ids.ip_label.text}")
+
+    # UI update methods (batched per frame or executed on main thread)
+    def start_game_screen(self):
+        """Add progress bar widgets and switch to game screen (next frame)."""
+        self.ui_updates.start()
+
+    def update_counter(self, count: int, idx: int, tap_time: int = 0):
+        """Update the progress bar and counter label (next frame, latest count only)."""
+        self.ui_updates.set_score(idx, count, tap_time)
+
+    def update_reset(self):
+        """Reset counters and progress bars (next frame)."""
+        self.ui_updates.reset()
+
+    def show_game_screen(self):
+        """Reset the scoreboard for the players and switch to game screen."""
+        self.scoreboard.set_players(self.n_players, self.app.max_score)
+
+        # Change to game screen (screen B)
+        self.app.root.current = "screen B"
+
+    @mainthread
+    def update_snackbar(self, message):
+        """Display a snackbar notification."""
+        snackbar(message)
+
+    @mainthread
+    def update_max_score(self, max_score: int):
+        """Use the max score chosen by a client."""
+        self.app.max_score = max_score
+
+    @mainthread
+    def update_sequence(self, seed: int):
+        """Highlight the buttons of the new race's sequence on the host too."""
+        self.app.new_sequence(seed)
+
+    def show_score(self, idx: int, count: int, tap_time: int):
+        """Update the progress bar and counter label."""
+        if tap_time:
+            self.latency.record("tap_to_render", delta_us(clock_us(), tap_time))
+        self.scoreboard.set_score(idx, count)
+        if idx == 0:
+            self.app.root.ids.count_label.text = str(count)
+
+    @mainthread
+    def update_winner(self, idx: int):
+        """A client won: take back a predicted win and open the lose menu."""
+        if idx == 0:
+            return
+        if self.count >= self.app.max_score:
+            self.menus.dismiss("win")
+        self.menus.open("lose")
+
+    def reset_game_screen(self):
+        """Reset counters and progress bars."""
+        self.count = 0
+        self.app.root.ids.count_label.text = "0"
+        self.scoreboard.reset()
+
+        self.menus.dismiss("win")
+        self.menus.dismiss("lose")
+
+    @mainthread
+    def update_back_home(self):
+        """Return to home screen (the scoreboard stays for the next game)."""
+        self.app.root.ids.nickname_label.text = ""
+        self.app.root.current = "screen A"
+
+
@@ -0,0 +1,141 @@
+"""Low-overhead latency measurement shared by Server and Client.
+
+Timestamps on the wire are 32-bit microsecond counters of the server
+monotonic clock (they wrap every ~71 minutes, differences are taken modulo
+2**32). A client converts its own clock to the server's with the offset
+estimated from PING/PONG exchanges, NTP style.
+
+COUNT, sent on every tap, carries its tap time narrowed to 16 bits of
+128 µs units (narrow_time): a COUNT is at most a few seconds old when it
+is read, so the receiver gets the whole timestamp back from its own clock
+(widen_time).
+"""
+import time
+from array import array
+
+MASK = 0xFFFFFFFF
+NARROW_SHIFT = 7            # Narrow times count 128 µs units, and wrap every ~8.4 s
+NARROW_MASK = 0xFFFF
+SUB_BUCKETS = 4             # Buckets per power of two (~19% relative resolution)
+N_BUCKETS = 31 * SUB_BUCKETS
+
+
+def clock_us() -> int:
+    """This host monotonic clock in microseconds, as sent on the wire."""
+    return (time.monotonic_ns() // 1000) & MASK
+
+
+def delta_us(later: int, earlier: int) -> int:
+    """Signed difference of two wire timestamps."""
+    delta = (later - earlier) & MASK
+    return delta - (MASK + 1) if delta > MASK >> 1 else delta
+
+
+def narrow_time(wire_time: int) -> int:
+    """16-bit form of a wire timestamp, as COUNT carries it."""
+    return wire_time >> NARROW_SHIFT & NARROW_MASK
+
+
+def widen_time(narrow: int, now: int) -> int:
+    """Wire timestamp of a narrow time within ~4 s of now (0, no time, stays 0)."""
+    if not narrow:
+        return 0
+    units = now >> NARROW_SHIFT
+    delta = (units - narrow) & NARROW_MASK
+    if delta > NARROW_MASK >> 1:
+        delta -= NARROW_MASK + 1
+    return (units - delta << NARROW_SHIFT) & MASK
+
+
+class Histogram:
+    """Fixed-size log-linear histogram of durations in microseconds.
+
+    Recording is one bucket computation and one array increment, so it can
+    stay on in production; memory never grows.
+    """
+    __slots__ = ("buckets", "count", "total")
+
+    def __init__(self):
+        self.buckets = array('L', bytes(array('L').itemsize * N_BUCKETS))
+        self.count = 0
+        self.total = 0
+
+    def record(self, us: int) -> None:
+        if us < SUB_BUCKETS:
+            index = max(us, 0)
+        else:
+            bits = us.bit_length()
+            index = min(SUB_BUCKETS * (bits - 2) + (us >> (bits - 3)) - SUB_BUCKETS, N_BUCKETS - 1)
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += us
+
+    @staticmethod
+    def bucket_value(index: int) -> float:
+        """Middle of a bucket, in microseconds."""
+        if index < SUB_BUCKETS:
+            return index
+        bits = index // SUB_BUCKETS + 2
+        low = (SUB_BUCKETS + index % SUB_BUCKETS) << (bits - 3)
+        return low + (1 << (bits - 3)) / 2
+
+    def percentile(self, p: float) -> float:
+        """Approximate p-th percentile (0..1) in milliseconds."""
+        if not self.count:
+            return 0.0
+        rank = p * self.count
+        seen = 0
+        for index, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n:
+                return self.bucket_value(index) / 1000
+        return self.bucket_value(N_BUCKETS - 1) / 1000
+
+    def summary(self) -> dict[str, float]:
+        return {
+            "count": self.count,
+            "mean_ms": self.total / self.count / 1000 if self.count else 0.0,
+            "p50_ms": self.percentile(.50),
+            "p95_ms": self.percentile(.95),
+            "p99_ms": self.percentile(.99),
+        }
+
+    def reset(self) -> None:
+        for index in range(N_BUCKETS):
+            self.buckets[index] = 0
+        self.count = self.total = 0
+
+
+class LatencyStats:
+    """Named histograms, queryable at runtime with summary()."""
+    def __init__(self, *names: str):
+        self.histograms: dict[str, Histogram] = {name: Histogram() for name in names}
+
+    def record(self, name: str, us: int) -> None:
+        self.histograms[name].record(us)
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        return {name: histogram.summary() for name, histogram in self.histograms.items()}
+
+
+class ClockSync:
+    """NTP-style round trip and clock offset estimate from PING/PONG samples."""
+    WINDOW = 8
+
+    def __init__(self):
+        self.offset_us: int = 0             # Server clock minus this host clock
+        self.rtt_us: int | None = None
+        self._samples: list[tuple[int, int]] = []   # (rtt, offset) of the last pongs
+
+    def add_sample(self, t0: int, t1: int, t2: int, t3: int) -> int:
+        """Add a PING sent at t0 (ours), received at t1 and answered at t2 (server), back at t3 (ours)."""
+        rtt = delta_us(t3, t0) - delta_us(t2, t1)
+        offset = (delta_us(t1, t0) + delta_us(t2, t3)) // 2
+        self._samples = self._samples[-(self.WINDOW - 1):] + [(rtt, offset)]
+        # The sample with the smallest round trip has the least queuing error
+        self.rtt_us, self.offset_us = min(self._samples)
+        return rtt
+
+    def server_time(self) -> int:
+        """Current server clock, as a wire timestamp."""
+        return (clock_us() + self.offset_us) & MASK
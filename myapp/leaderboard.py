@@ -0,0 +1,207 @@
+"""Persistent leaderboard and match history, in SQLite.
+
+A Server with a Leaderboard records the result of every race it decides a
+winner for: max score, time from the start to the winning tap, and the name
+and score of every player. record() only queues the result, so a tap or a
+broadcast never waits for the database: a writer thread commits the queued
+results in batches (up to BATCH_SIZE, or what came within BATCH_DELAY), one
+transaction each, in WAL mode so the readers are never blocked either. Many
+processes (the lobby workers) can share one database.
+
+Queries are answered from indexes, and the answers are kept in an LRU cache
+until a batch is committed (by this process or another one):
+    top(max_score, n)         fastest winners for a max score setting
+    history(player, before)   a player's races, newest first, one page at a time
+    bests(player)             a player's best time, wins and races per max score
+
+Players are known by the name their device sends (PLAYER_NAME), the same
+name on two devices is the same player.
+
+Run from the myapp directory:
+    python -m leaderboard DB top 50
+    python -m leaderboard DB history NAME [--before MATCH_ID]
+    python -m leaderboard DB bests NAME
+"""
+import argparse
+import queue
+import sqlite3
+import time
+from collections import OrderedDict
+from threading import Lock, Thread
+from typing import NamedTuple
+
+BATCH_SIZE = 64             # Results committed in one transaction at most
+BATCH_DELAY = 0.5           # Seconds to wait for more results before committing
+CACHE_SIZE = 256            # Query answers kept
+PAGE_SIZE = 20
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS matches (
+    id INTEGER PRIMARY KEY,
+    played_at REAL NOT NULL,
+    max_score INTEGER NOT NULL,
+    winner TEXT NOT NULL,
+    duration_ms INTEGER NOT NULL,
+    n_players INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    match_id INTEGER NOT NULL REFERENCES matches (id),
+    player TEXT NOT NULL,
+    score INTEGER NOT NULL,
+    won INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS matches_fastest ON matches (max_score, winner, duration_ms);
+CREATE INDEX IF NOT EXISTS results_player ON results (player, match_id DESC);
+"""
+
+
+class MatchResult(NamedTuple):
+    played_at: float                    # Epoch seconds
+    max_score: int
+    winner: str
+    duration_ms: int                    # Race start to the winning tap
+    scores: tuple[tuple[str, int, bool], ...]   # (player, score, won) of every player
+
+
+def connect(path: str) -> sqlite3.Connection:
+    connection = sqlite3.connect(path, timeout=10, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")     # WAL stays consistent, a crash may lose the last batch
+    return connection
+
+
+class Leaderboard:
+    """Match results in a SQLite database, written in batches by a background thread."""
+    def __init__(self, path: str):
+        self.path = path
+        self.reader = connect(path)
+        with self.reader:
+            self.reader.executescript(SCHEMA)
+        self.read_lock = Lock()
+        self.cache: OrderedDict[tuple, list] = OrderedDict()
+        self.data_version: int = 0
+        self.queue: queue.SimpleQueue = queue.SimpleQueue()
+        self.writer = Thread(target=self.write_results, name="leaderboard", daemon=True)
+        self.writer.start()
+
+    def record(self, result: MatchResult) -> None:
+        """Queue a result to be written (any thread, never blocks)."""
+        self.queue.put(result)
+
+    def write_results(self) -> None:
+        """Thread function committing the queued results in batches."""
+        connection = connect(self.path)
+        stop = False
+        while not stop:
+            result = self.queue.get()
+            if result is None:
+                break
+            batch = [result]
+            deadline = time.monotonic() + BATCH_DELAY
+            while len(batch) < BATCH_SIZE:
+                try:
+                    result = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if result is None:
+                    stop = True
+                    break
+                batch.append(result)
+            try:
+                with connection:
+                    for result in batch:
+                        self.insert(connection, result)
+            except sqlite3.Error as e:
+                print(f"Error writing {len(batch)} results to the leaderboard: {e}")
+        connection.close()
+
+    @staticmethod
+    def insert(connection: sqlite3.Connection, result: MatchResult) -> None:
+        match_id = connection.execute(
+            "INSERT INTO matches (played_at, max_score, winner, duration_ms, n_players) VALUES (?, ?, ?, ?, ?)",
+            (result.played_at, result.max_score, result.winner, result.duration_ms, len(result.scores)),
+        ).lastrowid
+        connection.executemany(
+            "INSERT INTO results (match_id, player, score, won) VALUES (?, ?, ?, ?)",
+            [(match_id, player, score, won) for player, score, won in result.scores],
+        )
+
+    def query(self, sql: str, *args) -> list[tuple]:
+        """Rows of a read query, from the cache when the same query was answered since the last write."""
+        key = (sql, args)
+        with self.read_lock:
+            # Bumped by every commit of another connection, the writer thread's included
+            data_version = self.reader.execute("PRAGMA data_version").fetchone()[0]
+            if data_version != self.data_version:
+                self.data_version = data_version
+                self.cache.clear()
+            rows = self.cache.get(key)
+            if rows is not None:
+                self.cache.move_to_end(key)
+                return rows
+            rows = self.reader.execute(sql, args).fetchall()
+            self.cache[key] = rows
+            if len(self.cache) > CACHE_SIZE:
+                self.cache.popitem(last=False)
+            return rows
+
+    def top(self, max_score: int, n: int = 10) -> list[tuple[str, int, int]]:
+        """(player, best time in ms, wins) of the n fastest winners at this max score."""
+        return self.query(
+            "SELECT winner, MIN(duration_ms) AS best, COUNT(*) FROM matches WHERE max_score = ?"
+            " GROUP BY winner ORDER BY best LIMIT ?", max_score, n)
+
+    def history(self, player: str, before: int | None = None, n: int = PAGE_SIZE) -> list[tuple]:
+        """(match id, played at, max score, score, won, winner time in ms) of a player's races, newest first.
+
+        Pass the last match id of a page as before to get the next page.
+        """
+        return self.query(
+            "SELECT r.match_id, m.played_at, m.max_score, r.score, r.won, m.duration_ms"
+            " FROM results AS r JOIN matches AS m ON m.id = r.match_id"
+            " WHERE r.player = ? AND r.match_id < ? ORDER BY r.match_id DESC LIMIT ?",
+            player, before if before is not None else 2 ** 63 - 1, n)
+
+    def bests(self, player: str) -> list[tuple[int, int | None, int, int]]:
+        """(max score, best winning time in ms or None, wins, races) of a player per max score."""
+        return self.query(
+            "SELECT m.max_score, MIN(CASE WHEN r.won THEN m.duration_ms END), SUM(r.won), COUNT(*)"
+            " FROM results AS r JOIN matches AS m ON m.id = r.match_id"
+            " WHERE r.player = ? GROUP BY m.max_score ORDER BY m.max_score", player)
+
+    def close(self) -> None:
+        """Write what is queued and close the database."""
+        self.queue.put(None)
+        self.writer.join()
+        with self.read_lock:
+            self.reader.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tap Race leaderboard")
+    parser.add_argument("db")
+    parser.add_argument("query", choices=["top", "history", "bests"])
+    parser.add_argument("arg", help="max score (top) or player name (history, bests)")
+    parser.add_argument("-n", type=int, default=PAGE_SIZE, help="rows to show")
+    parser.add_argument("--before", type=int, default=None, help="history page: races before this match id")
+    args = parser.parse_args()
+
+    leaderboard = Leaderboard(args.db)
+    if args.query == "top":
+        for rank, (player, best_ms, wins) in enumerate(leaderboard.top(int(args.arg), args.n), 1):
+            print(f"{rank:3}. {player:24} {best_ms / 1000:7.2f} s  {wins} wins")
+    elif args.query == "history":
+        for match_id, played_at, max_score, score, won, duration_ms in leaderboard.history(
+                args.arg, args.before, args.n):
+            when = time.strftime("%Y-%m-%d %H:%M", time.localtime(played_at))
+            result = f"won in {duration_ms / 1000:.2f} s" if won else f"{score}/{max_score}"
+            print(f"#{match_id:<6} {when}  to {max_score:4}  {result}")
+    else:
+        for max_score, best_ms, wins, races in leaderboard.bests(args.arg):
+            best = f"{best_ms / 1000:.2f} s" if best_ms is not None else "-"
+            print(f"to {max_score:4}: best {best:>9}, {wins}/{races} won")
+    leaderboard.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,359 @@
+"""Multi-room lobby: one supervisor process spreads rooms over worker processes.
+
+The supervisor owns the listening socket. A new client sends HELLO and
+JOIN_ROOM right after connecting. The supervisor reads them, looks the room
+up in its routing table, or gives a new room to the worker with the fewest
+rooms, and passes the socket (and the bytes already read) to that worker
+over a Unix socket with SCM_RIGHTS (clients wait in the supervisor while
+a busy worker's channel is full). Every later connection to the same room,
+reconnects included, lands on the same worker. Each worker runs all its
+rooms on one EventLoop, and every room is a plain Server with the usual
+MAX_SCORE/STARTED/COUNT/LOSE/RESET semantics.
+
+Old clients never send JOIN_ROOM and go to the DEFAULT_ROOM after a short
+grace period.
+
+With --record DIR every room records its match events to a log of its own,
+and with --leaderboard DB the workers store the race results in one database.
+
+Run from the myapp directory:  python -m lobby --port 55555 --workers 4
+"""
+import argparse
+import multiprocessing
+import os
+import re
+import socket
+import struct
+import matchlog
+from collections import deque
+import netlog
+from leaderboard import Leaderboard
+from netloop import EventLoop
+from protocol import HANDSHAKE, JOIN_ROOM, MAX_ROOM_LEN, FrameDecoder, ProtocolError
+from server import PORT, Server
+
+DEFAULT_ROOM = "lobby"
+JOIN_GRACE = 0.5            # Seconds to wait for JOIN_ROOM before using the default room
+
+
+# Supervisor <-> worker messages (one SOCK_SEQPACKET packet each)
+#   C <name len> <name> <bytes read>  supervisor -> worker, with the client fd attached
+#   E <joined u32> <name>             worker -> supervisor, the room is empty
+#   F <name>                          supervisor -> worker, the room is no longer routed
+_JOINED = struct.Struct(">I")
+
+
+def room_name(name: str) -> str:
+    """Letters and digits of a room name (it names the room's match log), or the default room."""
+    return re.sub(r"[^A-Za-z0-9]", "", name)[:MAX_ROOM_LEN] or DEFAULT_ROOM
+
+
+class Room(Server):
+    """A game room living in a worker process."""
+    def __init__(self, name: str, worker: "Worker"):
+        super().__init__(tick_rate=worker.tick_rate, loop=worker.loop, leaderboard=worker.leaderboard)
+        self.name = name
+        self.worker = worker
+        if worker.record_dir:
+            self.record(worker.record_dir, name)
+
+    def room_empty(self):
+        self.worker.room_empty(self.name)
+
+
+class Worker:
+    """Worker process hosting many rooms on a single event loop."""
+    def __init__(self, channel: socket.socket, tick_rate: int | None, record_dir: str | None = None,
+                 leaderboard_path: str | None = None):
+        self.channel = channel
+        self.tick_rate = tick_rate
+        self.record_dir = record_dir
+        self.leaderboard = Leaderboard(leaderboard_path) if leaderboard_path else None
+        self.loop = EventLoop()
+        self.rooms: dict[str, Room] = {}
+        self.joined: dict[str, int] = {}        # Clients handed over per room, for the supervisor
+        self.stop_thread: bool = False
+
+    def run(self):
+        self.loop.add_reader(self.channel, self.receive_supervisor)
+        self.loop.run(lambda: self.stop_thread)
+        for room in self.rooms.values():
+            self.close_room(room)
+        self.loop.close()
+        # A worker process ends without running the atexit handlers
+        matchlog.drain()
+        if self.leaderboard:
+            self.leaderboard.close()
+
+    def close_room(self, room: Room):
+        if room.recorder:
+            room.recorder.close()
+        room.spectators.close()
+
+    def receive_supervisor(self, channel):
+        """Adopt a client socket handed over by the supervisor, or drop a freed room."""
+        data, fds, _, _ = socket.recv_fds(channel, 65536, 1)
+        if not data:
+            # Supervisor is gone
+            self.stop_thread = True
+            return
+
+        if data[:1] == b"F":
+            name = room_name(data[1:].decode('ascii', 'replace'))
+            room = self.rooms.get(name)
+            if room and room.is_empty:
+                self.close_room(room)
+                del self.rooms[name]
+                del self.joined[name]
+            return
+
+        name_len = data[1]
+        name = room_name(data[2:2 + name_len].decode('ascii', 'replace'))
+        client = socket.socket(fileno=fds[0])
+
+        room = self.rooms.get(name)
+        if room is None or room.is_empty:
+            # Fresh game for a new or emptied room
+            if room:
+                self.close_room(room)
+            room = self.rooms[name] = Room(name, self)
+        self.joined[name] = self.joined.get(name, 0) + 1
+        room.add_client(client, data[2 + name_len:])
+
+    def room_empty(self, name: str):
+        """Tell the supervisor how many clients this room got, so it can free the route."""
+        self.channel.send(b"E" + _JOINED.pack(self.joined[name]) + name.encode('ascii'))
+
+
+def run_worker(channel: socket.socket, tick_rate: int | None, record_dir: str | None,
+               leaderboard_path: str | None, inherited: list[socket.socket]):
+    """Process target of a worker."""
+    # Close the supervisor ends inherited on fork, or no worker would ever see EOF
+    for sock in inherited:
+        sock.close()
+    Worker(channel, tick_rate, record_dir, leaderboard_path).run()
+
+
+class Lobby:
+    """Supervisor: accepts clients and routes them to the worker hosting their room."""
+    def __init__(self, ip_addr: str = "0.0.0.0", port: int = PORT, n_workers: int | None = None,
+                 tick_rate: int | None = 30, record_dir: str | None = None,
+                 leaderboard_path: str | None = None):
+        self.ip_addr = ip_addr
+        self.port = port
+        self.n_workers = n_workers or os.cpu_count() or 1
+        self.tick_rate = tick_rate
+        self.record_dir = record_dir
+        self.leaderboard_path = leaderboard_path
+
+        self.server: socket.socket | None = None
+        self.loop: EventLoop | None = None
+        self.stop_thread: bool = False
+
+        self.workers: list[multiprocessing.Process] = []
+        self.channels: list[socket.socket] = []
+        self.rooms_per_worker: list[int] = []
+        self.routes: dict[str, list[int]] = {}      # Room name -> [worker index, clients routed]
+        self.pending: dict[socket.socket, tuple] = {}   # Client -> (decoder, grace timer, bytes read)
+        self.backlog: list[deque] = []              # Per worker, (client, room, packet) the channel did not take
+
+    def start_server(self):
+        """Start the workers and the listening socket."""
+        for _ in range(self.n_workers):
+            parent, child = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+            worker = multiprocessing.Process(
+                target=run_worker, daemon=True,
+                args=(child, self.tick_rate, self.record_dir, self.leaderboard_path, [parent, *self.channels]))
+            worker.start()
+            child.close()
+            self.workers.append(worker)
+            self.channels.append(parent)
+            self.rooms_per_worker.append(0)
+            self.backlog.append(deque())
+
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((self.ip_addr, self.port))
+        self.server.listen(1024)
+        self.server.setblocking(False)
+
+        self.loop = EventLoop()
+        self.loop.add_reader(self.server, self.accept_connection)
+        for channel in self.channels:
+            channel.setblocking(False)
+            self.loop.add_reader(channel, self.receive_worker)
+
+    def run(self):
+        """Run the supervisor loop until close_connection() is called."""
+        self.loop.run(lambda: self.stop_thread)
+
+    def accept_connection(self, server):
+        """Accept a client and wait for it to name its room."""
+        try:
+            client, _ = server.accept()
+        except BlockingIOError:
+            return
+        client.setblocking(False)
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        timer = self.loop.call_later(JOIN_GRACE, self.route, client, DEFAULT_ROOM)
+        self.pending[client] = (FrameDecoder(), timer, bytearray())
+        self.loop.add_reader(client, self.receive_join)
+
+    def receive_join(self, client):
+        """Read the handshake of a pending client until its JOIN_ROOM arrives."""
+        decoder, timer, data = self.pending[client]
+        try:
+            chunk = client.recv(1024)
+        except BlockingIOError:
+            return
+        except OSError:
+            chunk = b""
+        if not chunk:
+            self.discard(client)
+            return
+
+        data += chunk
+        decoder.feed(chunk)
+        try:
+            messages = decoder.messages()
+        except ProtocolError:
+            self.discard(client)
+            return
+        for msg in messages:
+            if msg[0] == JOIN_ROOM:
+                self.route(client, msg[1])
+                return
+            elif msg[0] != HANDSHAKE:
+                # An old client talking already, it will not ask for a room
+                self.route(client, DEFAULT_ROOM)
+                return
+
+    def discard(self, client):
+        """Forget a pending client that went away."""
+        _, timer, _ = self.pending.pop(client)
+        timer.cancel()
+        self.loop.remove_reader(client)
+        client.close()
+
+    def route(self, client, room: str):
+        """Hand the client over to the worker hosting its room."""
+        if client not in self.pending:
+            return
+        _, timer, data = self.pending.pop(client)
+        timer.cancel()
+        self.loop.remove_reader(client)
+
+        room = room_name(room)
+        name = room.encode('ascii')
+        route = self.routes.get(room)
+        if route is None:
+            worker = min(range(self.n_workers), key=self.rooms_per_worker.__getitem__)
+            route = self.routes[room] = [worker, 0]
+            self.rooms_per_worker[worker] += 1
+        worker = route[0]
+        route[1] += 1
+
+        backlog = self.backlog[worker]
+        backlog.append((client, room, b"C" + bytes([len(name)]) + name + data))
+        # Otherwise the channel is full and the client waits its turn
+        if len(backlog) == 1 and not self.hand_over(worker):
+            self.loop.add_writer(self.channels[worker], self.channel_writable)
+
+    def channel_writable(self, channel):
+        """A full worker channel has room again, send it the clients waiting."""
+        if self.hand_over(self.channels.index(channel)):
+            self.loop.remove_writer(channel)
+
+    def hand_over(self, worker: int) -> bool:
+        """Pass the clients routed to a worker over its channel, False if it is full."""
+        channel = self.channels[worker]
+        backlog = self.backlog[worker]
+        while backlog:
+            client, room, packet = backlog[0]
+            try:
+                socket.send_fds(channel, [packet], [client.fileno()])
+            except BlockingIOError:
+                return False    # The worker is behind
+            except OSError as e:
+                print(f"Error handing client over to worker {worker}: {e}")
+                self.unroute(room)
+            backlog.popleft()
+            client.close()
+        return True
+
+    def unroute(self, room: str):
+        """A client routed to a room never got there, forget the room if it was the only one."""
+        route = self.routes[room]
+        route[1] -= 1
+        if not route[1]:
+            del self.routes[room]
+            self.rooms_per_worker[route[0]] -= 1
+
+    def receive_worker(self, channel):
+        """Handle a notification from a worker (a room became empty)."""
+        try:
+            data = channel.recv(1024)
+        except BlockingIOError:
+            return
+        if not data:
+            self.loop.remove_reader(channel)
+            return
+        if data[:1] == b"E":
+            joined, = _JOINED.unpack_from(data, 1)
+            room = data[1 + _JOINED.size:].decode('ascii')
+            route = self.routes.get(room)
+            # Clients still on their way to the worker keep the route alive
+            if route and route[1] == joined:
+                try:
+                    channel.send(b"F" + room.encode('ascii'))
+                except BlockingIOError:
+                    return      # The worker is behind, the room stays routed there (and starts afresh)
+                except OSError as e:
+                    print(f"Error freeing room {room}: {e}")
+                del self.routes[room]
+                self.rooms_per_worker[route[0]] -= 1
+
+    def close_connection(self):
+        """Stop accepting clients and shut the workers down."""
+        self.stop_thread = True
+        for backlog in self.backlog:
+            for client, _, _ in backlog:
+                client.close()
+        for channel in self.channels:
+            channel.close()
+        for worker in self.workers:
+            worker.join(timeout=1)
+        self.server.close()
+        self.loop.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tap Race multi-room lobby server")
+    parser.add_argument("--host", default="0.0.0.0", help="address to bind (default: all)")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--tick-rate", type=int, default=30,
+                        help="score snapshots per second, 0 to echo every tap")
+    parser.add_argument("--leaderboard", metavar="DB", default=None,
+                        help="store the race results of every room in the SQLite database DB")
+    parser.add_argument("--record", metavar="DIR", default=None,
+                        help="record the match events of every room to logs in DIR (see matchlog.py)")
+    parser.add_argument("--log", choices=list(netlog.LEVELS), default=None,
+                        help="network log level (default: TAP_RACE_LOG or off)")
+    args = parser.parse_args()
+    if args.log:
+        netlog.set_level(args.log)
+
+    lobby = Lobby(ip_addr=args.host, port=args.port, n_workers=args.workers, tick_rate=args.tick_rate or None,
+                  record_dir=args.record, leaderboard_path=args.leaderboard)
+    lobby.start_server()
+    print(f"Lobby listening on {args.host}:{args.port} with {lobby.n_workers} workers")
+    try:
+        lobby.run()
+    except KeyboardInterrupt:
+        pass
+    lobby.close_connection()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,41 @@
+import importlib
+import os
 import random
+import netinfo
+import netlog
+from threading import Thread
+from typing import TYPE_CHECKING
+from kivy.clock import Clock, mainthread
 from kivy.lang import Builder
 from kivy.core.text import LabelBase
 from kivy.core.window import Window
 from kivy.utils import platform
 from kivymd.app import MDApp
-from kivymd.uix.button import MDButton, MDButtonText
-from kivymd.uix.dialog import MDDialog, MDDialogHeadlineText, MDDialogContentContainer
 from kivymd.uix.boxlayout import MDBoxLayout
-from kivymd.uix.textfield import MDTextField, MDTextFieldHintText
-from kivymd.uix.menu import MDDropdownMenu
-from kivymd.uix.progressindicator import MDLinearProgressIndicator
-from server import Server
-from client import Client
-from myutils import snackbar, add_prog_bar
+from myutils import snackbar, device_name, WidgetPool
+from latency import clock_us
+from sequence import ButtonSequence
+from protocol import (
+    MAX_SCORE, STARTED_BY_SERVER, STARTED_BY_CLIENT, COUNT, LOSE, RESET, RESTARTED_BY_SERVER,
+    RESTARTED_BY_CLIENT, MISS,
+)
+
+if TYPE_CHECKING:
+    from kivymd.uix.dialog import MDDialog
+    from host import HostServer
+    from client import Client
+    from discovery import Discovery, FoundServer
+    from leaderboard import Leaderboard
+
+# Scores snapshots sent by the server per second
+TICK_RATE = 30
+
+# Modules screen A does not need: imported on first use, or one per frame
+# once the first frame is on screen, whichever comes first
+DEFERRED_IMPORTS = (
+    "kivymd.uix.menu", "kivymd.uix.button", "kivymd.uix.dialog", "kivymd.uix.textfield",
+    "kivymd.uix.list", "host", "client",
+)
 
 
 if platform == 'android' or platform == 'ios':
@@ -42,15 +65,18 @@ class MainApp(MDApp):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
-        self.server: Server | None = None
+        self.server: HostServer | None = None
         self.client: Client | None = None
 
         self.server_ip_dialog: MDDialog | None = None
-        self.prog_bars: list[MDLinearProgressIndicator] = []
+        self.discovery: Discovery | None = None
+        self.leaderboard: Leaderboard | None = None     # Opened by the first game hosted
 
         self.count: int = 0
         self.max_score = 10
         self.last_id: int = 0
+        self.sequence: ButtonSequence | None = None     # Buttons of the multiplayer race, random when None
+        self.presses: int = 0                           # Presses in this race, hits and misses
         self.single_player: bool = True
         self.stop_flow = True
 
@@ -60,13 +86,15 @@ class MainApp(MDApp):
         # Create screen object
         self.screen = Builder.load_file('layout.kv')
 
-        # Define menu items and create menus
+        # Define menu items, the menus are built the first time they open and reused
         self.menu_items_settings = self.settings_menu_items()
-        self.settings = self.settings_menu()
-
         self.menu_items = self.menu_items()
-        self.top_menu = self.menu_header()
-        self.menu_finish = self.menu_win()
+        self.menus = WidgetPool(
+            settings=self.settings_menu,
+            top=self.menu_header,
+            win=self.menu_win,
+            lose=self.menu_lose,
+        )
 
     def start_server(self):
         """Start the server if not already running as server or client."""
@@ -75,10 +103,14 @@ class MainApp(MDApp):
         elif self.client:
             snackbar("Already running as client!")
         else:
-            self.server = Server()
+            from host import HostServer
+            from leaderboard import Leaderboard
+            if self.leaderboard is None:
+                self.leaderboard = Leaderboard(os.path.join(self.user_data_dir, "leaderboard.db"))
+            self.sequence = None
+            self.server = HostServer(tick_rate=TICK_RATE, leaderboard=self.leaderboard)
             self.server.start_server()
-            self.server.menu_win = self.menu_win()
-            self.server.menu_lose = self.menu_lose()
+            self.server.announce(device_name())
             self.root.ids.nickname_label.text = \
                 f"Nickname: [color=#ff0000][b]{self.server.nickname}[/b][/color]"
             self.single_player = False
@@ -90,16 +122,33 @@ class MainApp(MDApp):
         elif self.client:
             snackbar("Already running as client!")
         else:
+            from client import Client
+            from discovery import Discovery
+            self.sequence = None
             self.client = Client()
             self.server_ip_dialog = self.dialog_box()
             self.server_ip_dialog.open()
+            # List the games announced on the LAN while the dialog is open
+            self.discovery = Discovery(self.update_server_list)
+            self.discovery.start()
 
     def dialog_box(self):
         """Create a dialog box for server IP input."""
+        from kivymd.uix.button import MDButton, MDButtonText
+        from kivymd.uix.dialog import MDDialog, MDDialogHeadlineText, MDDialogContentContainer
+        from kivymd.uix.label import MDLabel
+        from kivymd.uix.textfield import MDTextField, MDTextFieldHintText
+
         dialog = MDDialog(
-            MDDialogHeadlineText(text="Enter Server IP"),
+            MDDialogHeadlineText(text="Join a Game"),
             MDDialogContentContainer(
                 MDBoxLayout(
+                    MDBoxLayout(
+                        MDLabel(text="Looking for games...", adaptive_height=True),
+                        id="server_list",
+                        orientation="vertical",
+                        adaptive_height=True,
+                    ),
                     MDTextField(
                         MDTextFieldHintText(text="Server IP"),
                         id="text_field",
@@ -107,11 +156,22 @@ class MainApp(MDApp):
                         pos_hint={"center_x": .5, "top": 1},
                         size_hint_x=.8,
                     ),
+                    MDTextField(
+                        MDTextFieldHintText(text="Room (optional)"),
+                        id="room_field",
+                        mode="outlined",
+                        pos_hint={"center_x": .5},
+                        size_hint_x=.8,
+                    ),
                     MDBoxLayout(
                         MDButton(
                             MDButtonText(text="Connect"),
                             on_release=lambda obj: self.dialog_connect(),
                         ),
+                        MDButton(
+                            MDButtonText(text="Watch"),
+                            on_release=lambda obj: self.dialog_connect(watch=True),
+                        ),
                         MDButton(
                             MDButtonText(text="Close"),
                             on_release=lambda obj: self.dialog_close(),
@@ -127,41 +187,106 @@ class MainApp(MDApp):
                 ),
             ),
             size_hint=(.1, .1),
+            on_dismiss=lambda obj: self.stop_discovery(),
         )
         return dialog
 
-    def dialog_connect(self):
-        """Handle connect button in dialog."""
-        self.client.server_addr = self.server_ip_dialog.get_ids().text_field.text
-        self.server_ip_dialog.dismiss()
+    @mainthread
+    def update_server_list(self, servers: list["FoundServer"]):
+        """Show the games found on the LAN in the dialog, closest first."""
+        from kivymd.uix.label import MDLabel
+        from kivymd.uix.list import MDListItem, MDListItemHeadlineText, MDListItemSupportingText
+
+        if not self.server_ip_dialog:
+            return
+        server_list = self.server_ip_dialog.get_ids().server_list
+        server_list.clear_widgets()
+        if not servers:
+            server_list.add_widget(MDLabel(text="Looking for games...", adaptive_height=True))
+        for found in servers:
+            rtt = f", {found.rtt_ms:.0f} ms" if found.rtt_ms is not None else ""
+            server_list.add_widget(MDListItem(
+                MDListItemHeadlineText(text=found.name),
+                MDListItemSupportingText(text=f"{found.n_players} players, max score {found.max_score}{rtt}"),
+                on_release=lambda obj, found=found: self.dialog_join(found),
+            ))
+
+    def dialog_join(self, found: "FoundServer"):
+        """Handle a tap on a game found on the LAN."""
+        self.client.server_addr = None
+        self.client.server_addrs = found.addrs
+        self.client.server_port = found.port
+        self.dialog_connect(typed=False)
+
+    def dialog_connect(self, typed: bool = True, watch: bool = False):
+        """Handle connect (or watch, as a spectator) button in dialog."""
+        self.client.spectator = watch
+        if typed:
+            self.client.server_addr = self.server_ip_dialog.get_ids().text_field.text.strip()
+        room = self.server_ip_dialog.get_ids().room_field.text.strip()
+        self.client.room = room if room.isascii() and room.isalnum() else None
+        self.dialog_dismiss()
         self.client_connect()
 
     def dialog_close(self):
         """Handle close button in dialog."""
-        self.server_ip_dialog.dismiss()
+        self.dialog_dismiss()
         self.client = None
 
+    def dialog_dismiss(self):
+        """Close the dialog (see on_dismiss below)."""
+        self.server_ip_dialog.dismiss()
+
+    def stop_discovery(self):
+        """The dialog is closed, stop looking for games."""
+        self.server_ip_dialog = None
+        if self.discovery:
+            self.discovery.stop()
+            self.discovery = None
+
     def client_connect(self):
-        """Connect client to server using provided IP."""
-        print(f"Server IP provided: {self.client.server_addr}")
-        self.client.start_client()
-        if self.client.is_connected:
-            self.client.menu_win = self.menu_win()
-            self.client.menu_lose = self.menu_lose()
-            color = self.client.colors[self.client.idx]
-            self.root.ids.nickname_label.text = \
-                f"Nickname: [color={color}][b]{self.client.nickname}[/b][/color]"
+        """Connect client to server in the background, the UI stays responsive meanwhile."""
+        print(f"Server IP provided: {self.client.server_addr or self.client.server_addrs}")
+        snackbar("Connecting...")
+        Thread(target=self.connect_in_background, args=(self.client,), daemon=True).start()
+
+    def connect_in_background(self, client: "Client"):
+        """Thread function connecting a client (at most 2 s)."""
+        client.start_client()
+        self.client_connected(client)
+
+    @mainthread
+    def client_connected(self, client: "Client"):
+        """Back on the UI thread once the connection succeeded or failed."""
+        if client is not self.client:
+            # Back home or closed while connecting
+            if client.is_connected:
+                client.close_connection(by_client=True)
+        elif client.is_connected:
+            self.root.ids.ip_label.text = f"Your IP: {client.ip_addr}"
+            if client.spectator:
+                self.root.ids.nickname_label.text = "Watching"
             self.single_player = False
         else:
             self.client = None
             snackbar("Connection refused!")
 
     def random_id(self):
-        """Randomly select the next highlighted button."""
-        btn_id = random.sample(range(1, 5), 1)[0]
+        """Select the next highlighted button: the next of the race's sequence, or a random one."""
+        if self.sequence:
+            btn_id = self.sequence[self.presses]
+        else:
+            btn_id = random.sample(range(1, 5), 1)[0]
         self.last_id = btn_id
         self.change_button_color(btn_id, 1)
 
+    def new_sequence(self, seed: int):
+        """A race (or reset) with the button sequence of seed: highlight its first button."""
+        self.change_button_color(self.last_id, .2)
+        self.sequence = ButtonSequence(seed)
+        self.presses = 0
+        self.random_id()
+
     def change_button_color(self, btn_id: int, val: float):
         """Change the color intensity of a button."""
         match btn_id:
@@ -195,7 +320,7 @@ class MainApp(MDApp):
 
     def set_max_score(self, score: int):
         self.max_score = score
-        self.settings.dismiss()
+        self.menus.dismiss("settings")
         snackbar(f"Max Score: {score}")
 
     def settings_menu_items(self):
@@ -208,6 +333,7 @@ class MainApp(MDApp):
         return menu_items
 
     def settings_menu(self):
+        from kivymd.uix.menu import MDDropdownMenu
         menu = MDDropdownMenu(
             # header_cls=MenuHeader(),
             caller=self.screen.ids.settings,
@@ -236,6 +362,7 @@ class MainApp(MDApp):
 
     def menu_header(self):
         """Create the top bar menu object."""
+        from kivymd.uix.menu import MDDropdownMenu
         menu = MDDropdownMenu(
             header_cls=MenuHeader(),
             caller=self.screen.ids.menu_btn,
@@ -245,6 +372,7 @@ class MainApp(MDApp):
 
     def menu_win(self):
         """Create the win menu."""
+        from kivymd.uix.menu import MDDropdownMenu
         menu_win = MDDropdownMenu(
             header_cls=MenuWin(),
             caller=self.screen.ids.count_label,
@@ -255,6 +383,7 @@ class MainApp(MDApp):
 
     def menu_lose(self):
         """Create the lose menu."""
+        from kivymd.uix.menu import MDDropdownMenu
         menu_lose = MDDropdownMenu(
             header_cls=MenuLose(),
             caller=self.screen.ids.count_label,
@@ -267,28 +396,7 @@ class MainApp(MDApp):
         """Reset values on the screen."""
         self.root.ids.count_label.text = "0"
 
-        # Reset progress bar values based on mode
-        if self.server:
-            for i in range(self.server.n_players):
-                self.server.prog_bars[i].value = 0
-        elif self.client:
-            for i in range(self.client.n_players):
-                self.client.prog_bars[i].value = 0
-        else:
-            for i in range(len(self.prog_bars)):
-                self.prog_bars[i].value = 0
-
-    def remove_prog_bars(self):
-        """Remove progress bars from the grid layout."""
-        prog_bar_grid = self.root.ids.prog_bar_grid
-        children = prog_bar_grid.children.copy()
-        for child in children:
-            prog_bar_grid.remove_widget(child)
-
-        if self.server:
-            self.server.prog_bars = []
-        else:
-            self.prog_bars = []
+        self.root.ids.scoreboard.reset()
 
     """
     ==================== APP EVENTS =====================================
@@ -296,14 +404,15 @@ class MainApp(MDApp):
     def on_start_btn(self):
         """Handle start button press."""
         # For server mode
-        if self.server and self.server.clients:
-            self.server.broadcast(f'MAX_SCORE: {self.max_score}&')
-            self.server.broadcast(f'STARTED_BY_SERVER&')
+        if self.server and self.server.players:
+            self.server.max_score = self.max_score
+            self.server.reset_scores()
+            # Both messages are coalesced into a single write per client
+            self.server.broadcast((MAX_SCORE, self.max_score), (STARTED_BY_SERVER,))
             self.server.start_game_screen()
         # For client mode
         elif self.client:
-            self.client.client.send(f'MAX_SCORE: {self.max_score}&'.encode('ascii'))
-            self.client.client.send('STARTED_BY_CLIENT&'.encode('ascii'))
+            self.client.send((MAX_SCORE, self.max_score), (STARTED_BY_CLIENT,))
         # For single player mode
         else:
             if self.server:
@@ -311,18 +420,20 @@ class MainApp(MDApp):
                 self.server = None
                 self.single_player = True
 
-            # Add progress bar and change to screen B
-            prog_bar, panel = add_prog_bar(num=0, max_score=self.max_score)
-            self.prog_bars.append(prog_bar)
-            self.root.ids.prog_bar_grid.add_widget(panel)
+            # Reset the scoreboard for one player and change to screen B
+            self.sequence = None
+            self.root.ids.scoreboard.set_players(1, self.max_score)
             self.root.current = "screen B"
 
     def on_press(self, btn_id: int):
         """Handle game button press."""
+        # Spectators only watch
+        if self.client and self.client.spectator:
+            return
+
         # Remove button color intensity
         self.change_button_color(self.last_id, .2)
-
-        print(f"Max score: {self.max_score}")
+        self.presses += 1
 
         # Pressing the correct button
         if btn_id == self.last_id:
@@ -331,35 +442,47 @@ class MainApp(MDApp):
                 self.count += 1
                 # Update counter and progress bar
                 self.root.ids.count_label.text = str(self.count)
-                self.prog_bars[0].value = self.count
+                self.root.ids.scoreboard.set_score(0, self.count)
                 # Verify if won
                 if self.count == self.max_score:
-                    self.menu_finish.open()
+                    self.menus.open("win")
             # For server mode
             elif self.server and not self.single_player:
                 self.server.count += 1
                 self.server.update_counter(self.server.count, 0)
-                self.server.players_score[0] = self.server.count
-                # Send count to all clients
-                message = f"COUNT-{self.server.nickname}: {self.server.count}&"
-                self.server.broadcast(message)
-                print(f"To Client: {message}")
-                # Check if won
+                # Send count to all clients (with the next snapshot)
+                self.server.update_score(0, self.server.count, clock_us())
+                if netlog.level:
+                    netlog.message("host tap", (COUNT, 1, self.server.count))
+                # Check if won (the server confirms it and sends LOSE to the others)
                 if self.server.count == self.max_score:
-                    self.server.menu_win.open()
-                    self.server.broadcast('LOSE&')
+                    self.menus.open("win")
             # For client mode
             elif self.client:
-                # Update counter
+                # Update counter and progress bar right away, the server reconciles them
                 self.client.count += 1
-                # Send count to server
-                message = f"COUNT-{self.client.nickname}: {self.client.count}&"
-                self.client.client.send(message.encode('ascii'))
-                print(f"To Server: {message}")
-                # Check if won
+                self.client.update_counter(self.client.count, self.client.idx)
+                # Send the press with the next batch (the server counts the hits), or the count
+                if self.sequence:
+                    self.client.add_tap(self.sequence.seed, btn_id, win=self.client.count >= self.max_score)
+                else:
+                    message = (COUNT, self.client.idx + 1, self.client.count, self.client.stamp_tap())
+                    self.client.send(message)
+                    if netlog.level:
+                        netlog.message("to server", message)
+                # Check if won (the server confirms it, an old one relays this LOSE)
                 if self.client.count == self.max_score:
-                    self.client.menu_win.open()
-                    self.client.client.send('LOSE&'.encode('ascii'))
+                    self.menus.open("win")
+                    self.client.send((LOSE,))
+
+        # Pressing a wrong button, counted as a miss in the match log
+        elif self.server and not self.single_player:
+            self.server.record_miss(0)
+        elif self.client and not self.single_player:
+            if self.sequence:
+                self.client.add_tap(self.sequence.seed, btn_id)
+            else:
+                self.client.send((MISS,))
 
         # Generate next button with high intensity color
         self.random_id()
@@ -370,44 +493,47 @@ class MainApp(MDApp):
         if self.single_player:
             self.count = 0
             self.reset_uix_values()
-            self.top_menu.dismiss()
-            self.menu_finish.dismiss()
+            self.menus.dismiss("top")
+            self.menus.dismiss("win")
         # Reset for server mode
         elif self.server:
             self.server.count = 0
             self.reset_uix_values()
-            self.top_menu.dismiss()
-            self.server.menu_win.dismiss()
-            self.server.menu_lose.dismiss()
-            self.server.broadcast('RESET&')
+            self.menus.dismiss("top")
+            self.menus.dismiss("win")
+            self.menus.dismiss("lose")
+            self.server.reset_scores()
+            self.server.broadcast((RESET,))
         # Reset for client mode
         elif self.client:
-            self.top_menu.dismiss()
+            self.menus.dismiss("top")
             if self.client.is_connected:
-                self.client.client.send('RESET&'.encode('ascii'))
+                self.client.send((RESET,))
 
     def on_back_home(self):
         """Return to home screen."""
         # For single player mode
         if self.single_player:
             self.on_reset()
-            self.remove_prog_bars()
-            self.top_menu.dismiss()
+            self.menus.dismiss("top")
             self.root.ids.nickname_label.text = ""
             self.root.current = "screen A"
         # For  server mode
         elif self.server:
-            self.server.broadcast('RESTARTED_BY_SERVER&')
+            self.server.broadcast((RESTARTED_BY_SERVER,))
             self.server.update_reset()
             self.server.update_back_home()
             self.server.close_connection(close_clients=False)
             self.server = None
-            self.top_menu.dismiss()
+            self.menus.dismiss("top")
         # For client mode
         elif self.client:
-            self.top_menu.dismiss()
+            self.menus.dismiss("top")
             if self.client.is_connected:
-                self.client.client.send('RESTARTED_BY_CLIENT&'.encode('ascii'))
+                self.client.send((RESTARTED_BY_CLIENT,))
+            else:
+                # Still reconnecting, stop trying
+                self.client.close_connection(by_client=True)
             self.client = None
 
     def on_exit(self):
@@ -420,6 +546,8 @@ class MainApp(MDApp):
         elif self.client:
             self.client.close_connection(by_client=False)
             print("Client closed!")
+        if self.leaderboard:
+            self.leaderboard.close()
 
         # Close app
         self.stop()
@@ -436,6 +564,20 @@ class MainApp(MDApp):
         """Run on app initialization."""
         # Generate random id for the first highlighted button
         self.random_id()
+        Window.bind(on_flip=self.on_first_frame)
+
+    def on_first_frame(self, window):
+        """Screen A is on screen: start loading what the other screens need."""
+        Window.unbind(on_flip=self.on_first_frame)
+        # Find the LAN addresses in the background, Host and Join then read the cache
+        netinfo.watch()
+        Clock.schedule_once(lambda dt: self.preload(list(DEFERRED_IMPORTS)))
+
+    def preload(self, modules: list[str]):
+        """Import the deferred modules one per frame, so screen A stays responsive."""
+        importlib.import_module(modules.pop(0))
+        if modules:
+            Clock.schedule_once(lambda dt: self.preload(modules))
 
     def build(self):
         """Build the app layout."""
@@ -0,0 +1,374 @@
+"""Match recorder: an append-only binary log of the game events of a server.
+
+A log is a 32 byte header followed by fixed-width 16 byte records:
+    header  magic b"TAPLOG", version, record size, start (epoch, us)
+    record  time since the start (us), event, player id, value
+Events are the joins and leaves, MAX_SCORE (value), STARTED, every accepted
+COUNT (value: the score) and MISS (a press on a button that was not
+highlighted), WINNER, LOSE, RESET and RESTARTED, in time order.
+A race of 8 players to 50 is about 7 kB.
+
+MatchRecorder packs records into a bytearray on the server loop thread and
+hands full buffers (or whatever is buffered after FLUSH_INTERVAL) to a
+single background writer thread per process, so the receive path never
+waits for the disk.
+
+MatchLog maps a finished log with mmap: records are read in place, no file
+read or parse up front, and a sparse index (the time of every INDEX_STRIDE
+th record) finds any timestamp in a binary search and a short scan.
+replay() rebuilds the game state at the seek point and plays the events on
+into a consumer at any speed: a Client (its update_counter,
+start_game_screen, ... methods are the same as live) or anything with the
+methods of Printer.
+
+Run from the myapp directory:
+    python -m matchlog logs/*.taplog                     summary of each log
+    python -m matchlog LOG --replay --seek 10 --speed 4  replay from 10 s on
+"""
+import argparse
+import atexit
+import mmap
+import os
+import struct
+import time
+from bisect import bisect_right
+from collections import deque
+from threading import Event, Thread
+from typing import NamedTuple
+from netloop import EventLoop, TimerHandle
+from protocol import (
+    MAX_SCORE, STARTED_BY_SERVER, STARTED_BY_CLIENT, LOSE, RESET, RESTARTED_BY_SERVER,
+    RESTARTED_BY_CLIENT, WINNER,
+)
+
+MAGIC = b"TAPLOG"
+VERSION = 1
+HEADER = struct.Struct("<6sHHQ14x")
+RECORD = struct.Struct("<QBxHI")
+FLUSH_BYTES = 64 * 1024     # Buffered bytes handed to the writer at once
+FLUSH_INTERVAL = 1.0        # Seconds a record may wait in the buffer
+INDEX_STRIDE = 256          # Records between two entries of the sparse index
+
+# Events
+JOIN = 1
+LEAVE = 2
+MAX = 3                     # value: max score
+START = 4
+COUNT = 5                   # value: score
+WIN = 6
+LOST = 7
+CLEAR = 8                   # Scores reset
+HOME = 9                    # Back to the home screen
+MISSED = 10                 # Wrong button pressed
+EVENT_NAMES = {JOIN: "JOIN", LEAVE: "LEAVE", MAX: "MAX_SCORE", START: "STARTED", COUNT: "COUNT",
+               WIN: "WINNER", LOST: "LOSE", CLEAR: "RESET", HOME: "RESTARTED", MISSED: "MISS"}
+
+# Broadcast messages that are match events (counts are recorded as they are taken)
+_MESSAGE_EVENTS = {
+    MAX_SCORE: MAX, STARTED_BY_SERVER: START, STARTED_BY_CLIENT: START, WINNER: WIN, LOSE: LOST,
+    RESET: CLEAR, RESTARTED_BY_SERVER: HOME, RESTARTED_BY_CLIENT: HOME,
+}
+
+_writes: deque = deque()    # (file, data): data None closes the file, file None sets the Event data
+_wakeup = Event()
+_writer: Thread | None = None
+
+
+def _submit(file, data: bytes | None) -> None:
+    global _writer
+    _writes.append((file, data))
+    if _writer is None:
+        _writer = Thread(target=_write_buffers, name="matchlog", daemon=True)
+        _writer.start()
+        atexit.register(drain)
+    _wakeup.set()
+
+
+def _write_buffers() -> None:
+    while True:
+        _wakeup.wait()
+        _wakeup.clear()
+        while _writes:
+            file, data = _writes.popleft()
+            try:
+                if file is None:
+                    data.set()
+                elif data is None:
+                    file.close()
+                else:
+                    file.write(data)
+            except OSError as e:
+                print(f"matchlog: error writing {file.name}: {e}")
+
+
+def drain() -> None:
+    """Wait for the writer to write everything queued (at exit, or before a worker process ends)."""
+    done = Event()
+    _writes.append((None, done))
+    _wakeup.set()
+    done.wait(5)
+
+
+class Record(NamedTuple):
+    time_us: int            # Since the start of the log
+    event: int
+    player_id: int
+    value: int
+
+
+class MatchRecorder:
+    """Appends the events of one server (or lobby room) to a log file, on its loop thread."""
+    def __init__(self, path: str, loop: EventLoop):
+        self.path = path
+        self.loop = loop
+        self.file = open(path, "xb", buffering=0)
+        self.started = time.monotonic_ns() // 1000
+        self.file.write(HEADER.pack(MAGIC, VERSION, RECORD.size, time.time_ns() // 1000))
+        self.buffer = bytearray()
+        self.timer: TimerHandle | None = None
+        self.last_us: int = 0
+
+    @classmethod
+    def in_directory(cls, directory: str, name: str, loop: EventLoop) -> "MatchRecorder":
+        """New log in directory, named after the start time and name."""
+        os.makedirs(directory, exist_ok=True)
+        stem = os.path.join(directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{name}")
+        suffix = ""
+        while True:
+            try:
+                return cls(f"{stem}{suffix}.taplog", loop)
+            except FileExistsError:
+                suffix = f"-{int(suffix[1:] or 1) + 1}"
+
+    def add(self, event: int, player_id: int = 0, value: int = 0, ago_us: int = 0) -> None:
+        """Record an event now, or ago_us before (a batched tap), never before the last one."""
+        self.last_us = max(time.monotonic_ns() // 1000 - self.started - ago_us, self.last_us)
+        self.buffer += RECORD.pack(self.last_us, event, player_id, value)
+        if len(self.buffer) >= FLUSH_BYTES:
+            self.flush()
+        elif not self.timer:
+            self.timer = self.loop.call_later(FLUSH_INTERVAL, self.flush)
+
+    def message(self, message: tuple) -> None:
+        """Record a broadcast message if it is a match event."""
+        event = _MESSAGE_EVENTS.get(message[0])
+        if event == MAX:
+            self.add(MAX, 0, message[1])
+        elif event == WIN:
+            self.add(WIN, message[1])
+        elif event:
+            self.add(event)
+
+    def flush(self) -> None:
+        """Hand the buffered records to the writer thread."""
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+        if self.buffer:
+            _submit(self.file, bytes(self.buffer))
+            self.buffer.clear()
+
+    def close(self) -> None:
+        self.flush()
+        _submit(self.file, None)
+
+
+class ReplayState:
+    """Game state rebuilt from the events, as the clients saw it."""
+    def __init__(self):
+        self.players: set[int] = set()
+        self.scores: list[int] = []
+        self.max_score: int = 10
+        self.winner: int | None = None
+        self.racing: bool = False
+
+    @property
+    def n_players(self) -> int:
+        return len(self.scores)
+
+    def apply(self, event: int, player_id: int, value: int) -> None:
+        if event == JOIN:
+            self.players.add(player_id)
+        elif event == LEAVE:
+            self.players.discard(player_id)
+        elif event == MAX:
+            self.max_score = value
+        elif event == START:
+            self.scores = [0] * self.n_players
+            self.winner = None
+            self.racing = True
+        elif event == COUNT and player_id <= len(self.scores):
+            self.scores[player_id - 1] = value
+        elif event == WIN:
+            self.winner = player_id
+        elif event == LOST:
+            self.racing = False
+        elif event in (CLEAR, HOME):
+            self.scores = [0] * self.n_players
+            self.winner = None
+            self.racing = False
+        if event in (JOIN, LEAVE):
+            n_players = max(self.players, default=0)
+            self.scores = (self.scores + [0] * n_players)[:n_players]
+
+
+class MatchLog:
+    """A recorded match log, memory-mapped for scanning, seeking and replay."""
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, record_size, self.start_epoch_us = HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+            self.map.close()
+            raise ValueError(f"{path} is not a version {VERSION} match log")
+        # A record torn by a crash is left out
+        self.n_records = (len(self.map) - HEADER.size) // RECORD.size
+        self.index = [self.time_at(i) for i in range(0, self.n_records, INDEX_STRIDE)]
+
+    def __len__(self) -> int:
+        return self.n_records
+
+    def close(self) -> None:
+        self.map.close()
+
+    def time_at(self, i: int) -> int:
+        return RECORD.unpack_from(self.map, HEADER.size + i * RECORD.size)[0]
+
+    def __getitem__(self, i: int) -> Record:
+        return Record(*RECORD.unpack_from(self.map, HEADER.size + i * RECORD.size))
+
+    def events(self, start: int = 0, stop: int | None = None):
+        """Events start to stop (record numbers), read in place."""
+        stop = self.n_records if stop is None else stop
+        view = memoryview(self.map)[HEADER.size + start * RECORD.size:HEADER.size + stop * RECORD.size]
+        try:
+            for time_us, event, player_id, value in RECORD.iter_unpack(view):
+                yield Record(time_us, event, player_id, value)
+        finally:
+            view.release()
+
+    @property
+    def duration_us(self) -> int:
+        return self.time_at(self.n_records - 1) if self.n_records else 0
+
+    def seek(self, time_us: int) -> int:
+        """Number of the first record at or after time_us."""
+        block = max(bisect_right(self.index, time_us) - 1, 0)
+        i = block * INDEX_STRIDE
+        stop = min(i + INDEX_STRIDE + 1, self.n_records)
+        while i < stop and self.time_at(i) < time_us:
+            i += 1
+        return i
+
+    def state_at(self, time_us: int) -> tuple[ReplayState, int]:
+        """Game state just before time_us, and the record to go on from."""
+        stop = self.seek(time_us)
+        state = ReplayState()
+        for _, event, player_id, value in self.events(0, stop):
+            state.apply(event, player_id, value)
+        return state, stop
+
+    def replay(self, consumer, speed: float = 1.0, start_us: int = 0) -> ReplayState:
+        """Play the events from start_us on into consumer, speed times as fast (0: no waiting)."""
+        state, first = self.state_at(start_us)
+        # Bring the consumer to the state at the seek point
+        consumer.update_players(state.n_players)
+        consumer.update_max_score(state.max_score)
+        if state.racing or any(state.scores):
+            consumer.start_game_screen()
+            for idx, count in enumerate(state.scores):
+                if count:
+                    consumer.update_counter(count, idx)
+
+        started = time.monotonic()
+        for time_us, event, player_id, value in self.events(first):
+            if speed:
+                delay = (time_us - start_us) / 1e6 / speed - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            before = state.n_players
+            state.apply(event, player_id, value)
+            if state.n_players != before:
+                consumer.update_players(state.n_players)
+            if event == MAX:
+                consumer.update_max_score(value)
+            elif event == START:
+                consumer.start_game_screen()
+            elif event == COUNT:
+                consumer.update_counter(value, player_id - 1)
+            elif event == WIN:
+                consumer.update_winner(player_id - 1)
+            elif event == CLEAR:
+                consumer.update_reset()
+            elif event == HOME:
+                consumer.update_reset()
+                consumer.update_back_home()
+        return state
+
+
+class Printer:
+    """Headless replay consumer, prints what the screen would show."""
+    def update_players(self, n_players: int):
+        print(f"players: {n_players}")
+
+    def update_max_score(self, max_score: int):
+        print(f"max score: {max_score}")
+
+    def start_game_screen(self):
+        print("race started")
+
+    def update_counter(self, count: int, idx: int, tap_time: int = 0):
+        print(f"  P{idx + 1}: {count}")
+
+    def update_winner(self, idx: int):
+        print(f"winner: P{idx + 1}")
+
+    def update_reset(self):
+        print("scores reset")
+
+    def update_back_home(self):
+        print("back home")
+
+
+def summary(log: MatchLog) -> str:
+    """One line about a log: length, events, races and winners."""
+    races, winners, counts = 0, [], 0
+    for _, event, player_id, _ in log.events():
+        if event == START:
+            races += 1
+        elif event == WIN:
+            winners.append(f"P{player_id}")
+        elif event == COUNT:
+            counts += 1
+    started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(log.start_epoch_us / 1e6))
+    return (f"{log.path}: {started}, {log.duration_us / 1e6:.1f} s, {len(log)} events, {counts} counts, "
+            f"{races} races, winners {' '.join(winners) or '-'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tap Race match logs")
+    parser.add_argument("logs", nargs="+", metavar="LOG")
+    parser.add_argument("--replay", action="store_true", help="replay the (first) log on the terminal")
+    parser.add_argument("--seek", type=float, default=0.0, help="replay from this many seconds in")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed, 0 for no waiting")
+    args = parser.parse_args()
+
+    if args.replay:
+        log = MatchLog(args.logs[0])
+        state = log.replay(Printer(), speed=args.speed, start_us=int(args.seek * 1e6))
+        print(f"final scores: {state.scores}")
+        log.close()
+        return
+    for path in args.logs:
+        try:
+            log = MatchLog(path)
+        except (OSError, ValueError) as e:
+            print(f"{path}: {e}")
+            continue
+        print(summary(log))
+        log.close()
+
+
+if __name__ == "__main__":
+    main()
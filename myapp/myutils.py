@@ -1,21 +1,55 @@
-import netifaces as ni
+import colorsys
+import os
+import secrets
+import socket
+import netinfo
+from functools import lru_cache
+from kivy.clock import Clock
+from kivy.metrics import dp
+from kivy.properties import NumericProperty, StringProperty
+from kivy.uix.recycleview import RecycleView
 from kivymd.uix.snackbar import MDSnackbar, MDSnackbarText
-from kivymd.uix.label import MDLabel
-from kivymd.uix.floatlayout import MDFloatLayout
 from kivymd.uix.boxlayout import MDBoxLayout
-from kivymd.uix.progressindicator import MDLinearProgressIndicator
+from protocol import MAX_NAME_LEN
 
 
 # ================== GET WIFI ADDRESS IF CONNECTED ======================
 def get_wifi_addr() -> str:
-    interfaces = ni.interfaces()                # Get all available interfaces
-    wifi_addr = "Not connected to WIFI!"        # Get WIFI address if connected
-    for interface in interfaces:
-        addr = ni.ifaddresses(interface)        # Get interface info
-        is_up = ni.AF_INET in addr              # Check if it has IPv4 addr (is up)
-        if is_up and addr[2][0]['addr'].startswith("192.168"):
-            wifi_addr = addr[2][0]['addr']      # Check if it is up and if it starts with 192.168
-    return wifi_addr
+    """Best LAN address of this device (cached by netinfo, rescanned when the network changes)."""
+    return netinfo.best_addr() or "Not connected to WIFI!"
+
+
+def device_name() -> str:
+    """Name announced to the LAN for a game hosted on this device."""
+    name = socket.gethostname().split(".")[0]
+    return "Tap Race" if name in ("", "localhost") else name
+
+
+@lru_cache(maxsize=None)
+def player_name(data_dir: str) -> str:
+    """Leaderboard name of this install, made up once and kept in data_dir (phones all share a hostname)."""
+    path = os.path.join(data_dir, "player_name.txt")
+    try:
+        with open(path, encoding="utf-8") as f:
+            name = f.read().strip()[:MAX_NAME_LEN]
+        if name:
+            return name
+    except OSError:
+        pass
+    name = f"{device_name()[:MAX_NAME_LEN - 5]}-{secrets.token_hex(2)}"
+    try:
+        os.makedirs(data_dir, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(name)
+    except OSError as e:
+        print(f"Player name not saved: {e}")
+    return name
+
+
+def ip_label_text() -> str:
+    """Text of the home screen IP label: every LAN address, the best one first."""
+    addrs = [address.addr for address in netinfo.addresses()]
+    return f"Your IP: {', '.join(addrs)}" if addrs else "Not connected to WIFI!"
 
 
 # ================== DISPLAY SNACK BAR AT THE BOTTOM ==================
@@ -32,33 +66,160 @@ def snackbar(message: str) -> None:
         duration=2,
     ).open()
 
-# ================== PROGRESS BAR WIDGET ===============================
-def add_prog_bar(num: int, max_score: int) -> (MDLinearProgressIndicator, MDBoxLayout):
-    colors = ["#ff1717", "#17ff17", "#1717ff", "#ffff17", '#17ffff', '#8817ff']
-    label = MDLabel(
-        markup=True,
-        text=f"[color={colors[num]}][b]P{num + 1}[/color][/b]",
-        theme_font_size="Custom",
-        font_size="20sp",
-        adaptive_width=True,
-        pos_hint={'center_y': .5},
-    )
-    prog_bar = MDLinearProgressIndicator(
-        value=0,
-        max=max_score,
-        size_hint_y=None,
-        height="10dp",
-        pos_hint={'center_x': .5, 'center_y': .5},
-    )
-    panel = MDBoxLayout(
-        label,
-        MDFloatLayout(
-            prog_bar,
-            size_hint=(1, 1)
-        ),
-        spacing="8dp"
-    )
-    return prog_bar, panel
+# ================== PLAYER COLORS =====================================
+BASE_COLORS = ["#ff1717", "#17ff17", "#1717ff", "#ffff17", '#17ffff', '#8817ff']
+
+
+@lru_cache(maxsize=None)
+def player_color(num: int) -> str:
+    """Color of player num (0-based): the six base colors, then hues spread by the golden angle."""
+    if num < len(BASE_COLORS):
+        return BASE_COLORS[num]
+    red, green, blue = colorsys.hsv_to_rgb((num * 0.618033988749895) % 1, .85, 1)
+    return f"#{int(red * 255):02x}{int(green * 255):02x}{int(blue * 255):02x}"
+
+
+def player_label(num: int) -> str:
+    """Colored nickname markup of player num (0-based)."""
+    return f"[color={player_color(num)}][b]P{num + 1}[/b][/color]"
+
+
+# ================== SCOREBOARD ========================================
+class ScoreRow(MDBoxLayout):
+    """A player row of the Scoreboard, recycled and set from its data dict (layout.kv)."""
+    nickname = StringProperty("")
+    value = NumericProperty(0)
+    max_score = NumericProperty(10)
+
+
+class Scoreboard(RecycleView):
+    """Progress bar per player where only the rows on screen are widgets.
+
+    A small room fills the board like the old panels did; rows never get
+    smaller than MIN_ROW_HEIGHT, a larger room scrolls, so the UI cost stays
+    the same for 6 or 200 players. Scores change the data in place and
+    refresh the visible rows once per frame.
+
+    The board is declared once in layout.kv and kept for the whole session:
+    a new game resets the rows of the last one in place.
+    """
+    MIN_ROW_HEIGHT = dp(28)
+    SPACING = dp(8)
+    row_height = NumericProperty(dp(40))
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.max_score: int = 10
+        self._refresh = Clock.create_trigger(lambda dt: self.refresh_from_data())
+        self.bind(height=self.fit_rows)
+
+    def set_players(self, n_players: int, max_score: int) -> None:
+        """One row per player, all scores at zero (rows of the last game are reused)."""
+        self.max_score = max_score
+        rows = self.data[:n_players]
+        for row in rows:
+            row["value"] = 0
+            row["max_score"] = max_score
+        rows.extend(self.row(num) for num in range(len(rows), n_players))
+        self.data = rows
+        self.fit_rows()
+
+    def row(self, num: int) -> dict:
+        return {"nickname": player_label(num), "value": 0, "max_score": self.max_score}
+
+    def set_score(self, idx: int, count: int) -> None:
+        """Show a player score (rows are added for players who joined during the game)."""
+        if idx >= len(self.data):
+            self.data.extend(self.row(num) for num in range(len(self.data), idx + 1))
+            self.fit_rows()
+        self.data[idx]["value"] = count
+        self._refresh()
+
+    def reset(self) -> None:
+        """Put every score back to zero."""
+        for row in self.data:
+            row["value"] = 0
+        self._refresh()
+
+    def fit_rows(self, *args) -> None:
+        n_rows = max(len(self.data), 1)
+        self.row_height = max(self.MIN_ROW_HEIGHT, (self.height - self.SPACING * (n_rows - 1)) / n_rows)
+
+
+# ================== LAZY WIDGETS ======================================
+class WidgetPool:
+    """Widgets built on first use and kept for the next games.
+
+    Each widget has a factory; get() builds it the first time it is needed
+    and returns the same instance afterwards, so a menu nobody opens is never
+    built and a menu opened every game is built once per app.
+    """
+    def __init__(self, **factories):
+        self.factories = factories
+        self.widgets: dict = {}
+
+    def get(self, name: str):
+        widget = self.widgets.get(name)
+        if widget is None:
+            widget = self.widgets[name] = self.factories[name]()
+        return widget
+
+    def open(self, name: str) -> None:
+        self.get(name).open()
+
+    def dismiss(self, name: str) -> None:
+        """Dismiss a widget if it was built (nothing to dismiss otherwise)."""
+        if name in self.widgets:
+            self.widgets[name].dismiss()
+
+
+# ================== FRAME-SYNCHRONIZED SCORE UPDATES ==================
+class ScoreBuffer:
+    """Score updates from the network threads, applied to the UI once per frame.
+
+    Network threads only store the latest score of a player and mark it dirty
+    (a dict store and a set add, atomic under the GIL, no lock), then fire a
+    Clock trigger that runs at most once per frame however many times it is
+    fired. That frame callback starts the game screen or resets it if asked
+    and sets each dirty progress bar once, to its latest value.
+    """
+    def __init__(self, start_game_screen, reset, set_score):
+        self.apply_start = start_game_screen        # () -> None
+        self.apply_reset = reset                    # () -> None
+        self.apply_score = set_score                # (idx, count, tap_time) -> None
+        self._scores: dict[int, tuple[int, int]] = {}
+        self._dirty: set[int] = set()
+        self._start: bool = False
+        self._reset: bool = False
+        self._trigger = Clock.create_trigger(self._apply)
+
+    def set_score(self, idx: int, count: int, tap_time: int = 0) -> None:
+        """Store the latest score of player idx (any thread)."""
+        self._scores[idx] = (count, tap_time)
+        self._dirty.add(idx)
+        self._trigger()
 
+    def start(self) -> None:
+        """Start the game screen on the next frame (any thread)."""
+        self._start = True
+        self._trigger()
 
+    def reset(self) -> None:
+        """Reset the game screen on the next frame, dropping the scores not shown yet (any thread)."""
+        self._dirty.clear()
+        self._reset = True
+        self._trigger()
 
+    def _apply(self, dt) -> None:
+        if self._start:
+            self._start = False
+            self.apply_start()
+        if self._reset:
+            self._reset = False
+            self.apply_reset()
+        # Pop before reading, a score stored meanwhile is marked dirty again for the next frame
+        dirty = self._dirty
+        while dirty:
+            idx = dirty.pop()
+            count, tap_time = self._scores[idx]
+            self.apply_score(idx, count, tap_time)
@@ -0,0 +1,159 @@
+"""LAN addresses of this device, cached and refreshed when the network changes.
+
+Scanning the interfaces (netifaces) takes a system call per interface, so it
+is done once and the result is kept until the network changes: on Linux
+(Android included) a watcher thread listens to the kernel netlink route
+events (links and IPv4 addresses coming and going) and rescans after a
+burst of them settles. Where netlink is not available (other platforms, or
+a sandbox that refuses the socket) the watcher rescans every POLL_INTERVAL
+instead. Either way the rescans happen on the watcher thread, so reading
+the addresses costs the UI thread nothing.
+
+Candidates are the private IPv4 addresses (192.168/16, 10/8, 172.16/12) of
+every interface, ranked: Wi-Fi first, then Ethernet, then the rest, with
+virtual interfaces (containers, VPNs, bridges) last; 192.168 before 10 and
+172.16 inside a rank.
+"""
+import ipaddress
+import socket
+import time
+from threading import Thread
+from typing import NamedTuple
+
+POLL_INTERVAL = 5.0         # Seconds between rescans without netlink
+SETTLE_TIME = 0.2           # Seconds without netlink events before rescanning
+
+# Interface name prefixes, best kind first
+WIFI_PREFIXES = ("wlan", "wlp", "wl", "ap", "swlan")
+ETHERNET_PREFIXES = ("eth", "enp", "eno", "ens", "enx", "en")
+VIRTUAL_PREFIXES = ("docker", "br-", "veth", "virbr", "vmnet", "vboxnet", "tun", "tap", "wg", "zt",
+                    "tailscale", "utun", "lxc", "lxd", "rmnet")
+NETWORK_RANK = [ipaddress.ip_network(net) for net in ("192.168.0.0/16", "10.0.0.0/8", "172.16.0.0/12")]
+
+# Linux rtnetlink multicast groups (linux/rtnetlink.h)
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+
+
+class LanAddress(NamedTuple):
+    interface: str
+    addr: str
+
+
+_cache: list[LanAddress] | None = None
+_generation: int = 0        # Bumped by invalidate(), a scan started before is not cached
+_watcher: Thread | None = None
+
+
+def interface_rank(interface: str) -> int:
+    if interface.startswith(VIRTUAL_PREFIXES):
+        return 3
+    if interface.startswith(WIFI_PREFIXES):
+        return 0
+    if interface.startswith(ETHERNET_PREFIXES):
+        # en0 is the Wi-Fi of iOS and macOS
+        return 0 if interface == "en0" else 1
+    return 2
+
+
+def address_rank(address: LanAddress) -> tuple[int, int, str]:
+    ip = ipaddress.ip_address(address.addr)
+    network = next(rank for rank, net in enumerate(NETWORK_RANK) if ip in net)
+    return interface_rank(address.interface), network, address.interface
+
+
+def scan() -> list[LanAddress]:
+    """Private IPv4 addresses of every interface, best first (no cache)."""
+    import netifaces as ni
+    found = []
+    for interface in ni.interfaces():
+        for entry in ni.ifaddresses(interface).get(ni.AF_INET, []):
+            addr = entry.get("addr", "")
+            try:
+                ip = ipaddress.ip_address(addr)
+            except ValueError:
+                continue
+            if any(ip in net for net in NETWORK_RANK):
+                found.append(LanAddress(interface, addr))
+    return sorted(found, key=address_rank)
+
+
+def addresses() -> list[LanAddress]:
+    """LAN addresses, best first, scanned only if the network changed since the last call."""
+    global _cache
+    cached = _cache
+    if cached is None:
+        generation = _generation
+        cached = scan()
+        if generation == _generation:
+            _cache = cached
+    return cached
+
+
+def best_addr() -> str | None:
+    """The address to show to the other players, None when not on a LAN."""
+    found = addresses()
+    return found[0].addr if found else None
+
+
+def invalidate() -> None:
+    """Forget the addresses, the next call to addresses() scans again."""
+    global _cache, _generation
+    _generation += 1
+    _cache = None
+
+
+def watch() -> None:
+    """Scan in the background now and rescan whenever the network changes (once per process)."""
+    global _watcher
+    if _watcher is None:
+        _watcher = Thread(target=_watch, name="netinfo", daemon=True)
+        _watcher.start()
+
+
+def _watch() -> None:
+    addresses()
+    try:
+        events = netlink_socket()
+    except (AttributeError, OSError):
+        _poll()             # No netlink here
+    else:
+        _listen(events)
+
+
+def _listen(events: socket.socket) -> None:
+    """Rescan after each burst of netlink events."""
+    try:
+        while True:
+            events.settimeout(None)
+            events.recv(65536)
+            # A change comes as a burst of messages, wait until it settles
+            events.settimeout(SETTLE_TIME)
+            try:
+                while True:
+                    events.recv(65536)
+            except socket.timeout:
+                pass
+            invalidate()
+            addresses()
+    except OSError as e:
+        print(f"netinfo: netlink failed ({e}), polling instead")
+        events.close()
+        _poll()
+
+
+def _poll() -> None:
+    """Rescan every POLL_INTERVAL, replacing the cache only when something changed."""
+    global _cache
+    while True:
+        time.sleep(POLL_INTERVAL)
+        found = scan()
+        if found != _cache:
+            _cache = found
+
+
+def netlink_socket() -> socket.socket:
+    """Socket receiving the kernel link and IPv4 address events (Linux only)."""
+    events = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+    events.bind((0, RTMGRP_LINK | RTMGRP_IPV4_IFADDR))
+    return events
@@ -0,0 +1,110 @@
+"""Level-gated, non-blocking logging for the network hot paths.
+
+Levels, switchable at runtime with set_level():
+    OFF      nothing is recorded (a hot path only pays for `if netlog.level:`)
+    SUMMARY  message counters per direction and type, written every few seconds
+    TRACE    every message, formatted and written by the background writer
+
+Callers never format or write anything: a record is the format string and
+its arguments, appended to a bounded ring buffer (deque append is atomic, no
+lock is taken) and formatted later on the writer thread. When the ring is full
+the oldest records are dropped rather than blocking the caller. The writer
+only wakes up when there is something to write (at SUMMARY, every few seconds
+while messages keep coming, then not until the next one).
+
+The initial level comes from the TAP_RACE_LOG environment variable
+(off, summary or trace).
+"""
+import os
+from collections import deque
+from threading import Event, Thread
+from protocol import KIND_NAMES
+
+OFF = 0
+SUMMARY = 1
+TRACE = 2
+LEVELS = {"off": OFF, "summary": SUMMARY, "trace": TRACE}
+
+RING_SIZE = 4096            # Records kept before the oldest are dropped
+SUMMARY_INTERVAL = 5.0      # Seconds between summary lines
+
+level: int = OFF
+
+_ring: deque = deque(maxlen=RING_SIZE)
+_wakeup = Event()
+_writer: Thread | None = None
+# (event, kind) -> messages seen; every key is only bumped by one thread
+_counters: dict[tuple[str, int], int] = {}
+_dropped: int = 0
+_idle: bool = False         # Writer sleeps until the next message (SUMMARY, nothing new)
+
+
+def set_level(new_level: int | str) -> None:
+    """Switch the logging level at runtime (OFF, SUMMARY, TRACE or their names)."""
+    global level, _writer
+    if isinstance(new_level, str):
+        new_level = LEVELS[new_level.lower()]
+    level = new_level
+    if level and _writer is None:
+        _writer = Thread(target=_write_records, name="netlog", daemon=True)
+        _writer.start()
+    _wakeup.set()
+
+
+def trace(fmt: str, *args) -> None:
+    """Record a line, formatted as fmt % args later by the writer (TRACE only)."""
+    global _dropped
+    if level < TRACE:
+        return
+    if len(_ring) == RING_SIZE:
+        _dropped += 1
+    _ring.append((fmt, args))
+    if not _wakeup.is_set():
+        _wakeup.set()
+
+
+def message(event: str, msg: tuple) -> None:
+    """Count a protocol message (SUMMARY) and trace it (TRACE)."""
+    global _idle
+    if not level:
+        return
+    key = (event, msg[0])
+    _counters[key] = _counters.get(key, 0) + 1
+    if _idle:
+        _idle = False
+        _wakeup.set()
+    if level >= TRACE:
+        trace("%s: %s", event, msg)
+
+
+def summary() -> dict[str, int]:
+    """Message counters as {'<event> <TYPE>': count}."""
+    return {
+        f"{event} {KIND_NAMES.get(kind, kind)}": count
+        for (event, kind), count in sorted(_counters.copy().items())
+    }
+
+
+def _write_records() -> None:
+    """Writer thread: format and print records as they come, and the summaries."""
+    global _dropped, _idle
+    last_summary: dict[str, int] = {}
+    while True:
+        _wakeup.wait(SUMMARY_INTERVAL if level == SUMMARY and not _idle else None)
+        _wakeup.clear()
+        while _ring:
+            fmt, args = _ring.popleft()
+            print(fmt % args)
+        if _dropped:
+            print(f"netlog: {_dropped} records dropped")
+            _dropped = 0
+        if level >= SUMMARY:
+            counters = summary()
+            if counters != last_summary:
+                print("netlog summary: " + ", ".join(f"{name}={n}" for name, n in counters.items()))
+                last_summary = counters
+            else:
+                _idle = True
+
+
+set_level(LEVELS.get(os.environ.get("TAP_RACE_LOG", "").lower(), OFF))
@@ -0,0 +1,156 @@
+import heapq
+import selectors
+import socket
+import time
+from collections import deque
+
+
+class TimerHandle:
+    """A callback scheduled with EventLoop.call_later."""
+    __slots__ = ("when", "callback", "args", "cancelled")
+
+    def __init__(self, when: float, callback, args: tuple):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def __lt__(self, other: "TimerHandle") -> bool:
+        return self.when < other.when
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+
+class EventLoop:
+    """Single-threaded selectors loop that drives every socket of a server.
+
+    The loop sleeps in select() until a socket is ready, the next timer is due
+    or another thread calls call_soon_threadsafe(), so an idle loop never wakes
+    up and stopping it from another thread takes effect at once.
+    """
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self._ready: deque = deque()
+        self._timers: list[TimerHandle] = []
+        self.wakeups: int = 0           # Times select() returned (metric)
+
+        # Other threads write a byte here to wake the loop up
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
+        self._wakeup_send.setblocking(False)
+        self.add_reader(self._wakeup_recv, self._drain_wakeup)
+
+    def _update(self, sock: socket.socket, reader, writer) -> None:
+        """Register, modify or unregister sock for the given callbacks."""
+        events = (selectors.EVENT_READ if reader else 0) | (selectors.EVENT_WRITE if writer else 0)
+        try:
+            key = self.selector.get_key(sock)
+        except (KeyError, ValueError):
+            key = None
+        if key and not events:
+            self.selector.unregister(sock)
+        elif key:
+            self.selector.modify(sock, events, (reader, writer))
+        elif events:
+            self.selector.register(sock, events, (reader, writer))
+
+    def _callbacks(self, sock: socket.socket) -> tuple:
+        try:
+            return self.selector.get_key(sock).data
+        except (KeyError, ValueError):
+            return None, None
+
+    def add_reader(self, sock: socket.socket, callback) -> None:
+        """Call callback(sock) every time sock becomes readable."""
+        self._update(sock, callback, self._callbacks(sock)[1])
+
+    def remove_reader(self, sock: socket.socket) -> None:
+        """Stop watching sock for reading (no-op if it is not registered)."""
+        self._update(sock, None, self._callbacks(sock)[1])
+
+    def add_writer(self, sock: socket.socket, callback) -> None:
+        """Call callback(sock) every time sock becomes writable."""
+        self._update(sock, self._callbacks(sock)[0], callback)
+
+    def remove_writer(self, sock: socket.socket) -> None:
+        """Stop watching sock for writing (no-op if it is not registered)."""
+        self._update(sock, self._callbacks(sock)[0], None)
+
+    def call_soon(self, callback, *args) -> None:
+        """Run callback(*args) on the loop after the current events (loop thread only)."""
+        self._ready.append((callback, args))
+
+    def call_later(self, delay: float, callback, *args) -> TimerHandle:
+        """Run callback(*args) on the loop in delay seconds (loop thread only)."""
+        timer = TimerHandle(time.monotonic() + delay, callback, args)
+        heapq.heappush(self._timers, timer)
+        return timer
+
+    def call_soon_threadsafe(self, callback, *args) -> None:
+        """Run callback(*args) on the loop, from any thread."""
+        self._ready.append((callback, args))
+        try:
+            self._wakeup_send.send(b"\0")
+        except (BlockingIOError, OSError):
+            pass    # Wakeup already pending (or loop closed)
+
+    def _drain_wakeup(self, sock: socket.socket) -> None:
+        try:
+            while sock.recv(4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+
+    def _run_ready(self) -> None:
+        """Run the callbacks queued so far (not the ones they queue themselves)."""
+        # Move due timers to the ready queue
+        now = time.monotonic()
+        while self._timers and self._timers[0].when <= now:
+            timer = heapq.heappop(self._timers)
+            if not timer.cancelled:
+                self._ready.append((timer.callback, timer.args))
+
+        for _ in range(len(self._ready)):
+            callback, args = self._ready.popleft()
+            try:
+                callback(*args)
+            except Exception as e:
+                print(f"Exception caught in event loop callback: {e}")
+
+    def run(self, should_stop, timeout: float | None = None) -> None:
+        """Dispatch ready sockets and callbacks until should_stop() returns True.
+
+        should_stop is checked after every wakeup, so a flag set from another
+        thread needs a call_soon_threadsafe() to be seen (timeout: longest
+        sleep, None to sleep until something happens).
+        """
+        while not should_stop():
+            while self._timers and self._timers[0].cancelled:
+                heapq.heappop(self._timers)
+            if self._ready:
+                wait = 0
+            elif self._timers:
+                wait = max(0, self._timers[0].when - time.monotonic())
+                wait = wait if timeout is None else min(timeout, wait)
+            else:
+                wait = timeout
+            events = self.selector.select(wait)
+            self.wakeups += 1
+            for key, mask in events:
+                try:
+                    if mask & selectors.EVENT_READ and key.data[0]:
+                        key.data[0](key.fileobj)
+                    # The reader may have dropped the socket, look the writer up again
+                    writer = self._callbacks(key.fileobj)[1]
+                    if mask & selectors.EVENT_WRITE and writer:
+                        writer(key.fileobj)
+                except Exception as e:
+                    print(f"Exception caught in event loop: {e}")
+            self._run_ready()
+
+    def close(self) -> None:
+        """Release the selector and the wakeup sockets."""
+        self.selector.close()
+        self._wakeup_recv.close()
+        self._wakeup_send.close()
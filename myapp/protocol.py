@@ -0,0 +1,314 @@
+"""Wire protocol shared by Server and Client.
+
+Binary frames are length-prefixed: a big-endian u16 length (type byte plus
+payload), a u8 message type and a fixed payload per type. Messages are
+handled in the app as plain tuples, e.g. (COUNT, player_id, count, tap_time).
+
+Times on the wire (tap_time, PING/PONG) are u32 microseconds of the server
+monotonic clock, see latency.py; 0 means unknown (e.g. from an old peer).
+
+Old peers speak the ASCII protocol ('COUNT-P2: 7&'). Every connection starts
+in ASCII mode; a new peer sends HELLO right after connecting and the other
+side answers with HELLO, after which both switch to binary frames. HELLO has
+no '&' in it, so an old peer simply drops it and the connection stays ASCII.
+"""
+import struct
+from latency import narrow_time
+
+VERSION = 1
+MAGIC = b"\x00TRP"
+HELLO = MAGIC + bytes([VERSION])
+
+# ================== MESSAGE TYPES ======================================
+HANDSHAKE = 0               # (HANDSHAKE, version), reported by FrameDecoder
+NICKNAME = 1                # (NICKNAME, player_id)
+MAX_SCORE = 2               # (MAX_SCORE, score)
+STARTED_BY_SERVER = 3
+STARTED_BY_CLIENT = 4
+NPLAYERS = 5                # (NPLAYERS, n_players)
+COUNT = 6                   # (COUNT, player_id, count, tap_time), tap_time narrowed on the wire (widen_time)
+LOSE = 7
+RESET = 8
+RESTARTED_BY_SERVER = 9
+RESTARTED_BY_CLIENT = 10
+CLOSED_BY_CLIENT = 11
+CLOSED_BY_SERVER = 12
+CLOSED_BY_CLIENT_ACK = 13
+CLOSED_BY_SERVER_ACK = 14
+SNAPSHOT = 15               # (SNAPSHOT, ((player_id, count, tap_time), ...)), changed scores only
+JOIN_ROOM = 16              # (JOIN_ROOM, room), sent by a new client right after HELLO
+PING = 17                   # (PING, client_time), binary peers only
+PONG = 18                   # (PONG, client_time, server_receive_time, server_send_time)
+WINNER = 19                 # (WINNER, player_id), the server confirms who reached max score first
+REJECT = 20                 # (REJECT, count), the server kept count instead of the client's COUNT
+SESSION = 21                # (SESSION, token), the session a client resumes with after losing its socket
+RESUME = 22                 # (RESUME, token, seq), sent by a reconnecting client right after HELLO with its
+                            # last seq, answered with the session it got (old or new token) and the current seq
+SEQ = 23                    # (SEQ, seq), sequence number of the game state sent so far
+MISS = 24                   # (MISS,), the player pressed a button that was not highlighted (match logs)
+PLAYER_NAME = 25            # (PLAYER_NAME, name), the name of the install, for the leaderboard (once the server
+                            # answered HELLO, an old server never gets it)
+SEED = 26                   # (SEED, seed), button sequence of the race, sent before a start or reset
+TAPS = 27                   # (TAPS, seed, first_press, buttons, (tap_time, ...)), presses first_press,
+                            # first_press + 1, ... of a player: the buttons pressed (bytes) and when
+SPECTATE = 28               # (SPECTATE,), sent right after HELLO (and JOIN_ROOM) to watch instead of playing
+
+# Only binary peers know these, they have no ASCII form
+BINARY_ONLY = {JOIN_ROOM, PING, PONG, WINNER, REJECT, SESSION, RESUME, SEQ, MISS, PLAYER_NAME,
+               SEED, TAPS, SPECTATE}
+
+# Room names are short ASCII codes, so a JOIN_ROOM frame never contains '&'
+MAX_ROOM_LEN = 32
+MAX_NAME_LEN = 32           # Characters of a PLAYER_NAME
+MAX_TAPS = 255              # Presses in one TAPS frame
+MAX_LEGACY_LEN = 64         # Bytes of an ASCII message, '&' included
+
+NAMES = {
+    STARTED_BY_SERVER: "STARTED_BY_SERVER",
+    STARTED_BY_CLIENT: "STARTED_BY_CLIENT",
+    LOSE: "LOSE",
+    RESET: "RESET",
+    RESTARTED_BY_SERVER: "RESTARTED_BY_SERVER",
+    RESTARTED_BY_CLIENT: "RESTARTED_BY_CLIENT",
+    CLOSED_BY_CLIENT: "CLOSED_BY_CLIENT",
+    CLOSED_BY_SERVER: "CLOSED_BY_SERVER",
+    CLOSED_BY_CLIENT_ACK: "CLOSED_BY_CLIENT_ACK",
+    CLOSED_BY_SERVER_ACK: "CLOSED_BY_SERVER_ACK",
+}
+
+# Every message type, for logs
+KIND_NAMES = {
+    HANDSHAKE: "HANDSHAKE",
+    NICKNAME: "NICKNAME",
+    MAX_SCORE: "MAX_SCORE",
+    NPLAYERS: "NPLAYERS",
+    COUNT: "COUNT",
+    SNAPSHOT: "SNAPSHOT",
+    JOIN_ROOM: "JOIN_ROOM",
+    PING: "PING",
+    PONG: "PONG",
+    WINNER: "WINNER",
+    REJECT: "REJECT",
+    SESSION: "SESSION",
+    RESUME: "RESUME",
+    SEQ: "SEQ",
+    MISS: "MISS",
+    PLAYER_NAME: "PLAYER_NAME",
+    SEED: "SEED",
+    TAPS: "TAPS",
+    SPECTATE: "SPECTATE",
+    **NAMES,
+}
+
+_PAYLOADS = {
+    NICKNAME: ">H",
+    MAX_SCORE: ">I",
+    NPLAYERS: ">H",
+    COUNT: ">HIH",
+    PING: ">I",
+    PONG: ">III",
+    WINNER: ">H",
+    REJECT: ">I",
+    SESSION: ">Q",
+    RESUME: ">QI",
+    SEQ: ">I",
+    MISS: ">",
+    SEED: ">Q",
+    SPECTATE: ">",
+}
+# Precompiled whole-frame structs (header + payload), used to encode and decode
+_FRAMES = {kind: struct.Struct(">HB" + _PAYLOADS.get(kind, "")[1:]) for kind in (*_PAYLOADS, *NAMES)}
+# Variable-length frames: header followed by repeated items
+_HEADER = struct.Struct(">HB")
+_COUNT = _FRAMES[COUNT]
+_SCORE = struct.Struct(">HII")
+_TAPS = struct.Struct(">QI")    # Seed and first press, followed by the buttons (u8) and the tap times (u32)
+
+
+# Message types without payload, by ASCII name
+_LEGACY_KINDS = {name: kind for kind, name in NAMES.items()}
+# Player ids and counts of legacy COUNTs are small, a lookup is cheaper than int()
+_INTS = {str(i): i for i in range(1024)}
+
+
+class ProtocolError(Exception):
+    """Raised when a peer sends bytes that cannot be framed, the peer should be dropped."""
+
+
+# ================== ENCODING ===========================================
+def encode(message: tuple) -> bytes:
+    """Encode a message tuple as a binary frame."""
+    if message[0] == COUNT:
+        _, player_id, count, tap_time = message
+        return _COUNT.pack(_COUNT.size - 2, COUNT, player_id, count, narrow_time(tap_time))
+    elif message[0] == SNAPSHOT:
+        scores = message[1]
+        pack = _SCORE.pack
+        return _HEADER.pack(1 + _SCORE.size * len(scores), SNAPSHOT) + b"".join(
+            pack(*score) for score in scores)
+    elif message[0] == TAPS:
+        _, seed, first, buttons, tap_times = message
+        return (_HEADER.pack(1 + _TAPS.size + 5 * len(buttons), TAPS) + _TAPS.pack(seed, first) + buttons
+                + struct.pack(f">{len(tap_times)}I", *tap_times))
+    elif message[0] == JOIN_ROOM:
+        room = message[1].encode('ascii')[:MAX_ROOM_LEN]
+        return _HEADER.pack(1 + len(room), JOIN_ROOM) + room
+    elif message[0] == PLAYER_NAME:
+        name = message[1][:MAX_NAME_LEN].encode()
+        return _HEADER.pack(1 + len(name), PLAYER_NAME) + name
+    frame = _FRAMES[message[0]]
+    return frame.pack(frame.size - 2, *message)
+
+
+def encode_legacy(message: tuple) -> bytes:
+    """Encode a message tuple for an old ASCII peer (binary-only messages encode to nothing)."""
+    kind = message[0]
+    if kind in BINARY_ONLY:
+        return b""
+    elif kind == SNAPSHOT:
+        # Old peers only know COUNT, send one per changed score
+        return b"".join(encode_legacy((COUNT, *score)) for score in message[1])
+    elif kind == COUNT:
+        text = f"COUNT-P{message[1]}: {message[2]}"
+    elif kind == NPLAYERS:
+        text = f"NPLAYERS: {message[1]}"
+    elif kind == MAX_SCORE:
+        text = f"MAX_SCORE: {message[1]}"
+    elif kind == NICKNAME:
+        text = f"P{message[1]}"
+    else:
+        text = NAMES[kind]
+    return f"{text}&".encode('ascii')
+
+
+# ================== DECODING ===========================================
+def decode_legacy(text: str) -> tuple | None:
+    """Decode one ASCII message (without the '&' terminator)."""
+    try:
+        if text.startswith('COUNT-P'):
+            player_id, _, count = text[7:].partition(': ')
+            return COUNT, _INTS.get(player_id) or int(player_id), _INTS.get(count) or int(count), 0
+        elif text.startswith('NPLAYERS'):
+            return NPLAYERS, int(text[10:])
+        elif text.startswith('MAX_SCORE'):
+            return MAX_SCORE, int(text[11:])
+        elif text.startswith('P'):
+            return NICKNAME, int(text[1:])
+    except ValueError:
+        return None
+    kind = _LEGACY_KINDS.get(text)
+    return (kind,) if kind is not None else None
+
+
+class FrameDecoder:
+    """Incremental decoder for one peer's byte stream.
+
+    Bytes are received straight into a reusable bytearray and frames are read
+    in place through a memoryview, so partial frames survive across reads and
+    nothing is copied or decoded per chunk. ASCII messages are decoded in one
+    go up to the last '&' buffered.
+
+    A frame whose length does not fit its type, or ASCII bytes running past
+    MAX_LEGACY_LEN without an '&', raise ProtocolError: the stream cannot be
+    trusted after it. Unknown types are skipped.
+    """
+    def __init__(self, size: int = 4096):
+        self.binary: bool = False
+        self.peer_version: int = 0
+        self._buf = bytearray(size)
+        self._view = memoryview(self._buf)
+        self._start = 0
+        self._end = 0
+
+    def _reserve(self, n: int) -> None:
+        """Make room for n more bytes at the end of the buffer."""
+        if len(self._buf) - self._end >= n:
+            return
+        pending = self._end - self._start
+        if pending + n > len(self._buf):
+            # Grow (rare): a frame larger than the buffer or a slow consumer
+            self._view.release()
+            del self._buf[:self._start]
+            self._buf.extend(bytes(max(len(self._buf), pending + n)))
+            self._view = memoryview(self._buf)
+        else:
+            self._buf[:pending] = self._view[self._start:self._end]
+        self._start, self._end = 0, pending
+
+    def recv_into(self, sock, size: int = 1024) -> int:
+        """Read from sock into the buffer and return the number of bytes read."""
+        self._reserve(size)
+        n = sock.recv_into(self._view[self._end:], size)
+        self._end += n
+        return n
+
+    def feed(self, data: bytes) -> None:
+        """Append already received bytes to the buffer."""
+        self._reserve(len(data))
+        self._buf[self._end:self._end + len(data)] = data
+        self._end += len(data)
+
+    def messages(self) -> list[tuple]:
+        """Return every complete message buffered so far."""
+        buf, view = self._buf, self._view
+        pos, end = self._start, self._end
+        messages = []
+        while pos < end:
+            if self.binary:
+                if end - pos < 3:
+                    break
+                stop = pos + 2 + (buf[pos] << 8 | buf[pos + 1])
+                if stop > end:
+                    break
+                kind = buf[pos + 2]
+                frame = _FRAMES.get(kind)
+                if frame:
+                    if stop - pos != frame.size:
+                        raise ProtocolError(f"bad {KIND_NAMES[kind]} frame length {stop - pos}")
+                    messages.append(frame.unpack_from(buf, pos)[1:])
+                elif kind == SNAPSHOT:
+                    if (stop - pos - 3) % _SCORE.size:
+                        raise ProtocolError(f"bad SNAPSHOT frame length {stop - pos}")
+                    messages.append((SNAPSHOT, tuple(_SCORE.iter_unpack(view[pos + 3:stop]))))
+                elif kind == TAPS:
+                    start = pos + 3 + _TAPS.size
+                    n, extra = divmod(stop - start, 5)
+                    if stop < start or extra or n > MAX_TAPS:
+                        raise ProtocolError(f"bad TAPS frame length {stop - pos}")
+                    seed, first = _TAPS.unpack_from(buf, pos + 3)
+                    messages.append((TAPS, seed, first, bytes(view[start:start + n]),
+                                     struct.unpack_from(f">{n}I", buf, start + n)))
+                elif kind == JOIN_ROOM:
+                    messages.append((JOIN_ROOM, str(view[pos + 3:stop], 'ascii', 'replace')))
+                elif kind == PLAYER_NAME:
+                    messages.append((PLAYER_NAME, str(view[pos + 3:stop], 'utf-8', 'replace')))
+                pos = stop
+            elif buf[pos] == 0:
+                # Handshake from a new peer, switch to binary frames
+                if end - pos < len(HELLO):
+                    break
+                if view[pos:pos + len(MAGIC)] != MAGIC:
+                    raise ProtocolError("bad handshake")
+                self.peer_version = buf[pos + len(MAGIC)]
+                self.binary = True
+                messages.append((HANDSHAKE, self.peer_version))
+                pos += len(HELLO)
+            else:
+                # Every complete ASCII message up to a handshake (only ever first) or the end
+                hello = buf.find(0, pos, end)
+                limit = end if hello < 0 else hello
+                stop = buf.rfind(b"&", pos, limit)
+                if stop < 0:
+                    if hello < 0:
+                        if end - pos > MAX_LEGACY_LEN:
+                            raise ProtocolError(f"{end - pos} bytes of ASCII without a message end")
+                        break
+                    pos = hello     # Bytes before the handshake that are not a message
+                    continue
+                messages += filter(None, map(decode_legacy, str(view[pos:stop], 'ascii', 'replace').split('&')))
+                pos = stop + 1
+
+        if pos == end:
+            pos = end = 0
+        self._start, self._end = pos, end
+        return messages
@@ -0,0 +1,128 @@
+"""Players of a Server: compact records indexed by socket fd and by player id.
+
+Concurrency: the registry belongs to the server event loop thread. Joins,
+leaves and score updates all run there (accept and receive callbacks, and
+Server.update_score/reset_scores hop onto the loop first), so no lock is
+needed. Other threads (the UI) only read: a single score, len(scores) or a
+snapshot taken with tuple(registry), each atomic under the GIL.
+"""
+import heapq
+import secrets
+import socket
+from array import array
+from connection import Connection
+
+
+class Player:
+    """A player, connected or (sock None) away and expected to resume its session."""
+    __slots__ = ("player_id", "nickname", "name", "token", "sock", "fd", "connection", "tap_pace")
+
+    def __init__(self, player_id: int, sock: socket.socket, connection: Connection):
+        self.player_id = player_id
+        self.nickname = f"P{player_id}"
+        self.name = self.nickname                   # Name of the install (PLAYER_NAME), for the leaderboard
+        self.token = secrets.randbits(64) or 1      # Proves the session on RESUME, never 0
+        self.sock: socket.socket | None = sock
+        self.fd = sock.fileno()
+        self.connection: Connection | None = connection
+        self.tap_pace: int = 0      # Wire time its presses so far would end at, at the fastest pace
+
+    @property
+    def idx(self) -> int:
+        """Index of the player in the score arrays."""
+        return self.player_id - 1
+
+
+class Registry:
+    """Connected players by fd, all players by id and session token, with the scores of every slot.
+
+    Player ids index the scores (scores[player_id - 1]), so the slot of a
+    player who left stays until a new player takes the lowest free id;
+    free slots at the end are dropped, and len(scores) is the NPLAYERS sent
+    to the clients. With host_player, slot 0 belongs to the host (P1), who
+    has no socket.
+
+    A player who lost its socket is detached: it keeps its id, slot and
+    score but is no longer iterated over nor counted by len() until it is
+    attached to the socket it reconnected with, or removed.
+    """
+    def __init__(self, host_player: bool = False):
+        self.reserved: int = 1 if host_player else 0
+        self.by_fd: dict[int, Player] = {}
+        self.by_id: dict[int, Player] = {}
+        self.by_token: dict[int, Player] = {}
+        self.scores = array('I', [0] * self.reserved)       # Score of each slot
+        self.tap_times = array('I', [0] * self.reserved)    # Tap time (wire clock) of each score
+        self.score_seqs = array('I', [0] * self.reserved)   # Server seq the score was last sent with
+        self.presses = array('I', [0] * self.reserved)      # Presses (TAPS) taken from the slot this race
+        self._free: list[int] = []                          # Heap of free ids inside the slots
+
+    def __len__(self) -> int:
+        return len(self.by_fd)
+
+    def __iter__(self):
+        return iter(tuple(self.by_fd.values()))
+
+    def __contains__(self, sock: socket.socket) -> bool:
+        return sock.fileno() in self.by_fd
+
+    def get(self, sock: socket.socket) -> Player | None:
+        """The player on this socket, None if it is not (or no longer) playing."""
+        return self.by_fd.get(sock.fileno())
+
+    def add(self, sock: socket.socket, connection: Connection) -> Player:
+        """Register a new player under the lowest free id, with a zero score."""
+        if self._free:
+            player_id = heapq.heappop(self._free)
+            idx = player_id - 1
+            self.scores[idx] = self.tap_times[idx] = self.score_seqs[idx] = self.presses[idx] = 0
+        else:
+            player_id = len(self.scores) + 1
+            self.scores.append(0)
+            self.tap_times.append(0)
+            self.score_seqs.append(0)
+            self.presses.append(0)
+        player = Player(player_id, sock, connection)
+        self.by_fd[player.fd] = player
+        self.by_id[player_id] = player
+        self.by_token[player.token] = player
+        return player
+
+    def detach(self, player: Player) -> None:
+        """The player lost its socket, keep its slot for it to resume."""
+        del self.by_fd[player.fd]
+        player.sock = player.connection = None
+        player.fd = -1
+
+    def attach(self, player: Player, sock: socket.socket, connection: Connection) -> None:
+        """A detached player resumed on a new socket."""
+        player.sock = sock
+        player.fd = sock.fileno()
+        player.connection = connection
+        self.by_fd[player.fd] = player
+
+    def remove(self, player: Player) -> list[int]:
+        """Unregister a player, return the indexes of the slots dropped at the end."""
+        self.by_fd.pop(player.fd, None)
+        del self.by_id[player.player_id]
+        del self.by_token[player.token]
+        heapq.heappush(self._free, player.player_id)
+
+        dropped = []
+        while len(self.scores) > self.reserved and len(self.scores) not in self.by_id:
+            dropped.append(len(self.scores) - 1)
+            self.scores.pop()
+            self.tap_times.pop()
+            self.score_seqs.pop()
+            self.presses.pop()
+        if dropped:
+            self._free = [player_id for player_id in self._free if player_id <= len(self.scores)]
+            heapq.heapify(self._free)
+        return dropped
+
+    def reset_scores(self) -> None:
+        """Zero every score (new game or reset)."""
+        zeros = array('I', bytes(self.scores.itemsize * len(self.scores)))
+        self.scores[:] = zeros
+        self.tap_times[:] = zeros
+        self.presses[:] = zeros
@@ -0,0 +1,231 @@
+"""Spectator relay: watches a game as one spectator and fans it out to many.
+
+The relay connects to the game Server (or a lobby room) as a single
+spectator and runs a SpectatorFeed of its own on that stream, in its own
+process: however many phones and big screens watch through the relay, the
+game server sends one stream, so the spectators never add to the players'
+latency. A relay can also watch another relay.
+
+Spectators connect to the relay the way they would to the server (Watch in
+the join dialog, with the relay's address and port): HELLO, then SPECTATE.
+If the game server goes away the relay connects again every
+RECONNECT_DELAY seconds, the spectators stay and get the whole scoreboard
+again once it is back.
+
+Run from the myapp directory:
+    python -m relay --upstream 192.168.1.10:55555 [--room ROOM] [--port 55557]
+"""
+import argparse
+import socket
+import time
+import netlog
+from threading import Thread
+from connection import Connection, connect_first, set_keepalive
+from latency import clock_us
+from netloop import EventLoop
+from server import PORT
+from spectators import SPECTATOR_RATE, SpectatorFeed
+from protocol import (
+    HELLO, HANDSHAKE, JOIN_ROOM, SPECTATE, PING, PONG, CLOSED_BY_CLIENT, CLOSED_BY_CLIENT_ACK,
+    CLOSED_BY_SERVER, CLOSED_BY_SERVER_ACK, ProtocolError, encode,
+)
+
+RELAY_PORT = 55557
+RECONNECT_DELAY = 2.0       # Seconds between two attempts to reach the game server
+
+
+class Relay:
+    """One upstream spectator connection, fanned out to the spectators connected to us."""
+    def __init__(self, upstream_addr: str, upstream_port: int = PORT, ip_addr: str = "0.0.0.0",
+                 port: int = RELAY_PORT, room: str | None = None, rate: int = SPECTATOR_RATE):
+        self.upstream_addr = upstream_addr
+        self.upstream_port = upstream_port
+        self.ip_addr = ip_addr
+        self.port = port
+        self.room = room
+        self.server: socket.socket | None = None
+        self.loop = EventLoop()
+        self.stop_thread: bool = False
+
+        self.upstream: Connection | None = None
+        self.feed = SpectatorFeed(self.loop, rate)
+        self.connections: dict[socket.socket, Connection] = {}     # Spectator sockets
+        self.received_at: int = 0
+
+    def start_server(self):
+        """Listen for spectators and start looking for the game server."""
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((self.ip_addr, self.port))
+        self.server.listen()
+        self.server.setblocking(False)
+        self.loop.add_reader(self.server, self.accept_connection)
+        self.connect_upstream(delay=0)
+
+    def run(self):
+        """Run the relay loop until close_connection() is called."""
+        self.loop.run(lambda: self.stop_thread)
+
+    # Upstream: the game server
+    def connect_upstream(self, delay: float = RECONNECT_DELAY):
+        """Connect to the game server in the background, the loop keeps serving the spectators."""
+        Thread(target=self.reach_upstream, args=(delay,), name="upstream", daemon=True).start()
+
+    def reach_upstream(self, delay: float):
+        """Thread function connecting until the game server answers."""
+        while not self.stop_thread:
+            time.sleep(delay)
+            try:
+                sock = connect_first([self.upstream_addr], self.upstream_port, timeout=2)
+            except OSError as e:
+                print(f"Game server not reachable: {e}")
+                delay = RECONNECT_DELAY
+                continue
+            self.loop.call_soon_threadsafe(self.attach_upstream, sock)
+            return
+
+    def attach_upstream(self, sock: socket.socket):
+        """Watch the game on a socket just connected to the server (loop thread)."""
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        set_keepalive(sock)
+        self.upstream = Connection(sock, self.loop)
+        # Binary frames can follow HELLO at once, the server switches as soon as it reads it
+        self.upstream.queue_raw(HELLO)
+        if self.room:
+            self.upstream.queue_raw(encode((JOIN_ROOM, self.room)))
+        self.upstream.queue_raw(encode((SPECTATE,)))
+        self.upstream.flush()
+        self.loop.add_reader(sock, self.receive_upstream)
+        print(f"Watching {self.upstream_addr}:{self.upstream_port}")
+
+    def receive_upstream(self, sock):
+        """Feed the spectators with what the game server sends (socket is readable)."""
+        try:
+            n_bytes = self.upstream.receive()
+        except BlockingIOError:
+            return
+        except OSError as e:
+            print(f"Exception caught in receive_upstream: {e}")
+            n_bytes = 0
+
+        try:
+            messages = self.upstream.decoder.messages() if n_bytes else []
+        except ProtocolError as e:
+            print(f"Bad frame from the game server: {e}")
+            messages, n_bytes = [], 0
+        if n_bytes:
+            for msg in messages:
+                if netlog.level:
+                    netlog.message("from server", msg)
+                if msg[0] == HANDSHAKE:
+                    self.upstream.binary = True
+                elif msg[0] == CLOSED_BY_SERVER:
+                    self.upstream.queue((CLOSED_BY_SERVER_ACK,))
+                    self.upstream.flush()
+                    n_bytes = 0
+                    break
+                else:
+                    self.feed.message(msg)
+        if not n_bytes:
+            print("Game server gone, reconnecting")
+            self.upstream.close()
+            self.upstream = None
+            if not self.stop_thread:
+                self.connect_upstream()
+
+    # Downstream: the spectators
+    def accept_connection(self, server):
+        """Accept a spectator (listener is readable)."""
+        try:
+            client, _ = server.accept()
+        except BlockingIOError:
+            return
+        client.setblocking(False)
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        set_keepalive(client)
+        self.connections[client] = Connection(client, self.loop, on_overflow=self.drop_slow_spectator)
+        self.loop.add_reader(client, self.receive_data)
+
+    def receive_data(self, client):
+        """Handle data from a spectator: handshake, SPECTATE, clock probes and goodbye."""
+        connection = self.connections[client]
+        try:
+            n_bytes = connection.receive()
+        except BlockingIOError:
+            return
+        except OSError:
+            n_bytes = 0
+        if not n_bytes:
+            self.drop_spectator(client)
+            return
+
+        self.received_at = clock_us()
+        try:
+            messages = connection.decoder.messages()
+        except ProtocolError:
+            self.drop_spectator(client)
+            return
+        for msg in messages:
+            kind = msg[0]
+            if kind == HANDSHAKE:
+                connection.queue_raw(HELLO)
+                connection.binary = True
+            elif kind == SPECTATE and connection.binary:
+                self.feed.add(connection)
+                print(f"Spectator joined, {len(self.feed)} watching")
+            elif kind == PING:
+                connection.queue((PONG, msg[1], self.received_at, clock_us()))
+            elif kind == CLOSED_BY_CLIENT:
+                connection.queue((CLOSED_BY_CLIENT_ACK,))
+        connection.flush()
+
+    def drop_slow_spectator(self, connection: Connection):
+        """Disconnect a spectator that fell too far behind (called on queue overflow)."""
+        # Called while fanning out to the spectators, so do it right after
+        self.loop.call_soon(self.drop_spectator, connection.sock)
+
+    def drop_spectator(self, client):
+        connection = self.connections.pop(client, None)
+        if connection:
+            self.feed.discard(connection)
+            connection.close()
+
+    def close_connection(self):
+        """Tell the spectators, close every socket and stop the loop."""
+        self.stop_thread = True
+        self.feed.close()
+        for connection in self.connections.values():
+            connection.close()
+        if self.upstream:
+            self.upstream.close()
+        self.server.close()
+        self.loop.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tap Race spectator relay")
+    parser.add_argument("--upstream", required=True, metavar="HOST[:PORT]",
+                        help=f"game server (or lobby) to watch, port {PORT} by default")
+    parser.add_argument("--room", default=None, help="lobby room to watch")
+    parser.add_argument("--host", default="0.0.0.0", help="address to bind (default: all)")
+    parser.add_argument("--port", type=int, default=RELAY_PORT, help="port the spectators connect to")
+    parser.add_argument("--rate", type=int, default=SPECTATOR_RATE, help="scoreboard updates per second")
+    parser.add_argument("--log", choices=list(netlog.LEVELS), default=None,
+                        help="network log level (default: TAP_RACE_LOG or off)")
+    args = parser.parse_args()
+    if args.log:
+        netlog.set_level(args.log)
+
+    addr, _, port = args.upstream.partition(":")
+    relay = Relay(addr, int(port or PORT), ip_addr=args.host, port=args.port, room=args.room, rate=args.rate)
+    relay.start_server()
+    print(f"Relay listening on {args.host}:{args.port}")
+    try:
+        relay.run()
+    except KeyboardInterrupt:
+        pass
+    relay.close_connection()
+
+
+if __name__ == "__main__":
+    main()
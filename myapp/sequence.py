@@ -0,0 +1,50 @@
+"""Highlighted button sequences, the same on every device of a race.
+
+The server draws a seed for every race (and every reset) and sends it as
+SEED right before the start. Press n of a player, hit or miss, is followed
+by the highlight of buttons[n + 1], buttons[0] being highlighted at the
+start, so every player of a race gets the same sequence.
+
+Buttons are taken from BLAKE2b digests of (seed, block number), BLOCK at a
+time: the sequence only depends on the seed, on any device and Python, and
+it is generated ahead in whole blocks, so the server checks a batch of
+presses (TAPS) with a couple of bytes operations, never one RNG call per tap.
+"""
+import hashlib
+import struct
+
+BUTTONS = 4
+BLOCK = 64                  # Buttons per digest (the largest BLAKE2b digest)
+
+_BLOCK_KEY = struct.Struct("<QQ")
+# Digest byte to button 1..BUTTONS (256 is a multiple of BUTTONS, no bias)
+_TO_BUTTON = bytes(byte % BUTTONS + 1 for byte in range(256))
+
+
+class ButtonSequence:
+    """The buttons highlighted one after the other in a race, generated in blocks on demand."""
+    def __init__(self, seed: int, length: int = BLOCK):
+        self.seed = seed
+        self.buttons = bytearray()
+        self.extend(length)
+
+    def extend(self, length: int) -> None:
+        """Generate at least length buttons."""
+        while len(self.buttons) < length:
+            block = len(self.buttons) // BLOCK
+            digest = hashlib.blake2b(_BLOCK_KEY.pack(self.seed, block), digest_size=BLOCK).digest()
+            self.buttons += digest.translate(_TO_BUTTON)
+
+    def __getitem__(self, press: int) -> int:
+        """Button highlighted for press number press."""
+        if press >= len(self.buttons):
+            self.extend(press + 1)
+        return self.buttons[press]
+
+    def hits(self, first: int, pressed: bytes) -> int:
+        """How many of the presses first, first + 1, ... were on the highlighted button."""
+        n = len(pressed)
+        self.extend(first + n)
+        # Equal buttons XOR to a zero byte
+        diff = int.from_bytes(self.buttons[first:first + n], "big") ^ int.from_bytes(pressed, "big")
+        return diff.to_bytes(n, "big").count(0)
@@ -1,247 +1,851 @@
+import secrets
 import socket
-from threading import Thread
-from kivy.clock import mainthread
-from kivymd.app import MDApp
-from kivymd.uix.progressindicator import MDLinearProgressIndicator
-from kivymd.uix.menu import MDDropdownMenu
-from myutils import snackbar, get_wifi_addr, add_prog_bar
+import time
+import netlog
+from functools import partial, wraps
+from threading import Thread, current_thread
+from netloop import EventLoop, TimerHandle
+from connection import HEARTBEAT_TIMEOUT, RESUME_GRACE, Connection, set_keepalive
+from registry import Player, Registry
+from discovery import Beacon
+from matchlog import JOIN, LEAVE, MISSED, COUNT as COUNTED, MatchRecorder
+from leaderboard import Leaderboard, MatchResult
+from latency import MASK, LatencyStats, clock_us, delta_us, widen_time
+from sequence import ButtonSequence
+from spectators import SpectatorFeed
+from protocol import (
+    HELLO, HANDSHAKE, NICKNAME, MAX_SCORE, STARTED_BY_CLIENT, NPLAYERS, COUNT, LOSE, RESET,
+    RESTARTED_BY_CLIENT, CLOSED_BY_CLIENT, CLOSED_BY_SERVER, CLOSED_BY_CLIENT_ACK,
+    CLOSED_BY_SERVER_ACK, STARTED_BY_SERVER, RESTARTED_BY_SERVER, SNAPSHOT, PING, PONG, WINNER, REJECT,
+    SESSION, RESUME, SEQ, MISS, JOIN_ROOM, PLAYER_NAME, MAX_NAME_LEN, SEED, TAPS, MAX_TAPS, SPECTATE,
+    ProtocolError, encode, encode_legacy,
+)
+
+PORT = 55555
+# Presses of a player closer than this are not a human thumb, the batch is void
+MIN_TAP_INTERVAL_US = 25_000
+# Presses a player may get ahead of that pace, for batches bunched up on the way
+TAP_BURST = 20
+# Presses a player may make per point of the max score, misses included
+PRESSES_PER_POINT = 4
+# Highest max score a client may ask for (the app offers up to 100), it bounds the button sequence
+SCORE_LIMIT = 1000
+# Seconds a new client has to send HELLO, an old client sends nothing before its NICKNAME
+HELLO_GRACE = 0.5
+# Messages a binary client sends right after HELLO, before it is a player or a spectator
+GREETING = (HANDSHAKE, JOIN_ROOM, SPECTATE, RESUME)
+# Messages that zero the scores, each race (and reset) gets a new button sequence
+NEW_SEQUENCE = (STARTED_BY_SERVER, STARTED_BY_CLIENT, RESET)
+
+
+def loop_thread(method):
+    """Run a Server method on its event loop thread, handed over when called from another one (UI)."""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        # Sockets and game state are only touched by the loop thread
+        if current_thread() is not self.handle_connection_thread:
+            if self.loop:
+                self.loop.call_soon_threadsafe(partial(wrapper, self, *args, **kwargs))
+            return
+        return method(self, *args, **kwargs)
+    return wrapper
 
 
 class Server:
     """Server class for handling client connection and communication and game state management."""
-    def __init__(self):
+    def __init__(self, ip_addr: str = "0.0.0.0", port: int = PORT, tick_rate: int | None = None,
+                 host_player: bool = False, loop: EventLoop | None = None,
+                 heartbeat_timeout: float = HEARTBEAT_TIMEOUT, resume_grace: float = RESUME_GRACE,
+                 leaderboard: Leaderboard | None = None, require_taps: bool = False):
         self.server: socket.socket | None = None
         self.handle_connection_thread: Thread | None = None
-        self.receive_data_thread: Thread | None = None
+        self.loop: EventLoop | None = loop
         self.stop_thread: bool = False
 
-        self.nickname: str | None = "P1"
+        # A room of the lobby shares the event loop of its worker (running in this thread)
+        if loop:
+            self.handle_connection_thread = current_thread()
+
+        self.tick_rate: int | None = tick_rate
+        self.changed_scores: set[int] = set()
+        self.snapshot_timer: TimerHandle | None = None
+        self.last_snapshot: float = 0
+        self.latency = LatencyStats("tap_to_server", "tap_to_broadcast", "tap_to_render")
+        self.received_at: int = 0           # Wire time the data being processed arrived
+        self.heartbeat_timeout: float = heartbeat_timeout
+        self.heartbeat_timer: TimerHandle | None = None
+        self.resume_grace: float = resume_grace
+        self.away: dict[int, TimerHandle] = {}     # Expiry timers of the detached players, by id
+
+        # State sequence: bumped by every broadcast, with the seq each piece of state last changed at
+        self.seq: int = 0
+        self.state_seqs: dict[int, int] = {}        # MAX_SCORE, NPLAYERS, WINNER, SEED and STARTED_BY_SERVER (phase)
+        self.phase: tuple | None = None             # Last start, reset or restart message
+        self.racers: set[int] = set()               # Ids of the players in the race, the ones that PING
+
+        self.ip_addr: str = ip_addr
+        self.port: int = port
+        self.host_player: bool = host_player
+        self.max_score: int = 10
+        self.winner: int | None = None     # Player id of the confirmed winner of this race
+        self.sequence: ButtonSequence | None = None     # Buttons of this race, see new_sequence()
+        self.require_taps: bool = require_taps
+        self.race_started: float | None = None     # Monotonic time of the last start
+        self.leaderboard: Leaderboard | None = leaderboard
+
+        self.nickname: str | None = "P1" if host_player else None
+        self.host_name: str | None = self.nickname     # Leaderboard name of the host player
         self.count: int = 0
-        self.n_players: int = 1
 
-        self.menu_win: MDDropdownMenu | None = None
-        self.menu_lose: MDDropdownMenu | None = None
-
-        # Create lists for clients, nicknames, and players_score
-        self.clients: list[socket] = []
-        self.nicknames: list[str] = []
-        self.players_score: list[int] = [0]
-        self.prog_bars: list[MDLinearProgressIndicator] = []
-
-        # Get WIFI IP address if connected
-        self.ip_addr: str = get_wifi_addr()
-        print(f"Server IP: {self.ip_addr}")
-
-        self.app = MDApp.get_running_app()
-        if self.ip_addr.startswith("Not connected"):
-            self.app.root.ids.ip_label.text = self.ip_addr
-        else:
-            self.app.root.ids.ip_label.text = f"Your IP: {self.ip_addr}"
+        # Players by socket fd and by id, with their scores
+        self.players: Registry = Registry(host_player)
+        self.connections: dict[socket.socket, Connection] = {}     # Every client socket, leaving ones too
+        self.joining: dict[socket.socket, TimerHandle] = {}         # Clients not greeted yet, grace timers
+        self.dirty: set[Connection] = set()
+        self.flush_scheduled: bool = False
+        self.beacon: Beacon | None = None
+        self.recorder: MatchRecorder | None = None
+        self.spectators: SpectatorFeed = SpectatorFeed(loop)
+
+    @property
+    def n_players(self) -> int:
+        """Player slots, as sent in NPLAYERS."""
+        return len(self.players.scores)
+
+    @property
+    def is_empty(self) -> bool:
+        """No player connected, nor away and expected back."""
+        return not self.players and not self.away
 
     def start_server(self):
         """Initialize and start the server socket."""
         try:
-            # Create socket, bind IP/port, and set to listen mode and connection timeout
+            # Create socket, bind IP/port, and set to listen mode without blocking
             self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             self.server.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-            self.server.bind((self.ip_addr, 55555))
+            self.server.bind((self.ip_addr, self.port))
             self.server.listen()
-            self.server.settimeout(1)
+            self.server.setblocking(False)
+
+            # Every socket (listener and clients) is served by one event loop
+            self.loop = EventLoop()
+            self.loop.add_reader(self.server, self.accept_connection)
+            self.spectators.loop = self.loop
 
             try:
-                # Start new thread to run handle_connection()
+                # Start the single network thread running handle_connection()
                 self.handle_connection_thread = Thread(target=self.handle_connection)
                 self.handle_connection_thread.start()
-                snackbar("Server is listening!")
+                self.update_snackbar("Server is listening!")
             except Exception as e:
                 print(f"Error starting handle_connection thread on server: {e}")
 
         except Exception as e:
             print(f"Error starting server: {e}")
 
-    def handle_connection(self):
-        """Thread function to accept new client connections."""
-        while not self.stop_thread:
-            try:
-                # Wait for new incoming connections
-                client, (addr, port) = self.server.accept()
-                print(f"Connected with ({addr}, {port})")
-
-                # Append client socket, nickname, and score to lists
-                nickname = f"P{(len(self.nicknames) + 2)}"
-                self.clients.append(client)
-                self.nicknames.append(nickname)
-                self.players_score.append(0)
-                self.n_players += 1
-
-                # Send nickname to client
-                client.send(f"{nickname}&".encode('ascii'))
-                print(f'{nickname} connected!')
-                self.update_snackbar(f"{nickname} connected!")
-
-                try:
-                    # Start new thread to run receive_data()
-                    self.receive_data_thread = Thread(target=self.receive_data, args=(client,))
-                    self.receive_data_thread.start()
-                except Exception as e:
-                    print(f"Error starting receive_data thread on server: {e}")
-
-                # Update number of player on clients
-                self.broadcast(f'NPLAYERS: {self.n_players}&')
-
-            except TimeoutError:
-                pass
-            except Exception as e:
-                print(f"Exception caught in receive_connection: {e}")
+    def announce(self, name: str):
+        """Announce the game on the LAN (discovery beacons) under name, once the server is started."""
+        if self.loop and not self.beacon:
+            self.beacon = Beacon(self, name)
+            self.loop.call_soon_threadsafe(self.beacon.start)
 
-    def receive_data(self, client):
-        """Thread function to handle communication with a connected client."""
-        while not self.stop_thread:
-            try:
-                # Wait for data from client and deal with buffered data
-                msg_recv = client.recv(1024).decode('ascii')
-                messages = msg_recv.split('&')[:-1]
+    @loop_thread
+    def record(self, directory: str, name: str = "game"):
+        """Record the match events to a new log in directory, once the server is started."""
+        try:
+            self.recorder = MatchRecorder.in_directory(directory, name, self.loop)
+        except OSError as e:
+            print(f"Error starting the match recorder: {e}")
+            return
+        self.recorder.message((MAX_SCORE, self.max_score))
+        for player_id in self.players.by_id if not self.host_player else [1, *self.players.by_id]:
+            self.recorder.add(JOIN, player_id)
 
-                for msg in messages:
-                    print(f"msg from client: {msg}")
-                    self.process_message(client, msg)
+    def handle_connection(self):
+        """Thread function running the event loop for the listener and all clients."""
+        self.loop.run(lambda: self.stop_thread)
+        self.loop.close()
 
-            except TimeoutError:
-                pass
-            except Exception as e:
-                print(f"Exception caught in receive_data: {e}")
-                break
+    def accept_connection(self, server):
+        """Accept a new client connection (listener is readable)."""
+        try:
+            client, (addr, port) = server.accept()
+        except BlockingIOError:
+            return
+        print(f"Connected with ({addr}, {port})")
+        self.add_client(client)
+
+    def add_client(self, client, data: bytes | None = None):
+        """Add a connected client socket to the game, it joins once greeted.
+
+        data: bytes already read by whoever accepted the socket (the lobby,
+        after the handshake and JOIN_ROOM), the client joins right after them.
+        """
+        client.setblocking(False)
+        set_keepalive(client)
+        self.connections[client] = Connection(client, self.loop, on_overflow=self.drop_slow_client)
+        self.joining[client] = self.loop.call_later(HELLO_GRACE, self.add_player, client)
+
+        # Watch the client socket on the event loop
+        self.loop.add_reader(client, self.receive_data)
+
+        if data is not None:
+            self.connections[client].decoder.feed(data)
+            self.read_messages(client)
+            if client in self.joining:
+                self.add_player(client)
+
+    def add_player(self, client) -> Player:
+        """A new client plays: register it under the lowest free id and tell everybody."""
+        self.joining.pop(client).cancel()
+        connection = self.connections[client]
+        player = self.players.add(client, connection)
+        if self.recorder:
+            self.recorder.add(JOIN, player.player_id)
+
+        # Send nickname to client (in ASCII to an old client)
+        self.send(client, (NICKNAME, player.player_id))
+        if connection.binary and self.resume_grace:
+            self.send(client, (SESSION, player.token))
+        print(f'{player.nickname} connected!')
+        self.update_snackbar(f"{player.nickname} connected!")
+
+        # Update number of player on clients
+        self.broadcast((NPLAYERS, self.n_players))
+        return player
+
+    def receive_data(self, client):
+        """Handle data from a connected client (client socket is readable)."""
+        connection = self.connections[client]
+        try:
+            # Read what is available straight into the client frame buffer
+            n_bytes = connection.receive()
+        except BlockingIOError:
+            return
+        except OSError as e:
+            # Reset, or keepalive probes unanswered
+            print(f"Exception caught in receive_data: {e}")
+            n_bytes = 0
+
+        # Peer went away: reap it, a closed socket costs nothing more
+        if not n_bytes:
+            if client in self.players:
+                self.drop_client(client)
+            else:
+                # Left with CLOSED_BY_CLIENT already, a spectator, or never greeted
+                self.forget_client(client)
+            return
+        self.read_messages(client)
+
+    def read_messages(self, client):
+        """Process the messages received from a client, a binary client joins after its greeting."""
+        connection = self.connections[client]
+        self.received_at = clock_us()
+        try:
+            messages = connection.decoder.messages()
+        except ProtocolError as e:
+            self.drop_bad_client(client, e)
+            return
+        for msg in messages:
+            if netlog.level:
+                netlog.message("from client", msg)
+            self.process_message(client, msg)
+        if client in self.joining and connection.binary:
+            self.add_player(client)
 
     def process_message(self, client, msg):
         """Process incoming messages based on their type."""
-        if msg.startswith('MAX_SCORE'):
-            max_score = int(msg[11:])
-            self.app.max_score = max_score
-            self.broadcast(f"{msg}&")
+        kind = msg[0]
+
+        # Spectators only watch
+        if kind not in (HANDSHAKE, PING, CLOSED_BY_CLIENT) and self.connections[client] in self.spectators:
+            return
+
+        # An old client talking (it never sent HELLO) or a binary one done with its greeting: it plays
+        if kind not in GREETING and client in self.joining:
+            self.add_player(client)
+
+        # Peer speaks the binary protocol, answer and switch to it
+        if kind == HANDSHAKE:
+            connection = self.connections[client]
+            connection.queue_raw(HELLO)
+            connection.binary = True
+            self.schedule_flush(connection)
+            player = self.players.get(client)
+            if player and self.resume_grace:
+                self.send(client, (SESSION, player.token))
+
+        # Reconnected after losing its socket, take the old slot back
+        elif kind == RESUME:
+            self.resume_session(client, msg[1], msg[2])
+
+        # Joined to watch the game, not to play
+        elif kind == SPECTATE:
+            self.add_spectator(client)
+
+        elif kind == MAX_SCORE:
+            self.max_score = min(max(msg[1], 1), SCORE_LIMIT)
+            self.update_max_score(self.max_score)
+            self.broadcast((MAX_SCORE, self.max_score))
 
         # Start game
-        elif msg.startswith('STARTED_BY_CLIENT'):
-            self.broadcast(f'STARTED_BY_CLIENT&')
+        elif kind == STARTED_BY_CLIENT:
+            self.reset_scores()
+            self.broadcast(msg)
             self.start_game_screen()
 
-        # Receive client score
-        elif msg.startswith('COUNT'):
-            self.broadcast(f"{msg}&")
-            idx = int(msg[7]) - 1
-            count = int(msg[10:])
-            self.players_score[idx] = count
-            self.update_counter(count, idx)
-
-        # Open lose menu
-        elif msg.startswith('LOSE'):
-            self.broadcast(f"{msg}&")
-            self.update_menu_lose()
+        # Receive client score, only one step forward in its own slot is taken. Binary clients send
+        # their presses as TAPS once the race has a button sequence, a COUNT would skip the check
+        elif kind == COUNT:
+            player = self.players.get(client)
+            count, tap_time = msg[2], widen_time(msg[3], self.received_at)
+            if player is None:
+                pass    # Left the game already
+            elif (self.require_taps or msg[1] != player.player_id
+                  or (self.sequence and player.connection.binary)
+                  or count != self.players.scores[player.idx] + 1 or count > self.max_score):
+                self.send(client, (REJECT, self.players.scores[player.idx]))
+            else:
+                if tap_time:
+                    self.latency.record("tap_to_server", delta_us(self.received_at, tap_time))
+                self.update_score(player.idx, count, tap_time)
+                self.update_counter(count, player.idx, tap_time)
+
+        # Presses of a client since its last batch, scored against the race's button sequence
+        elif kind == TAPS:
+            player = self.players.get(client)
+            if player:
+                self.receive_taps(player, msg[1], msg[2], msg[3], msg[4])
+
+        # Name of the player's device
+        elif kind == PLAYER_NAME:
+            player = self.players.get(client)
+            name = msg[1].strip()[:MAX_NAME_LEN]
+            if player and name:
+                player.name = name
+
+        # Wrong button pressed, only kept for the match log
+        elif kind == MISS:
+            player = self.players.get(client)
+            if player and self.recorder:
+                self.recorder.add(MISSED, player.player_id)
+
+        # Clock probe from a client, answer with our receive and send times
+        elif kind == PING:
+            self.send(client, (PONG, msg[1], self.received_at, clock_us()))
+
+        # Sent by a client that thinks it won (old servers relay it), the winner
+        # is decided from the scores by update_score, which sends LOSE itself
+        elif kind == LOSE:
+            pass
 
         # Reset score and progress bars
-        elif msg.startswith('RESET'):
-            self.broadcast(f"{msg}&")
+        elif kind == RESET:
+            self.reset_scores()
+            self.broadcast(msg)
             self.update_reset()
 
-        # Remove everything and stop thread
-        elif msg.startswith('RESTARTED_BY_CLIENT'):
-            self.broadcast(f"{msg}&")
+        # Remove everything and stop thread (a dedicated host keeps running)
+        elif kind == RESTARTED_BY_CLIENT:
+            self.broadcast(msg)
+            self.reset_scores()
             self.update_reset()
             self.update_back_home()
-            self.close_connection(close_clients=False)
+            if self.host_player:
+                self.close_connection(close_clients=False)
 
         # Close connection, remove everything, and stop thread
-        elif msg.startswith('CLOSED_BY_CLIENT'):
-            nickname = self.nicknames[self.clients.index(client)]
-            self.clients.remove(client)
-            self.nicknames.remove(nickname)
-            client.send('CLOSED_BY_CLIENT_ACK&'.encode('ascii'))
-            self.update_snackbar(f"{nickname} disconnected!")
-            print(f"{nickname} disconnected!")
+        elif kind == CLOSED_BY_CLIENT:
+            player = self.players.get(client)
+            if player:
+                self.remove_player(player)
+            self.send(client, (CLOSED_BY_CLIENT_ACK,))
 
         # Acknowledge from client
-        elif msg.startswith('CLOSED_BY_SERVER_ACK'):
-            client.close()
+        elif kind == CLOSED_BY_SERVER_ACK:
+            self.connections.pop(client).close()
             self.stop_thread = True
 
-        # Any other message is broadcast to clients
+    def send(self, client, message: tuple):
+        """Queue a message to one client in the protocol it speaks."""
+        connection = self.connections[client]
+        connection.queue(message)
+        self.schedule_flush(connection)
+
+    @loop_thread
+    def broadcast(self, *messages: tuple):
+        """Queue messages to all connected clients, they go out in one write per client."""
+        self.seq += 1
+        if any(message[0] in NEW_SEQUENCE for message in messages):
+            messages = (self.new_sequence(),) + messages
+        for message in messages:
+            self.record_seq(message)
+            if self.recorder:
+                self.recorder.message(message)
+            self.spectators.message(message)
+        messages += ((SEQ, self.seq),)
+        for message in messages:
+            if netlog.level:
+                netlog.message("broadcast", message)
+            frame = encode(message)
+            legacy = None
+            for player in self.players:
+                connection = player.connection
+                if connection.binary:
+                    connection.queue(message, frame)
+                elif message[0] != SEQ:
+                    if legacy is None:
+                        legacy = encode_legacy(message)
+                    connection.queue(message, legacy)
+                self.dirty.add(connection)
+        self.schedule_flush()
+
+    def record_seq(self, message: tuple):
+        """Remember the seq a piece of state was last sent with, for the resuming clients."""
+        kind = message[0]
+        if kind == COUNT:
+            self.players.score_seqs[message[1] - 1] = self.seq
+        elif kind == SNAPSHOT:
+            score_seqs = self.players.score_seqs
+            for player_id, _, _ in message[1]:
+                score_seqs[player_id - 1] = self.seq
+        elif kind in (MAX_SCORE, NPLAYERS, WINNER, SEED):
+            self.state_seqs[kind] = self.seq
+        elif kind in (STARTED_BY_SERVER, STARTED_BY_CLIENT, RESET, RESTARTED_BY_SERVER, RESTARTED_BY_CLIENT):
+            self.phase = message
+            self.state_seqs[STARTED_BY_SERVER] = self.seq
+            self.race_started = time.monotonic() if kind in (STARTED_BY_SERVER, STARTED_BY_CLIENT) else None
+            # Who joins afterwards waits for the next race and does not PING meanwhile
+            self.racers = {player.player_id for player in self.players} if kind in NEW_SEQUENCE else set()
+            # Nobody joins during a race, the beacons would only keep the radios awake
+            if self.beacon:
+                if self.race_started:
+                    self.beacon.pause()
+                else:
+                    self.beacon.resume()
+
+    def resume_session(self, client, token: int, last_seq: int):
+        """Give a reconnecting client its old slot back and send it what it missed since last_seq."""
+        new_player = self.players.get(client)
+        if new_player is None and client not in self.joining:
+            return      # A spectator
+        player = self.players.by_token.get(token)
+        if player is None or player is new_player:
+            # Session expired: the client plays on as a new player, from press 0
+            new_player = new_player or self.add_player(client)
+            self.send(client, (RESUME, new_player.token, self.seq))
+            if self.sequence and self.phase and self.phase[0] in NEW_SEQUENCE:
+                self.send(client, (SEED, self.sequence.seed))
+            return
+
+        if new_player is None:
+            self.joining.pop(client).cancel()
         else:
-            self.broadcast(msg)
-
-    def broadcast(self, message):
-        """Send a message to all connected clients."""
-        print(f"Broadcasting: {message}")
-        for client in self.clients:
-            client.send(message.encode('ascii'))
+            # Greeted in two reads, drop the player the client joined as, quietly
+            for idx in self.players.remove(new_player):
+                self.changed_scores.discard(idx)
+        # Move the old player to this socket
+        if player.sock is not None:
+            # The old socket is half-open (the client saw it die first), the token proves who this is
+            old_connection = player.connection
+            self.players.detach(player)
+            del self.connections[old_connection.sock]
+            old_connection.close()
+        else:
+            self.away.pop(player.player_id).cancel()
+        self.players.attach(player, client, self.connections[client])
+
+        missed = [message for kind, message in (
+            (MAX_SCORE, (MAX_SCORE, self.max_score)),
+            (NPLAYERS, (NPLAYERS, self.n_players)),
+            (SEED, (SEED, self.sequence.seed) if self.sequence else None),
+            (STARTED_BY_SERVER, self.phase),
+        ) if self.state_seqs.get(kind, 0) > last_seq]
+        score_seqs, scores, tap_times = self.players.score_seqs, self.players.scores, self.players.tap_times
+        changed = tuple((idx + 1, scores[idx], tap_times[idx])
+                        for idx in range(len(scores)) if score_seqs[idx] > last_seq)
+        if changed:
+            missed.append((SNAPSHOT, changed))
+        if self.winner is not None and self.state_seqs.get(WINNER, 0) > last_seq:
+            missed += [(WINNER, self.winner), (LOSE,)]
+        for message in missed + [(NICKNAME, player.player_id), (RESUME, token, self.seq)]:
+            self.send(client, message)
+
+        # The others saw the new player join
+        self.broadcast((NPLAYERS, self.n_players))
+        self.update_snackbar(f"{player.nickname} reconnected!")
+        print(f"{player.nickname} resumed its session ({len(missed)} messages missed)")
+
+    def add_spectator(self, client):
+        """A client joined to watch, it never gets a player slot."""
+        player = self.players.get(client)
+        connection = self.connections[client]
+        if not connection.binary:
+            return
+        if client in self.joining:
+            self.joining.pop(client).cancel()
+        elif player is None:
+            return      # Watching already
+        else:
+            # Greeted in two reads and taken for a player meanwhile, its slot is free again
+            for idx in self.players.remove(player):
+                self.changed_scores.discard(idx)
+            if self.recorder:
+                self.recorder.add(LEAVE, player.player_id)
+            self.broadcast((NPLAYERS, self.n_players))
+        self.spectators.add(connection)
+        print(f"Spectator joined, {len(self.spectators)} watching")
+
+    @loop_thread
+    def update_score(self, idx: int, count: int, tap_time: int = 0, record: bool = True):
+        """Record a player score and send it, right away or with the next snapshot.
+
+        record: log the count (False when the caller logged its taps already).
+        """
+        if idx >= len(self.players.scores):
+            return      # Player left meanwhile
+        self.players.scores[idx] = count
+        self.players.tap_times[idx] = tap_time
+        if self.recorder and record:
+            self.recorder.add(COUNTED, idx + 1, count)
+        if not self.tick_rate:
+            if tap_time:
+                self.latency.record("tap_to_broadcast", delta_us(clock_us(), tap_time))
+            self.broadcast((COUNT, idx + 1, count, tap_time))
+        else:
+            self.changed_scores.add(idx)
+            if count >= self.max_score:
+                # A win must not wait for the next tick
+                self.send_snapshot()
+            elif not self.snapshot_timer:
+                delay = self.last_snapshot + 1 / self.tick_rate - time.monotonic()
+                self.snapshot_timer = self.loop.call_later(max(0, delay), self.send_snapshot)
+
+        # Players who stop talking during the race are dropped
+        if not self.heartbeat_timer and self.heartbeat_timeout:
+            self.heartbeat_timer = self.loop.call_later(self.heartbeat_timeout / 2, self.check_heartbeats)
+
+        # First to reach max score wins, players who predicted otherwise roll back
+        if count >= self.max_score and self.winner is None:
+            self.winner = idx + 1
+            self.broadcast((WINNER, idx + 1), (LOSE,))
+            self.update_winner(idx)
+            if self.leaderboard and self.race_started is not None:
+                self.leaderboard.record(self.race_result(idx))
+
+    def new_sequence(self) -> tuple:
+        """Draw the button sequence of a new race (or reset), return the SEED message announcing it."""
+        # The presses of every slot were zeroed with the scores
+        self.sequence = ButtonSequence(secrets.randbits(64) or 1, 2 * self.max_score)
+        self.update_sequence(self.sequence.seed)
+        return SEED, self.sequence.seed
+
+    def receive_taps(self, player: Player, seed: int, first: int, buttons: bytes, tap_times: tuple[int, ...]):
+        """Score a batch of presses of a client: those on the highlighted button of their press number."""
+        if self.sequence is None or seed != self.sequence.seed:
+            return      # Presses of a race that is over
+        idx = player.idx
+        presses, scores = self.players.presses, self.players.scores
+        if (first > presses[idx] or len(buttons) > MAX_TAPS
+                or first + len(buttons) > PRESSES_PER_POINT * self.max_score):
+            # Presses never sent before these (the sequence is only checked from where the player is),
+            # or far more than a race takes
+            self.send(player.sock, (REJECT, scores[idx]))
+            return
+        if first < presses[idx]:
+            # Sent again after a resume, only the presses not taken yet count
+            skip = presses[idx] - first
+            first, buttons, tap_times = presses[idx], buttons[skip:], tap_times[skip:]
+        if not buttons:
+            return
+        presses[idx] = first + len(buttons)
+
+        # Paced on the server clock, the tap times are the client's word
+        # (a pace out of the burst window, 0 or wrapped around the clock, starts from the floor)
+        burst = TAP_BURST * MIN_TAP_INTERVAL_US
+        floor = (self.received_at - burst) & MASK
+        pace = player.tap_pace if 0 < delta_us(player.tap_pace, floor) <= burst else floor
+        pace = (pace + len(buttons) * MIN_TAP_INTERVAL_US) & MASK
+        if delta_us(pace, self.received_at) > 0:
+            print(f"{player.nickname} pressed faster than a human thumb, batch void")
+            self.send(player.sock, (REJECT, scores[idx]))
+            return
+        player.tap_pace = pace
+
+        tap_time = tap_times[-1]
+        if tap_time:
+            self.latency.record("tap_to_server", delta_us(self.received_at, tap_time))
+        count = min(scores[idx] + self.sequence.hits(first, buttons), self.max_score)
+        if self.recorder:
+            self.record_presses(player, first, buttons, tap_times)
+        if count > scores[idx]:
+            self.update_score(idx, count, tap_time, record=False)
+            self.update_counter(count, idx, tap_time)
+
+    def record_presses(self, player: Player, first: int, buttons: bytes, tap_times: tuple[int, ...]):
+        """Log every press of a batch at its tap time, as a count or a miss."""
+        now = clock_us()
+        count = self.players.scores[player.idx]
+        highlighted = self.sequence.buttons[first:first + len(buttons)]
+        for button, expected, tap_time in zip(buttons, highlighted, tap_times):
+            ago_us = max(0, delta_us(now, tap_time)) if tap_time else 0
+            if button == expected and count < self.max_score:
+                count += 1
+                self.recorder.add(COUNTED, player.player_id, count, ago_us)
+            else:
+                self.recorder.add(MISSED, player.player_id, 0, ago_us)
+
+    def race_result(self, winner_idx: int) -> MatchResult:
+        """Result of the race just won, for the leaderboard."""
+        names = {player.idx: player.name for player in self.players.by_id.values()}
+        if self.host_player:
+            names[0] = self.host_name
+        scores = tuple((names[idx], score, idx == winner_idx)
+                       for idx, score in enumerate(self.players.scores) if idx in names)
+        return MatchResult(time.time(), self.max_score, names.get(winner_idx, f"P{winner_idx + 1}"),
+                           round((time.monotonic() - self.race_started) * 1000), scores)
+
+    @loop_thread
+    def record_miss(self, idx: int):
+        """Log a press on a button that was not highlighted (the host's own misses)."""
+        if self.recorder:
+            self.recorder.add(MISSED, idx + 1)
+
+    def check_heartbeats(self):
+        """Drop the binary racers silent for heartbeat_timeout, again until the race is won."""
+        self.heartbeat_timer = None
+        deadline = time.monotonic() - self.heartbeat_timeout
+        for player in self.players:
+            if (player.player_id in self.racers and player.connection.binary
+                    and player.connection.last_received < deadline):
+                print(f"{player.nickname} timed out")
+                self.drop_client(player.sock)
+        if self.winner is None and self.players:
+            self.heartbeat_timer = self.loop.call_later(self.heartbeat_timeout / 2, self.check_heartbeats)
+
+    def send_snapshot(self):
+        """Broadcast the scores that changed since the last snapshot."""
+        if self.snapshot_timer:
+            self.snapshot_timer.cancel()
+            self.snapshot_timer = None
+        if not self.changed_scores:
+            return
+        now = clock_us()
+        players_score, tap_times = self.players.scores, self.players.tap_times
+        for idx in self.changed_scores:
+            if tap_times[idx]:
+                self.latency.record("tap_to_broadcast", delta_us(now, tap_times[idx]))
+        scores = tuple((idx + 1, players_score[idx], tap_times[idx]) for idx in sorted(self.changed_scores))
+        self.changed_scores.clear()
+        self.last_snapshot = time.monotonic()
+        self.broadcast((SNAPSHOT, scores))
+
+    @loop_thread
+    def reset_scores(self):
+        """Zero every score and drop the changes not sent yet (new game or reset)."""
+        if self.snapshot_timer:
+            self.snapshot_timer.cancel()
+            self.snapshot_timer = None
+        if self.heartbeat_timer:
+            self.heartbeat_timer.cancel()
+            self.heartbeat_timer = None
+        self.changed_scores.clear()
+        self.winner = None
+        self.players.reset_scores()
+
+    def schedule_flush(self, connection: Connection | None = None):
+        """Flush the given (and every dirty) connection once the loop is done with this round."""
+        if connection:
+            self.dirty.add(connection)
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            self.loop.call_soon(self.flush)
+
+    def flush(self):
+        """Write the queue of every dirty connection."""
+        self.flush_scheduled = False
+        dirty, self.dirty = self.dirty, set()
+        for connection in dirty:
+            connection.flush()
+
+    def drop_slow_client(self, connection: Connection):
+        """Disconnect a client that fell too far behind (called on queue overflow)."""
+        # Called while broadcasting to the client list, so do it right after
+        self.loop.call_soon(self.drop_client, connection.sock)
+
+    def drop_client(self, client):
+        """Remove a client from the game (or hold its slot until it resumes) and close its socket."""
+        player = self.players.get(client)
+        if player is None:
+            connection = self.connections.get(client)
+            if connection in self.spectators:
+                self.spectators.discard(connection)
+                self.connections.pop(client).close()
+            return
+        connection = self.connections.pop(client)
+        if connection.binary and self.resume_grace:
+            self.players.detach(player)
+            self.away[player.player_id] = self.loop.call_later(self.resume_grace, self.expire_session, player)
+            print(f"{player.nickname} lost its connection, slot held for {self.resume_grace:g} s")
+        else:
+            self.remove_player(player)
+        connection.close()
+        if self.is_empty:
+            self.room_empty()
+
+    def drop_bad_client(self, client, error: ProtocolError):
+        """Remove a client whose byte stream cannot be decoded, no resume for it."""
+        print(f"Dropping a client that sent a bad frame: {error}")
+        player = self.players.get(client)
+        if player:
+            self.remove_player(player)
+        self.forget_client(client)
+
+    def forget_client(self, client):
+        """Close the socket of a client that is not (or no longer) a player."""
+        timer = self.joining.pop(client, None)
+        if timer:
+            timer.cancel()
+        connection = self.connections.pop(client)
+        self.spectators.discard(connection)
+        connection.close()
+        if self.is_empty:
+            self.room_empty()
+
+    def expire_session(self, player: Player):
+        """A detached player did not come back in time, free its slot."""
+        del self.away[player.player_id]
+        self.remove_player(player)
+        if self.is_empty:
+            self.room_empty()
+
+    def remove_player(self, player: Player):
+        """Take a player out of the game, free its slot and tell the others the new NPLAYERS."""
+        for idx in self.players.remove(player):
+            self.changed_scores.discard(idx)
+        if self.recorder:
+            self.recorder.add(LEAVE, player.player_id)
+        self.broadcast((NPLAYERS, self.n_players))
+
+        self.update_snackbar(f"{player.nickname} disconnected!")
+        print(f"{player.nickname} disconnected!")
+
+    def latency_summary(self) -> dict[str, dict[str, float]]:
+        """Percentiles of the latency histograms, in milliseconds (metric)."""
+        return self.latency.summary()
+
+    def queue_depths(self) -> dict[str, int]:
+        """Frames waiting to be written per client (metric)."""
+        return {player.nickname: player.connection.queue_depth for player in self.players}
 
     def close_connection(self, close_clients=True):
         """Close the server socket and optionally disconnect all clients."""
-        if close_clients:
-            clients = self.clients.copy()
-            for client in clients:
-                index = self.clients.index(client)
-                nickname = self.nicknames[index]
-                self.clients.remove(client)
-                self.nicknames.remove(nickname)
-                print(f"Disconnecting client {nickname}")
-                client.send('CLOSED_BY_SERVER&'.encode('ascii'))
+        if current_thread() is self.handle_connection_thread:
+            # Called from process_message the loop is already on its way out
+            self.shutdown(close_clients)
+        else:
+            self.loop.call_soon_threadsafe(self.shutdown, close_clients)
+            self.handle_connection_thread.join()
+        self.server.close()
 
+    def shutdown(self, close_clients):
+        """Disconnect clients if asked, write what is still queued and stop the loop."""
+        if close_clients:
+            for player in self.players:
+                self.players.remove(player)
+                print(f"Disconnecting client {player.nickname}")
+                self.send(player.sock, (CLOSED_BY_SERVER,))
+        for timer in (*self.away.values(), *self.joining.values()):
+            timer.cancel()
+        self.spectators.close()
+
+        if self.beacon:
+            self.beacon.close()
+        if self.recorder:
+            self.recorder.close()
+        self.flush()
         self.stop_thread = True
-        self.handle_connection_thread.join()
-        self.server.close()
 
-    # UI update methods (executed on main thread)
-    @mainthread
-    def start_game_screen(self):
-        """Add progress bar widgets and switch to game screen."""
-        for i in range(self.n_players):
-            prog_bar, panel = add_prog_bar(num=i, max_score=self.app.max_score)
-            self.prog_bars.append(prog_bar)
-            self.app.root.ids.prog_bar_grid.add_widget(panel)
+    def room_empty(self):
+        """Called when the last client has left (used by the lobby to free the room)."""
 
-        # Change to game screen (screen B)
-        self.app.root.current = "screen B"
+    # UI update methods (overridden by HostServer, no-ops on a dedicated host)
+    def start_game_screen(self):
+        """Switch to the game screen."""
 
-    @mainthread
     def update_snackbar(self, message):
-        """Display a snackbar notification."""
-        snackbar(message)
+        """Display a notification."""
+
+    def update_max_score(self, max_score: int):
+        """Show the max score chosen by a client."""
 
-    @mainthread
-    def update_counter(self, count: int, idx: int):
+    def update_sequence(self, seed: int):
+        """Highlight the buttons of the new race's sequence."""
+
+    def update_counter(self, count: int, idx: int, tap_time: int = 0):
         """Update the progress bar and counter label."""
-        self.prog_bars[idx].value = count
-        if idx == 0:
-            self.app.root.ids.count_label.text = str(count)
 
-    @mainthread
-    def update_menu_lose(self):
-        """Open the lose menu."""
-        self.menu_lose.open()
+    def update_winner(self, idx: int):
+        """Show the confirmed winner of the race."""
 
-    @mainthread
     def update_reset(self):
         """Reset counters and progress bars."""
         self.count = 0
-        self.app.root.ids.count_label.text = "0"
-        for i in range(self.n_players):
-            self.prog_bars[i].value = 0
-
-        if self.menu_win:
-            self.menu_win.dismiss()
-        if self.menu_lose:
-            self.menu_lose.dismiss()
 
-    @mainthread
     def update_back_home(self):
-        """Remove progress bars widgets and return to home screen."""
-        prog_bar_grid = self.app.root.ids.prog_bar_grid
-        children = prog_bar_grid.children.copy()
-        for child in children:
-            prog_bar_grid.remove_widget(child)
-        self.prog_bars = []
-
-        self.app.root.ids.nickname_label.text = ""
-        self.app.root.current = "screen A"
-
-
+        """Return to the home screen."""
+
+
+def main():
+    """Run a dedicated server: python -m server [--port PORT]."""
+    import argparse     # Only the command line needs it, not the app
+
+    parser = argparse.ArgumentParser(description="Tap Race dedicated server")
+    parser.add_argument("--host", default="0.0.0.0", help="address to bind (default: all)")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--tick-rate", type=int, default=30,
+                        help="score snapshots per second, 0 to echo every tap")
+    parser.add_argument("--heartbeat-timeout", type=float, default=HEARTBEAT_TIMEOUT,
+                        help="seconds a player may stay silent during a race, 0 to never drop")
+    parser.add_argument("--resume-grace", type=float, default=RESUME_GRACE,
+                        help="seconds the slot of a disconnected player is held for it to resume, 0 to free it")
+    parser.add_argument("--require-taps", action="store_true",
+                        help="only score the presses checked against the button sequence (no COUNT from old clients)")
+    parser.add_argument("--leaderboard", metavar="DB", default=None,
+                        help="store the race results in the SQLite database DB (see leaderboard.py)")
+    parser.add_argument("--record", metavar="DIR", default=None,
+                        help="record the match events to a log in DIR (see matchlog.py)")
+    parser.add_argument("--log", choices=list(netlog.LEVELS), default=None,
+                        help="network log level (default: TAP_RACE_LOG or off)")
+    parser.add_argument("--announce", metavar="NAME", default=None,
+                        help="announce the game on the LAN under NAME (discovery beacons)")
+    args = parser.parse_args()
+    if args.log:
+        netlog.set_level(args.log)
+
+    leaderboard = Leaderboard(args.leaderboard) if args.leaderboard else None
+    server = Server(ip_addr=args.host, port=args.port, tick_rate=args.tick_rate or None,
+                    heartbeat_timeout=args.heartbeat_timeout, resume_grace=args.resume_grace,
+                    leaderboard=leaderboard, require_taps=args.require_taps)
+    server.start_server()
+    if not server.handle_connection_thread:
+        raise SystemExit(1)
+    if args.announce:
+        server.announce(args.announce)
+    if args.record:
+        server.record(args.record, str(args.port))
+    print(f"Listening on {args.host}:{args.port}")
+    try:
+        server.handle_connection_thread.join()
+    except KeyboardInterrupt:
+        server.close_connection(close_clients=True)
+    if leaderboard:
+        leaderboard.close()
+    for name, stats in server.latency_summary().items():
+        if stats["count"]:
+            print(f"{name}: {stats}")
+
+
+if __name__ == "__main__":
+    main()
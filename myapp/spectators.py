@@ -0,0 +1,143 @@
+"""Read-only spectators: a throttled, delta-encoded scoreboard stream.
+
+A spectator connects like a player and sends SPECTATE right after HELLO
+(and JOIN_ROOM on a lobby): it never gets a player slot, only what a
+SpectatorFeed sends, and never sends a score:
+    on SPECTATE  MAX_SCORE, NPLAYERS, the phase (start, reset...), every
+                 score and the winner, what the stream built up to now
+    then         the phase messages as they happen, and at most rate times
+                 a second a SNAPSHOT of only the scores changed since the last
+Every frame is encoded once for all the spectators, and a spectator that
+falls behind is dropped like a slow player. The feed keeps its own copy of
+the state, built from the game messages only, so the same feed runs in the
+Server (its broadcasts) and in a relay (the stream it watches, relay.py).
+
+On the game server a spectator costs one frame per tick, for a big screen
+or a few phones. For dozens, run a relay: the game server then has one
+spectator, the relay process fans the stream out to everyone else.
+"""
+from array import array
+from connection import Connection
+from netloop import EventLoop, TimerHandle
+from protocol import (
+    MAX_SCORE, NPLAYERS, STARTED_BY_SERVER, STARTED_BY_CLIENT, COUNT, RESET, CLOSED_BY_SERVER, SNAPSHOT,
+    WINNER, encode,
+)
+
+# Scoreboard updates per second
+SPECTATOR_RATE = 10
+
+# Messages that zero the scores (a restart sends the players home, the spectators stay for the next race)
+PHASES = (STARTED_BY_SERVER, STARTED_BY_CLIENT, RESET)
+
+
+class SpectatorFeed:
+    """The spectators of one game and the scoreboard state they were sent (event loop thread)."""
+    def __init__(self, loop: EventLoop | None, rate: int = SPECTATOR_RATE):
+        self.loop = loop
+        self.rate = rate
+        self.connections: set[Connection] = set()
+        self.timer: TimerHandle | None = None
+
+        self.max_score: int | None = None
+        self.n_players: int = 0
+        self.phase: tuple | None = None
+        self.winner: int | None = None
+        self.scores = array('I')        # Latest score of each slot
+        self.sent = array('I')          # Score of each slot as last sent
+
+    def __len__(self) -> int:
+        return len(self.connections)
+
+    def __contains__(self, connection: Connection) -> bool:
+        return connection in self.connections
+
+    def add(self, connection: Connection) -> None:
+        """A new spectator: send it the whole scoreboard, the stream goes on from there."""
+        # Pending changes go to the others first, so the new one starts from the same scores
+        self.tick()
+        self.connections.add(connection)
+        messages = [(MAX_SCORE, self.max_score)] if self.max_score is not None else []
+        messages.append((NPLAYERS, self.n_players))
+        if self.phase:
+            messages.append(self.phase)
+        scores = tuple((idx + 1, score, 0) for idx, score in enumerate(self.sent) if score)
+        if scores:
+            messages.append((SNAPSHOT, scores))
+        if self.winner is not None:
+            messages.append((WINNER, self.winner))
+        for message in messages:
+            connection.queue(message)
+        connection.flush()
+
+    def discard(self, connection: Connection) -> None:
+        self.connections.discard(connection)
+
+    def message(self, message: tuple) -> None:
+        """Follow a game message: keep the scores for the next tick, send the rest right away."""
+        kind = message[0]
+        if kind == COUNT:
+            self.set_score(message[1] - 1, message[2])
+            return
+        elif kind == SNAPSHOT:
+            for player_id, count, _ in message[1]:
+                self.set_score(player_id - 1, count)
+            return
+        elif kind == MAX_SCORE:
+            self.max_score = message[1]
+        elif kind == NPLAYERS:
+            self.n_players = message[1]
+            del self.scores[self.n_players:], self.sent[self.n_players:]
+            while len(self.scores) < self.n_players:
+                self.scores.append(0)
+                self.sent.append(0)
+        elif kind == WINNER:
+            self.winner = message[1]
+        elif kind in PHASES:
+            self.phase = message
+            self.winner = None
+            zeros = array('I', bytes(self.scores.itemsize * self.n_players))
+            self.scores[:] = zeros
+            self.sent[:] = zeros
+        else:
+            return      # Not part of the scoreboard
+        # Scores changed before this message go before it
+        self.tick()
+        self.fan_out(message)
+
+    def set_score(self, idx: int, count: int) -> None:
+        if idx >= len(self.scores):
+            return
+        self.scores[idx] = count
+        if self.connections and not self.timer:
+            self.timer = self.loop.call_later(1 / self.rate, self.tick)
+
+    def tick(self) -> None:
+        """Send the scores changed since the last tick, as one SNAPSHOT for every spectator."""
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+        if self.scores == self.sent:
+            return
+        changed = tuple((idx + 1, score, 0)
+                        for idx, (score, sent) in enumerate(zip(self.scores, self.sent)) if score != sent)
+        self.sent[:] = self.scores
+        self.fan_out((SNAPSHOT, changed))
+
+    def fan_out(self, message: tuple) -> None:
+        """Send a message to every spectator, encoded once."""
+        if not self.connections:
+            return
+        frame = encode(message)
+        # A spectator that overflows is dropped meanwhile
+        for connection in tuple(self.connections):
+            connection.queue(message, frame)
+            connection.flush()
+
+    def close(self) -> None:
+        """The game is over for good: tell the spectators."""
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+        self.fan_out((CLOSED_BY_SERVER,))
+        self.connections.clear()
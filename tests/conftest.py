@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The app modules import each other by name, as when run from the myapp directory
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "myapp"))
@@ -0,0 +1,33 @@
+import socket
+
+from connection import Connection
+from netloop import EventLoop
+from protocol import COUNT, HELLO, NPLAYERS, SEQ, FrameDecoder
+
+
+def test_counts_coalesce_across_seq():
+    loop = EventLoop()
+    ours, theirs = socket.socketpair()
+    try:
+        connection = Connection(ours, loop)
+        connection.binary = True
+        for seq in range(1, 6):
+            connection.queue((COUNT, 1, seq, 0))
+            connection.queue((SEQ, seq))
+        assert connection.queue_depth == 2
+        assert connection.dropped_counts == 4
+
+        # A control frame in between keeps its place, the latest SEQ still comes last
+        connection.queue((NPLAYERS, 2))
+        connection.queue((COUNT, 1, 6, 0))
+        connection.queue((SEQ, 6))
+        assert connection.queue_depth == 4
+        connection.flush()
+
+        decoder = FrameDecoder()
+        decoder.feed(HELLO + theirs.recv(4096))
+        assert [message[0] for message in decoder.messages()][1:] == [COUNT, NPLAYERS, COUNT, SEQ]
+    finally:
+        ours.close()
+        theirs.close()
+        loop.close()
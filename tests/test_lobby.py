@@ -0,0 +1,71 @@
+import socket
+from collections import deque
+from lobby import DEFAULT_ROOM, Lobby, room_name
+from netloop import EventLoop
+from protocol import FrameDecoder
+
+
+def lobby_with_workers(n_workers: int) -> tuple[Lobby, list[socket.socket]]:
+    """A Lobby whose worker channels end in the returned sockets, no process started."""
+    lobby = Lobby(n_workers=n_workers)
+    lobby.loop = EventLoop()
+    workers = []
+    for _ in range(n_workers):
+        parent, child = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        parent.setblocking(False)
+        lobby.channels.append(parent)
+        lobby.rooms_per_worker.append(0)
+        lobby.backlog.append(deque())
+        workers.append(child)
+    return lobby, workers
+
+
+def join(lobby: Lobby, room: str) -> socket.socket:
+    """Route a pending client to room, return our end of it."""
+    ours, theirs = socket.socketpair()
+    timer = lobby.loop.call_later(60, lambda: None)
+    lobby.pending[theirs] = (FrameDecoder(), timer, bytearray())
+    lobby.route(theirs, room)
+    return ours
+
+
+def test_room_names_are_alphanumeric():
+    assert room_name("../../etc/passwd") == "etcpasswd"
+    assert room_name("Room 42!") == "Room42"
+    assert room_name("/..") == DEFAULT_ROOM
+    assert len(room_name("a" * 100)) == 32
+
+
+def test_rooms_stick_to_a_worker_and_free_their_route():
+    lobby, workers = lobby_with_workers(2)
+    clients = []
+    try:
+        clients += [join(lobby, "../red"), join(lobby, "blue"), join(lobby, "red")]
+        assert lobby.routes == {"red": [0, 2], "blue": [1, 1]}
+        packet, fds, _, _ = socket.recv_fds(workers[0], 1024, 1)
+        assert packet == b"C\x03red"
+        socket.socket(fileno=fds[0]).close()
+
+        # Worker 1 tells the room got its only client and emptied, the supervisor frees it
+        workers[1].send(b"E\x00\x00\x00\x01blue")
+        lobby.receive_worker(lobby.channels[1])
+        assert "blue" not in lobby.routes and lobby.rooms_per_worker == [1, 0]
+        socket.recv_fds(workers[1], 1024, 1)    # The handed over client
+        assert workers[1].recv(1024) == b"Fblue"
+    finally:
+        for sock in clients + workers + lobby.channels:
+            sock.close()
+        lobby.loop.close()
+
+
+def test_client_that_never_reaches_its_worker_rolls_back_the_route():
+    lobby, workers = lobby_with_workers(1)
+    workers[0].close()      # The worker died
+    try:
+        client = join(lobby, "red")
+        assert lobby.routes == {} and lobby.rooms_per_worker == [0]
+        assert not lobby.backlog[0]
+        client.close()
+    finally:
+        lobby.channels[0].close()
+        lobby.loop.close()
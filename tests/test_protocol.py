@@ -0,0 +1,86 @@
+import pytest
+from latency import MASK, NARROW_SHIFT, delta_us, widen_time
+from protocol import (
+    HELLO, HANDSHAKE, COUNT, NPLAYERS, RESET, SNAPSHOT, TAPS, PLAYER_NAME, FrameDecoder, ProtocolError,
+    MAX_LEGACY_LEN, encode, encode_legacy,
+)
+
+
+def binary_decoder() -> FrameDecoder:
+    decoder = FrameDecoder()
+    decoder.binary = True
+    return decoder
+
+
+def test_frames_split_across_reads():
+    messages = [(NPLAYERS, 3), (COUNT, 2, 17, 1234 << NARROW_SHIFT), (SNAPSHOT, ((1, 5, 10), (2, 6, 20))),
+                (TAPS, 99, 4, b"\x01\x02", (100, 200)), (PLAYER_NAME, "Pixel ✓")]
+    data = b"".join(map(encode, messages))
+    decoder = binary_decoder()
+    received = []
+    for i in range(len(data)):
+        decoder.feed(data[i:i + 1])
+        received += decoder.messages()
+    assert received == [messages[0], (COUNT, 2, 17, 1234), *messages[2:]]     # Tap time narrowed
+
+
+def test_partial_frame_waits_for_the_rest():
+    frame = encode((COUNT, 1, 2, 3 << NARROW_SHIFT))
+    decoder = binary_decoder()
+    decoder.feed(frame[:-1])
+    assert decoder.messages() == []
+    decoder.feed(frame[-1:])
+    assert decoder.messages() == [(COUNT, 1, 2, 3)]      # Tap time narrowed
+
+
+@pytest.mark.parametrize("frame", [
+    b"\x00\x02" + bytes([NPLAYERS]) + b"\x01",          # Fixed frame too short
+    b"\x00\x04" + bytes([RESET]) + b"abc",              # Fixed frame too long
+    b"\x00\x05" + bytes([SNAPSHOT]) + b"abcd",          # Not a whole number of scores
+    b"\x00\x05" + bytes([TAPS]) + b"abcd",              # Shorter than seed and first press
+])
+def test_bad_frame_length_raises(frame):
+    decoder = binary_decoder()
+    decoder.feed(frame)
+    with pytest.raises(ProtocolError):
+        decoder.messages()
+
+
+def test_bad_handshake_raises():
+    decoder = FrameDecoder()
+    decoder.feed(b"\x00XXXX\x01")
+    with pytest.raises(ProtocolError):
+        decoder.messages()
+
+
+def test_endless_legacy_message_raises():
+    decoder = FrameDecoder()
+    decoder.feed(b"COUNT-P1: 4&" + b"9" * MAX_LEGACY_LEN)
+    assert decoder.messages() == [(COUNT, 1, 4, 0)]
+    decoder.feed(b"9")
+    with pytest.raises(ProtocolError):
+        decoder.messages()
+
+
+def test_legacy_messages_then_handshake():
+    decoder = FrameDecoder()
+    decoder.feed(encode_legacy((NPLAYERS, 2)) + b"COUNT-P1: 4&COUNT-P2")
+    assert decoder.messages() == [(NPLAYERS, 2), (COUNT, 1, 4, 0)]
+    decoder.feed(b": 5&" + HELLO + encode((COUNT, 2, 6, 0)))
+    assert decoder.messages() == [(COUNT, 2, 5, 0), (HANDSHAKE, HELLO[-1]), (COUNT, 2, 6, 0)]
+
+
+def test_legacy_garbage_is_skipped():
+    decoder = FrameDecoder()
+    decoder.feed(b"\xff\xfe&COUNT-Px: 1&RESET&")
+    assert decoder.messages() == [(RESET,)]
+
+
+def test_count_tap_time_is_narrowed_and_widened():
+    decoder = binary_decoder()
+    tap_time = 0xFFFFFF00      # Close to the wrap of the wire clock
+    decoder.feed(encode((COUNT, 1, 2, tap_time)))
+    (_, _, _, narrow), = decoder.messages()
+    for now in (tap_time, tap_time + 3_000_000, tap_time - 1000):
+        assert abs(delta_us(widen_time(narrow, now & MASK), tap_time)) < 1 << NARROW_SHIFT
+    assert widen_time(0, 12345) == 0
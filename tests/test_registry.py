@@ -0,0 +1,66 @@
+import socket
+from array import array
+import pytest
+from registry import Registry
+
+
+@pytest.fixture
+def sockets():
+    pairs = [socket.socketpair() for _ in range(4)]
+    yield [a for a, _ in pairs]
+    for a, b in pairs:
+        a.close()
+        b.close()
+
+
+def test_lowest_free_id_is_reused(sockets):
+    registry = Registry()
+    p1, p2, p3 = (registry.add(sock, None) for sock in sockets[:3])
+    assert [p.player_id for p in (p1, p2, p3)] == [1, 2, 3]
+    registry.scores[1] = 7
+
+    assert registry.remove(p2) == []            # A hole, the slots stay
+    assert len(registry.scores) == 3 and sockets[1] not in registry
+    p4 = registry.add(sockets[3], None)
+    assert p4.player_id == 2 and p4.nickname == "P2"
+    assert registry.scores[1] == 0              # Fresh score in the reused slot
+
+
+def test_free_slots_at_the_end_are_dropped(sockets):
+    registry = Registry()
+    p1, p2, p3 = (registry.add(sock, None) for sock in sockets[:3])
+    registry.remove(p2)
+    assert registry.remove(p3) == [2, 1]
+    assert len(registry.scores) == len(registry.presses) == 1
+    assert registry.add(sockets[1], None).player_id == 2
+
+
+def test_host_slot_is_kept(sockets):
+    registry = Registry(host_player=True)
+    player = registry.add(sockets[0], None)
+    assert player.player_id == 2
+    assert registry.remove(player) == [1]
+    assert len(registry.scores) == 1
+
+
+def test_detached_player_keeps_its_slot(sockets):
+    registry = Registry()
+    player = registry.add(sockets[0], None)
+    registry.scores[0] = 5
+    registry.detach(player)
+    assert len(registry) == 0 and list(registry) == []
+    assert registry.by_token[player.token] is player
+    assert registry.add(sockets[1], None).player_id == 2
+
+    registry.attach(player, sockets[2], None)
+    assert registry.get(sockets[2]) is player
+    assert registry.scores[0] == 5 and len(registry) == 2
+
+
+def test_reset_scores(sockets):
+    registry = Registry()
+    for sock in sockets[:2]:
+        registry.add(sock, None)
+    registry.scores[:] = registry.presses[:] = array('I', [3, 4])
+    registry.reset_scores()
+    assert list(registry.scores) == list(registry.presses) == [0, 0]
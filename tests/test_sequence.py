@@ -0,0 +1,21 @@
+from sequence import BLOCK, BUTTONS, ButtonSequence
+
+
+def test_same_seed_same_buttons():
+    a, b = ButtonSequence(42), ButtonSequence(42, 3 * BLOCK)
+    assert [a[i] for i in range(3 * BLOCK)] == list(b.buttons[:3 * BLOCK])
+    assert set(b.buttons) <= set(range(1, BUTTONS + 1))
+    assert ButtonSequence(43).buttons != a.buttons[:BLOCK]
+
+
+def test_hits_counts_the_highlighted_presses():
+    sequence = ButtonSequence(7)
+    first = BLOCK - 3           # Across a block boundary, generated on demand
+    expected = ButtonSequence(7, 2 * BLOCK).buttons[first:first + 6]
+    assert sequence.hits(first, bytes(expected)) == 6
+
+    pressed = bytearray(expected)
+    pressed[0] = pressed[0] % BUTTONS + 1
+    pressed[4] = pressed[4] % BUTTONS + 1
+    assert sequence.hits(first, bytes(pressed)) == 4
+    assert sequence.hits(first, b"") == 0
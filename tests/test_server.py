@@ -0,0 +1,219 @@
+import socket
+import time
+from protocol import (
+    HELLO, CLOSED_BY_SERVER, MAX_SCORE, NICKNAME, NPLAYERS, PING, REJECT, RESUME, SEED, SESSION,
+    SPECTATE, STARTED_BY_CLIENT, TAPS, COUNT, FrameDecoder, encode,
+)
+from latency import MASK, clock_us
+from sequence import ButtonSequence
+from server import PRESSES_PER_POINT, SCORE_LIMIT, TAP_BURST
+from server import Server
+
+
+def start_server(n_clients: int) -> tuple[Server, list[socket.socket]]:
+    """A headless Server on localhost with n_clients binary clients joined."""
+    server = Server(ip_addr="127.0.0.1", port=0)
+    server.start_server()
+    port = server.server.getsockname()[1]
+    clients = [socket.create_connection(("127.0.0.1", port)) for _ in range(n_clients)]
+    for client in clients:
+        client.sendall(HELLO)
+    deadline = time.monotonic() + 2
+    while len(server.players) < n_clients and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(server.players) == n_clients
+    time.sleep(0.1)     # Let the joins and handshakes settle
+    return server, clients
+
+
+def wait_for(client: socket.socket, kind: int, decoder: FrameDecoder | None = None) -> list[tuple]:
+    """Messages a client gets up to the first of kind (socket.timeout if it never comes)."""
+    decoder = decoder or FrameDecoder()
+    messages = []
+    client.settimeout(2)
+    while not any(msg[0] == kind for msg in messages):
+        data = client.recv(4096)
+        assert data, "connection closed"
+        decoder.feed(data)
+        messages += decoder.messages()
+    return messages
+
+
+def test_idle_server_sleeps_and_shuts_down_fast():
+    server, clients = start_server(4)
+    try:
+        wakeups = server.loop.wakeups
+        time.sleep(0.5)
+        assert server.loop.wakeups == wakeups
+
+        start = time.perf_counter()
+        server.close_connection(close_clients=True)
+        assert time.perf_counter() - start < 0.5
+        assert not server.handle_connection_thread.is_alive()
+        for client in clients:
+            wait_for(client, CLOSED_BY_SERVER)
+    finally:
+        for client in clients:
+            client.close()
+
+
+def test_resume_moves_the_session_off_a_half_open_socket():
+    server, (old,) = start_server(1)
+    new = None
+    try:
+        (_, token), = (msg for msg in wait_for(old, SESSION) if msg[0] == SESSION)
+        server.players.scores[0] = 3
+
+        # The client saw its socket die, the server did not
+        new = socket.create_connection(("127.0.0.1", server.server.getsockname()[1]))
+        new.sendall(HELLO + encode((RESUME, token, 0)))
+        messages = wait_for(new, RESUME)
+        assert (NICKNAME, 1) in messages
+        assert [msg[1] for msg in messages if msg[0] == RESUME] == [token]
+
+        old.settimeout(2)
+        while old.recv(4096):
+            pass                    # Closed by the server
+        player, = server.players
+        assert player.player_id == 1 and player.sock is not None
+        assert server.players.scores[0] == 3 and server.n_players == 1
+    finally:
+        server.close_connection(close_clients=True)
+        old.close()
+        if new:
+            new.close()
+
+
+def test_client_input_is_bounded():
+    server, (client,) = start_server(1)
+    try:
+        decoder = FrameDecoder()
+        wait_for(client, SESSION, decoder)
+        client.sendall(encode((MAX_SCORE, 10 ** 9)) + encode((STARTED_BY_CLIENT,)))
+        messages = wait_for(client, SEED, decoder)
+        assert (MAX_SCORE, SCORE_LIMIT) in messages
+        (_, seed), = (msg for msg in messages if msg[0] == SEED)
+        assert len(server.sequence.buttons) < 4 * SCORE_LIMIT
+
+        # Presses far ahead of the ones taken are refused, not generated up to
+        client.sendall(encode((TAPS, seed, 10 ** 9, b"\x01", (0,))))
+        assert (REJECT, 0) in wait_for(client, REJECT, decoder)
+        assert server.players.presses[0] == 0
+        assert len(server.sequence.buttons) < 4 * SCORE_LIMIT
+    finally:
+        server.close_connection(close_clients=True)
+        client.close()
+
+
+def test_spectator_never_takes_a_slot():
+    server, (player,) = start_server(1)
+    spectator = None
+    try:
+        decoder = FrameDecoder()
+        wait_for(player, SESSION, decoder)
+        spectator = socket.create_connection(("127.0.0.1", server.server.getsockname()[1]))
+        spectator.sendall(HELLO + encode((SPECTATE,)))
+        messages = wait_for(spectator, NPLAYERS)
+        assert (NPLAYERS, 1) in messages and not any(msg[0] == NICKNAME for msg in messages)
+        assert len(server.spectators) == 1 and server.n_players == 1
+
+        # The player heard of nobody joining
+        player.sendall(encode((MAX_SCORE, 12)))
+        assert not any(msg[0] == NPLAYERS for msg in wait_for(player, MAX_SCORE, decoder))
+    finally:
+        server.close_connection(close_clients=True)
+        player.close()
+        if spectator:
+            spectator.close()
+
+
+def test_old_client_joins_after_the_grace():
+    server = Server(ip_addr="127.0.0.1", port=0)
+    server.start_server()
+    client = socket.create_connection(("127.0.0.1", server.server.getsockname()[1]))
+    try:
+        # Sends nothing before its nickname, which comes in ASCII
+        client.settimeout(2)
+        assert client.recv(4096).startswith(b"P1&")
+    finally:
+        server.close_connection(close_clients=True)
+        client.close()
+
+
+def test_binary_client_scores_only_checked_presses():
+    server, (client,) = start_server(1)
+    try:
+        decoder = FrameDecoder()
+        wait_for(client, SESSION, decoder)
+        client.sendall(encode((MAX_SCORE, 10)) + encode((STARTED_BY_CLIENT,)))
+        (_, seed), = (msg for msg in wait_for(client, SEED, decoder) if msg[0] == SEED)
+        buttons = bytes(ButtonSequence(seed, PRESSES_PER_POINT * 10).buttons)
+
+        # A COUNT once the race has a sequence skips the check
+        client.sendall(encode((COUNT, 1, 1, 0)))
+        assert (REJECT, 0) in wait_for(client, REJECT, decoder)
+
+        # Right presses, faked tap times far apart but all sent at once: only the burst counts
+        n = TAP_BURST + 10
+        client.sendall(encode((TAPS, seed, 0, buttons[:n], tuple(range(0, n * 10 ** 6, 10 ** 6)))))
+        assert (REJECT, 0) in wait_for(client, REJECT, decoder)
+        assert server.players.scores[0] == 0
+
+        # Misses cannot go on for ever
+        first = server.players.presses[0]
+        assert first == n
+        wrong = bytes(button % 4 + 1 for button in buttons[first:PRESSES_PER_POINT * 10 + 1])  # One too many
+        client.sendall(encode((TAPS, seed, first, wrong, (0,) * len(wrong))))
+        assert (REJECT, 0) in wait_for(client, REJECT, decoder)
+        assert server.players.presses[0] == first
+    finally:
+        server.close_connection(close_clients=True)
+        client.close()
+
+
+def test_stale_tap_pace_never_voids_a_batch():
+    server, (client,) = start_server(1)
+    try:
+        decoder = FrameDecoder()
+        wait_for(client, SESSION, decoder)
+        client.sendall(encode((MAX_SCORE, 10)) + encode((STARTED_BY_CLIENT,)))
+        (_, seed), = (msg for msg in wait_for(client, SEED, decoder) if msg[0] == SEED)
+
+        # From a race long ago, the clock wrapped around since: it reads as ahead of now
+        player, = server.players
+        player.tap_pace = (clock_us() + 10 ** 9) & MASK
+        client.sendall(encode((TAPS, seed, 0, bytes(ButtonSequence(seed).buttons[:1]), (0,))))
+        wait_for(client, COUNT, decoder)
+        assert server.players.scores[0] == 1
+    finally:
+        server.close_connection(close_clients=True)
+        client.close()
+
+
+def test_heartbeats_only_drop_racers():
+    server, (racer,) = start_server(1)
+    late = None
+    try:
+        server.heartbeat_timeout = 0.3
+        decoder = FrameDecoder()
+        wait_for(racer, SESSION, decoder)
+        racer.sendall(encode((MAX_SCORE, 10)) + encode((STARTED_BY_CLIENT,)))
+        (_, seed), = (msg for msg in wait_for(racer, SEED, decoder) if msg[0] == SEED)
+
+        # Joins mid-race: it waits for the next start and never PINGs meanwhile
+        late = socket.create_connection(server.server.getsockname())
+        late.sendall(HELLO)
+        wait_for(late, NICKNAME)
+
+        # A point starts the heartbeat checks, the racer keeps pinging
+        racer.sendall(encode((TAPS, seed, 0, bytes(ButtonSequence(seed).buttons[:1]), (0,))))
+        for _ in range(8):
+            racer.sendall(encode((PING, 0)))
+            time.sleep(0.1)
+        assert server.players.scores[0] == 1
+        assert server.n_players == 2 and len(server.players) == 2
+    finally:
+        server.close_connection(close_clients=True)
+        racer.close()
+        if late:
+            late.close()
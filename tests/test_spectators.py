@@ -0,0 +1,38 @@
+from netloop import EventLoop
+from protocol import (
+    MAX_SCORE, NPLAYERS, STARTED_BY_SERVER, COUNT, RESTARTED_BY_SERVER, SNAPSHOT, WINNER,
+)
+from spectators import SpectatorFeed
+
+
+class Watcher:
+    """Stands in for a spectator Connection, keeps what it is sent."""
+    def __init__(self):
+        self.messages = []
+
+    def queue(self, message, frame=None):
+        self.messages.append(message)
+
+    def flush(self):
+        pass
+
+
+def test_restart_is_not_a_spectator_phase():
+    loop = EventLoop()
+    try:
+        feed = SpectatorFeed(loop)
+        watcher = Watcher()
+        feed.add(watcher)
+        for message in ((MAX_SCORE, 10), (NPLAYERS, 2), (STARTED_BY_SERVER,), (COUNT, 1, 10, 0),
+                        (COUNT, 2, 4, 0), (WINNER, 1), (RESTARTED_BY_SERVER,)):
+            feed.message(message)
+        feed.tick()
+        assert (RESTARTED_BY_SERVER,) not in watcher.messages
+
+        # Joined after the restart: the last race, never the restart that sends players home
+        late = Watcher()
+        feed.add(late)
+        assert late.messages == [(MAX_SCORE, 10), (NPLAYERS, 2), (STARTED_BY_SERVER,),
+                                 (SNAPSHOT, ((1, 10, 0), (2, 4, 0))), (WINNER, 1)]
+    finally:
+        loop.close()